@@ -0,0 +1,120 @@
+import argparse
+import json
+import platform
+import time
+import tracemalloc
+
+from benchmark import corpus
+from src import pep8
+
+
+def _find_code(lines):
+    return pep8.find_code(lines, pep8.replace_tabs)
+
+
+def _replace_tabs(lines):
+    # the rule on its own, format_source runs it together with the other
+    # rules that change single lines
+    source = pep8.SourceFile(lines)
+    pep8._run_line_rules(source, [pep8.REGISTRY["replace_tabs"]])
+    return source.lines
+
+
+RULES = {
+    "scan": pep8.scan,
+    "find_code": _find_code,
+    "replace_tabs": _replace_tabs,
+    "move_imports_to_start": pep8.move_imports_to_start,
+    "split_imports": pep8.split_imports,
+    "format_newlines": pep8.format_newlines,
+    "remove_trailing_newlines": pep8.remove_trailing_newlines,
+    "split_long_comments": pep8.split_long_comments,
+    "apply_rules": pep8.apply_rules,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser("pep8 benchmark")
+    parser.add_argument("--lines", type=int, default=10000,
+                        help="lines of the generated module")
+    parser.add_argument("--def-density", type=float, default=0.05)
+    parser.add_argument("--class-density", type=float, default=0.01)
+    parser.add_argument("--comment-density", type=float, default=0.1)
+    parser.add_argument("--tab-ratio", type=float, default=0.0)
+    parser.add_argument("--imports", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-r", "--repeat", type=int, default=5,
+                        help="runs per rule, the fastest one is reported")
+    parser.add_argument("--rules", nargs="+", choices=list(RULES),
+                        default=list(RULES), help="rules to benchmark")
+    parser.add_argument("-o", "--output", type=str,
+                        help="save the results to this JSON file")
+    parser.add_argument("-b", "--baseline", type=str,
+                        help="compare the results with this JSON file")
+    args = parser.parse_args()
+
+    lines = corpus.generate_module(args.lines, args.def_density,
+                                   args.class_density, args.comment_density,
+                                   args.tab_ratio, args.imports, args.seed)
+    corpus_config = {key: getattr(args, key) for key in (
+        "lines", "def_density", "class_density", "comment_density",
+        "tab_ratio", "imports", "seed")}
+    results = {
+        "python": platform.python_version(),
+        "corpus": corpus_config,
+        "rules": {rule: benchmark_rule(RULES[rule], lines, args.repeat)
+                  for rule in args.rules},
+    }
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+    print_results(results, baseline)
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+
+
+def benchmark_rule(rule, lines, repeat=5):
+    # Rules are always given a fresh copy because some change the list
+    size = sum(len(line) + 1 for line in lines)
+    best = float("inf")
+    for _ in range(repeat):
+        lines_copy = list(lines)
+        start = time.perf_counter()
+        rule(lines_copy)
+        best = min(best, time.perf_counter() - start)
+
+    # Measured in a separate run, tracing allocations slows the rule down
+    lines_copy = list(lines)
+    tracemalloc.start()
+    rule(lines_copy)
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {
+        "seconds": best,
+        "lines_per_second": len(lines) / best if best else 0.0,
+        "mb_per_second": size / best / 1e6 if best else 0.0,
+        "peak_memory_bytes": peak_memory,
+    }
+
+
+def print_results(results, baseline=None):
+    print(f"{'rule':<26}{'ms':>10}{'lines/s':>14}{'MB/s':>9}"
+          f"{'peak KiB':>11}{'vs base':>10}")
+    for rule, result in results["rules"].items():
+        change = ""
+        if baseline and rule in baseline["rules"]:
+            ratio = result["seconds"] / baseline["rules"][rule]["seconds"]
+            change = f"{ratio:.2f}x"
+        print(f"{rule:<26}{result['seconds'] * 1000:>10.2f}"
+              f"{result['lines_per_second']:>14,.0f}"
+              f"{result['mb_per_second']:>9.2f}"
+              f"{result['peak_memory_bytes'] / 1024:>11,.0f}{change:>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+import random
+
+WORDS = ["value", "result", "item", "index", "count", "name", "data",
+         "buffer", "node", "total", "config", "handler", "state", "line"]
+MODULES = ["os", "sys", "re", "json", "math", "time", "random", "string",
+           "shutil", "logging", "itertools", "functools", "collections"]
+
+
+def generate_module(lines=1000, def_density=0.05, class_density=0.01,
+                    comment_density=0.1, tab_ratio=0.0, imports=10, seed=0):
+    """
+    Generates the lines of a syntactically valid module for benchmarks.
+
+    def_density and class_density are the chance that a new top-level
+    statement is a function or a class, comment_density the chance of a
+    comment line before a statement and tab_ratio the share of indented
+    blocks using tabs. Half of the imports are combined into lines with
+    several imports and scattered through the module.
+    """
+    rng = random.Random(seed)
+    body = []
+    import_lines = _imports(rng, imports)
+
+    while len(body) < lines:
+        if import_lines and rng.random() < 0.05:
+            body.append(import_lines.pop())
+            continue
+        roll = rng.random()
+        if roll < class_density:
+            body.extend(_class(rng, comment_density, tab_ratio))
+        elif roll < class_density + def_density:
+            body.extend(_function(rng, "", comment_density, tab_ratio))
+        else:
+            if rng.random() < comment_density:
+                body.append(_comment(rng, ""))
+            body.append(_statement(rng, ""))
+    return import_lines + body
+
+
+def _imports(rng, count):
+    modules = [rng.choice(MODULES) + str(idx) for idx in range(count)]
+    combined = count // 2
+    import_lines = []
+    for idx in range(0, combined, 3):
+        import_lines.append("import " + ", ".join(modules[idx:min(
+            idx + 3, combined)]))
+    import_lines.extend("import " + module for module in modules[combined:])
+    rng.shuffle(import_lines)
+    return import_lines
+
+
+def _indent(rng, indent, tab_ratio):
+    return indent + ("\t" if rng.random() < tab_ratio else "    ")
+
+
+def _comment(rng, indent):
+    # Some comments are longer than the line length limit
+    words = rng.randint(3, 30)
+    return indent + "# " + " ".join(rng.choice(WORDS) for _ in range(words))
+
+
+def _statement(rng, indent):
+    name = rng.choice(WORDS)
+    kind = rng.randint(0, 3)
+    if kind == 0:
+        return f"{indent}{name} = {rng.randint(0, 1000)}"
+    if kind == 1:
+        return f"{indent}{name} = '{rng.choice(WORDS)}\\t{rng.choice(WORDS)}'"
+    if kind == 2:
+        return f"{indent}{name} = [{name}, {rng.choice(WORDS)}]  # inline"
+    return f"{indent}print({name}, {rng.choice(WORDS)!r})"
+
+
+def _function(rng, indent, comment_density, tab_ratio, method=False):
+    body_indent = _indent(rng, indent, tab_ratio)
+    lines = []
+    if rng.random() < 0.2:
+        lines.append(indent + "@staticmethod" if method else
+                     indent + "@decorator")
+    args = "self" if method and not lines else ""
+    lines.append(f"{indent}def {rng.choice(WORDS)}_{rng.randint(0, 9999)}"
+                 f"({args}):")
+    for _ in range(rng.randint(1, 8)):
+        if rng.random() < comment_density:
+            lines.append(_comment(rng, body_indent))
+        lines.append(_statement(rng, body_indent))
+    return lines
+
+
+def _class(rng, comment_density, tab_ratio):
+    indent = _indent(rng, "", tab_ratio)
+    lines = [f"class {rng.choice(WORDS).title()}{rng.randint(0, 9999)}:"]
+    for _ in range(rng.randint(1, 5)):
+        lines.extend(_function(rng, indent, comment_density, tab_ratio,
+                               method=True))
+    return lines
@@ -1,51 +1,352 @@
 import argparse
+import asyncio
+import functools
+import logging
 import os
+import subprocess
+import sys
 
+import async_io
+import cache
+import check
 import folder_util
-import file_handler
+import git_util
+import log
+import parallel
 import pep8
+import profiler
+import server
+import watch
+
+logger = logging.getLogger("pep8.main")
 
 
 def main():
     parser = argparse.ArgumentParser("pep8 tool")
     parser.add_argument("-f", "--folder_path", type=str,
                         help="folder path", default="./test")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(),
+                        help="number of processes used for formatting, "
+                             "defaults to the number of CPUs")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="format every file even if it is unchanged "
+                             "since an earlier run")
+    parser.add_argument("--profile", action="store_true",
+                        help="print the slowest files and rules")
+    parser.add_argument("--profile-json", type=str, metavar="PATH",
+                        help="save the cost of every rule on every file "
+                             "to a JSON file")
+    parser.add_argument("--profile-prometheus", type=str, metavar="PATH",
+                        help="save the cost of every rule in the "
+                             "Prometheus text format")
+    verbosity = parser.add_mutually_exclusive_group()
+    verbosity.add_argument("-q", "--quiet", action="store_true",
+                           help="log only warnings and errors")
+    verbosity.add_argument("-v", "--verbose", action="store_true",
+                           help="log every change the rules make")
+    parser.add_argument("--log-json", action="store_true",
+                        help="log one JSON object per line")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("-i", "--in-place", action="store_true",
+                      help="overwrite the changed files in the folder "
+                           "instead of writing to the outputs folder")
+    mode.add_argument("--py-only", action="store_true",
+                      help="write only the formatted .py files to the "
+                           "outputs folder instead of copying the folder")
+    mode.add_argument("--check", action="store_true",
+                      help="only report the files that would be changed, "
+                           "exits with 1 if there are any")
+    mode.add_argument("--diff", action="store_true",
+                      help="print the changes as unified diffs instead of "
+                           "writing them, exits with 1 if there are any")
+    changes = parser.add_mutually_exclusive_group()
+    changes.add_argument("--changed-since", type=str, metavar="REF",
+                         help="format only the lines changed since the git "
+                              "ref and the untracked files")
+    changes.add_argument("--staged", action="store_true",
+                         help="format only the lines with staged changes")
+    parser.add_argument("--watch", action="store_true",
+                        help="keep running and format the .py files again "
+                             "whenever they change")
+    parser.add_argument("--exclude", action="append", default=[],
+                        metavar="GLOB",
+                        help="skip the files and folders matching the glob, "
+                             "can be given several times")
+    parser.add_argument("--no-gitignore", action="store_true",
+                        help="format the files ignored by .gitignore files "
+                             "too")
+    parser.add_argument("--select", type=rule_names, metavar="RULES",
+                        help="comma separated names of the rules to apply, "
+                             "all rules by default: "
+                             + ", ".join(pep8.REGISTRY))
+    parser.add_argument("--ignore", type=rule_names, metavar="RULES",
+                        default=(), help="comma separated names of rules "
+                                         "that aren't applied")
+    parser.add_argument("--split-large-files", action="store_true",
+                        help="format files of 4 MB and more in chunks in "
+                             "all processes instead of in one")
+    parser.add_argument("--io-jobs", type=int, metavar="N",
+                        help="read and write the files in N threads while "
+                             "they are formatted, for slow file systems "
+                             "like NFS")
+    parser.add_argument("--full-copy", action="store_true",
+                        help="copy every file into the output folder "
+                             "instead of linking the files the formatter "
+                             "doesn't change")
+    parser.add_argument("--keep", type=int, metavar="N",
+                        help="remove the oldest output folders, keeping "
+                             "the N newest ones")
+    parser.add_argument("--max-output-size", type=float, metavar="MB",
+                        help="remove the oldest output folders while the "
+                             "output folders take up more than MB "
+                             "megabytes")
+    parser.add_argument("--serve", type=str, nargs="?", const="-",
+                        metavar="SOCKET",
+                        help="format source text sent as JSON-RPC requests "
+                             "on stdin, or on a Unix socket if its path is "
+                             "given, instead of formatting a folder")
+    parser.add_argument("--timeout", type=float, default=10.0,
+                        help="seconds a request to the server may take, "
+                             "defaults to 10")
     args = parser.parse_args()
+    if args.watch and (args.changed_since or args.staged):
+        parser.error("--watch can't be used with --changed-since or "
+                     "--staged")
+    rules = None
+    if args.select or args.ignore:
+        try:
+            rules = pep8.select_rules(args.select, args.ignore)
+        except ValueError as e:
+            parser.error(str(e))
+
+    level = logging.INFO
+    if args.quiet:
+        level = logging.WARNING
+    elif args.verbose:
+        level = logging.DEBUG
+    # diffs and the files that would be changed are written to stdout
+    log.configure(level, args.log_json,
+                  sys.stderr if args.check or args.diff or args.serve
+                  else sys.stdout)
+
+    if args.serve:
+        serve(args.serve, args.jobs, args.timeout)
+        return
 
     folder_path = args.folder_path
     if not folder_path and os.path.isdir(folder_path):
-        print("Invalid folder path. Please provide a valid folder path.")
+        logger.error("Invalid folder path. Please provide a valid folder "
+                     "path.")
         exit()
 
     dir_path = os.path.dirname(os.path.realpath(__file__))
-    output_path = os.path.join(dir_path, "../outputs")
-
-    count = count_py_files_in_folder(folder_path)
-    if count:
-        output_path = folder_util.copy_folder_to_new_output_folder(folder_path,
-                                                                   output_path)
-        if output_path:
-            files = folder_util.find_py_files_in_subfolders(output_path)
-            process_files_with_pep8(files)
-
-
-def count_py_files_in_folder(folder_path):
-    files = folder_util.find_py_files_in_subfolders(folder_path)
-    count = len(files)
-    print(f"Found {count} .py file{'s' if count != 1 else ''}"
-          f" in the provided folder path")
-    print("Files:")
-    for file in files:
-        print(f"    {file}")
-    return count
-
-
-def process_files_with_pep8(files):
-    for file in files:
-        print(f"\nProcessing file: {file}")
-        lines = file_handler.read_from_file(file)
-        lines = pep8.apply_rules(lines)
-        file_handler.write_to_file(file, lines)
+    outputs_path = os.path.join(dir_path, "../outputs")
+    output_path = outputs_path
+
+    ranges = None
+    if args.changed_since or args.staged:
+        changes = find_changes(folder_path, args.changed_since, args.staged,
+                               not (args.check or args.diff))
+        files = iter(changes)
+        ranges = changes.get
+    else:
+        # The folder is walked while the files are formatted
+        files = folder_util.iter_py_files_in_subfolders(
+            folder_path, args.exclude, not args.no_gitignore)
+    if args.check or args.diff:
+        status = check_files(files, args.jobs, args.diff, ranges, rules,
+                             args.staged)
+        if not args.watch:
+            sys.exit(status)
+        watch_folder(folder_path, functools.partial(check_files, jobs=1,
+                                                    diff=args.diff,
+                                                    rules=rules),
+                     args.exclude, not args.no_gitignore)
+        return
+
+    destination = None
+    if args.in_place:
+        # the walk yields normalized paths, so every file is its own
+        # destination
+        destination = os.path.normpath
+    elif args.py_only:
+        output_path = folder_util.create_new_output_folder(output_path)
+        if not output_path:
+            return
+        destination = functools.partial(folder_util.mirror_path,
+                                        folder_path=folder_path,
+                                        output_path=output_path)
+    else:
+        if next(files, None) is None:
+            log_found_files(0)
+            return
+        output_path = folder_util.copy_folder_to_new_output_folder(
+            folder_path, output_path, not args.full_copy)
+        if not output_path:
+            return
+        if ranges is None:
+            files = folder_util.iter_py_files_in_subfolders(
+                output_path, args.exclude, not args.no_gitignore)
+        else:
+            changes = {folder_util.mirror_path(file, folder_path,
+                                               output_path): changes[file]
+                       for file in changes}
+            files = iter(changes)
+            ranges = changes.get
+
+    result_cache = None
+    if not args.no_cache:
+        result_cache = cache.ResultCache(
+            os.path.join(dir_path, "../.cache"),
+            {"rules": list(rules)} if rules is not None else None)
+    run_profiler = None
+    if args.profile or args.profile_json or args.profile_prometheus:
+        run_profiler = profiler.Profiler()
+    process_files_with_pep8(files, args.jobs, result_cache, destination,
+                            run_profiler, ranges, rules,
+                            args.split_large_files, args.io_jobs)
+    if not args.in_place and (args.keep is not None
+                              or args.max_output_size is not None):
+        folder_util.prune_output_folders(
+            outputs_path, args.keep,
+            None if args.max_output_size is None
+            else int(args.max_output_size * 1024 * 1024))
+    if args.watch:
+        if destination is None:
+            # the changes are formatted into the copy made above
+            destination = functools.partial(folder_util.mirror_path,
+                                            folder_path=folder_path,
+                                            output_path=output_path)
+        # a single file is formatted faster in this process than in a pool
+        watch_folder(folder_path, functools.partial(
+            process_files_with_pep8, jobs=1, result_cache=result_cache,
+            destination=destination, run_profiler=run_profiler, rules=rules),
+            args.exclude, not args.no_gitignore)
+    if result_cache:
+        result_cache.prune()
+    if run_profiler:
+        save_profile(run_profiler, args)
+
+
+def save_profile(run_profiler, args):
+    if args.profile:
+        print()
+        print(run_profiler.report())
+    if args.profile_json:
+        with open(args.profile_json, "w") as file:
+            file.write(run_profiler.to_json())
+    if args.profile_prometheus:
+        with open(args.profile_prometheus, "w") as file:
+            file.write(run_profiler.to_prometheus())
+
+
+def serve(socket_path, jobs=None, timeout=None):
+    # Serves until stdin is closed or the process is interrupted, "-" serves
+    # on stdin and stdout
+    if socket_path == "-":
+        coroutine = server.serve_stdio(jobs=jobs, timeout=timeout)
+    else:
+        coroutine = server.serve_socket(socket_path, jobs=jobs,
+                                        timeout=timeout)
+    try:
+        asyncio.run(coroutine)
+    except KeyboardInterrupt:
+        logger.info("Server stopped")
+
+
+def watch_folder(folder_path, process, exclude=(), gitignore=True):
+    # Calls process with every batch of changed files until interrupted,
+    # the imports and caches stay loaded between the batches
+    with watch.Watcher(folder_path, exclude=exclude,
+                       gitignore=gitignore) as watcher:
+        logger.info("Watching %s for changes%s", folder_path,
+                    " by polling" if watcher.polling else "")
+        try:
+            for batch in watcher.batches():
+                process(batch)
+        except KeyboardInterrupt:
+            logger.info("Stopped watching")
+
+
+def find_changes(folder_path, ref=None, staged=False, skip_unstaged=False):
+    # The changed .py files mapped to their changed lines, exits if git
+    # cannot tell. With staged and skip_unstaged the files that also have
+    # unstaged changes are left out, the staged line numbers don't fit them
+    # and formatting them would take the unstaged changes along.
+    try:
+        changes = git_util.changed_lines(folder_path, ref, staged)
+        if staged and skip_unstaged:
+            unstaged = git_util.unstaged_files(folder_path)
+            for file in sorted(unstaged & changes.keys()):
+                logger.warning("Skipping %s, it has unstaged changes", file)
+                del changes[file]
+        return changes
+    except subprocess.CalledProcessError as e:
+        logger.error("Could not get the changes from git: %s",
+                     e.stderr.strip().partition("\n")[0])
+    except OSError as e:
+        logger.error("Could not run git: %s", e)
+    sys.exit(2)
+
+
+def rule_names(value):
+    return tuple(name.strip() for name in value.split(",") if name.strip())
+
+
+def check_files(files, jobs=None, diff=False, ranges=None, rules=None,
+                staged=False):
+    # Returns the exit status, 1 if any file would be changed or failed
+    changed = 0
+    failed = 0
+    results = check.check_files(files, jobs, diff, ranges, rules, staged)
+    for file, file_changed, file_diff, error in results:
+        if error:
+            logger.error("Error checking file %s: %s", file, error)
+            failed += 1
+        elif file_changed:
+            changed += 1
+            if diff:
+                print(file_diff, end="")
+            else:
+                print(f"Would reformat {file}")
+    logger.info("%d file%s would be reformatted%s", changed,
+                "s" if changed != 1 else "",
+                f", {failed} failed" if failed else "")
+    return 1 if changed or failed else 0
+
+
+def log_found_files(count):
+    logger.info("Found %d .py file%s in the provided folder path", count,
+                "s" if count != 1 else "")
+
+
+def process_files_with_pep8(files, jobs=None, result_cache=None,
+                            destination=None, run_profiler=None, ranges=None,
+                            rules=None, split=False, io_jobs=None):
+    # With io_jobs the files are read and written by async_io while they
+    # are formatted
+    count = 0
+    failed = []
+    if io_jobs:
+        results = async_io.format_files(files, jobs, io_jobs, result_cache,
+                                        destination, run_profiler, ranges,
+                                        rules, split)
+    else:
+        results = parallel.format_files(files, jobs, result_cache,
+                                        destination, run_profiler, ranges,
+                                        rules, split)
+    for file, file_log, error in results:
+        count += 1
+        logger.info("Processing file: %s", file)
+        # the log was formatted by the worker
+        sys.stdout.write(file_log)
+        if error:
+            logger.error("Error formatting file %s: %s", file, error)
+            failed.append(file)
+    log_found_files(count)
+    if failed:
+        logger.warning("Failed to format %d file%s: %s", len(failed),
+                       "s" if len(failed) != 1 else "", ", ".join(failed))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,223 @@
+import asyncio
+import collections
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+try:
+    from . import file_handler
+    from . import log
+    from . import parallel
+except ImportError:
+    import file_handler
+    import log
+    import parallel
+
+logger = logging.getLogger("pep8.io")
+
+STAGES = ("read", "format", "write")
+
+
+class Pipeline:
+    """
+    Formats files with the reads and writes overlapping the formatting.
+
+    Files are read and written in io_jobs threads, at most io_jobs reads
+    and writes are in progress at once, and formatted in jobs processes.
+    Up to io_jobs + 2 * jobs files are read ahead of the file whose result
+    is yielded next, and a file is written as soon as it is formatted while
+    the next files are formatted. stats has, for every stage, the seconds
+    spent in it ("busy") and the seconds the results waited for it
+    ("waited"): a run waiting mostly for reads and writes is I/O-bound, one
+    waiting mostly for formatting is CPU-bound. close() cancels the files
+    not yet formatted and waits for the writes in progress.
+    """
+
+    def __init__(self, jobs=None, io_jobs=16, cache=None, destination=None,
+                 ranges=None, rules=None, profile=False, split=False):
+        self.jobs = jobs or os.cpu_count() or 1
+        self.io_jobs = io_jobs
+        self.cache = cache
+        self.destination = destination
+        self.ranges = ranges
+        self.rules = rules
+        self.split_jobs = self.jobs if split else None
+        self.profile = profile
+        self.records = []
+        self.stats = {stage: {"busy": 0.0, "waited": 0.0}
+                      for stage in STAGES}
+        self._io = ThreadPoolExecutor(max_workers=io_jobs,
+                                      thread_name_prefix="pep8-io")
+        self._cpu = ProcessPoolExecutor(
+            max_workers=self.jobs,
+            initializer=parallel.init_slots if split else None,
+            initargs=(multiprocessing.Semaphore(self.jobs),) if split else ())
+        self._tasks = set()
+
+    async def results(self, files):
+        # Yields (file, log, error) for every file in the order of files,
+        # files can be a generator, it is advanced in an I/O thread
+        loop = asyncio.get_running_loop()
+        files = iter(files)
+        pending = collections.deque()
+        window = self.io_jobs + 2 * self.jobs
+        while True:
+            file = await loop.run_in_executor(self._io, next, files, None)
+            if file is None:
+                break
+            pending.append(self._start(file))
+            if len(pending) >= window:
+                yield await self._finish(pending.popleft())
+        while pending:
+            yield await self._finish(pending.popleft())
+
+    def _start(self, file):
+        read = self._task(self._read(file))
+        formatted = self._task(self._format_file(file, read))
+        return file, read, formatted, self._task(self._write(file, read,
+                                                             formatted))
+
+    def _task(self, coroutine):
+        task = asyncio.ensure_future(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def _finish(self, job):
+        # Waits for the stages of a file one after the other, the time
+        # spent waiting for each of them is added to its waited time
+        file, *stages = job
+        for stage, task in zip(STAGES, stages):
+            start = time.perf_counter()
+            await asyncio.wait([task])
+            self.stats[stage]["waited"] += time.perf_counter() - start
+        file_log, error = stages[-1].result()
+        return file, file_log, error
+
+    async def _run(self, stage, executor, function, *args):
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        try:
+            return await loop.run_in_executor(executor, function, *args)
+        finally:
+            self.stats[stage]["busy"] += time.perf_counter() - start
+
+    async def _read(self, file):
+        # Returns the content and the cached result, None if there is none
+        return await self._run("read", self._io, self._read_file, file)
+
+    def _read_file(self, file):
+        with open(file, "rb") as f:
+            data = f.read()
+        if not self._cached(file, data):
+            return data, None
+        return data, self.cache.get(data)
+
+    def _cached(self, file, data):
+        # Like in parallel.format_file, results for ranges and for large
+        # files aren't cached
+        if self.cache is None or len(data) >= file_handler.MMAP_MIN_SIZE:
+            return False
+        return self.ranges is None or self.ranges(file) is None
+
+    async def _format_file(self, file, read):
+        # Returns (formatted, log, error), formatted is None after an error
+        try:
+            data, cached = await read
+        except Exception as e:
+            return None, "", f"{type(e).__name__}: {e}"
+        if cached is not None:
+            with log.capture(file, log.logger.getEffectiveLevel(),
+                             log.json_format()) as file_log:
+                logger.info("Unchanged since an earlier run, using the "
+                            "cached result")
+            return cached, file_log.getvalue(), None
+        formatted, file_log, error, records = await self._run(
+            "format", self._cpu, parallel.format_data, file, data,
+            self.ranges(file) if self.ranges else None, self.profile,
+            log.logger.getEffectiveLevel(), log.json_format(), self.rules,
+            self.split_jobs)
+        if records:
+            self.records.extend(records)
+        return formatted, file_log, error
+
+    async def _write(self, file, read, formatted):
+        # Returns (log, error) with the log of all stages
+        formatted, file_log, error = await formatted
+        if formatted is None:
+            return file_log, error
+        data, cached = read.result()
+        destination = self.destination(file) if self.destination else None
+        try:
+            written = await self._run(
+                "write", self._io, self._write_file, file, destination,
+                formatted, data if cached is None
+                and self._cached(file, data) else None)
+        except Exception as e:
+            return file_log, f"{type(e).__name__}: {e}"
+        if written and destination is not None:
+            with log.capture(file, log.logger.getEffectiveLevel(),
+                             log.json_format()) as write_log:
+                parallel.logger.info("Written to %s", destination)
+            file_log += write_log.getvalue()
+        return file_log, None
+
+    def _write_file(self, file, destination, formatted, data=None):
+        # The result is cached for data unless it is None
+        if self.cache and data is not None:
+            self.cache.put(data, formatted)
+        if destination is None:
+            return file_handler.write_bytes(file, formatted)
+        return file_handler.write_bytes(destination, formatted, atomic=True)
+
+    async def close(self):
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        loop = asyncio.get_running_loop()
+        # writes that already started are finished, never left half done
+        await loop.run_in_executor(None, self._io.shutdown)
+        self._cpu.shutdown(wait=True, cancel_futures=True)
+
+    def log_stats(self, count):
+        busy = {stage: self.stats[stage]["busy"] for stage in STAGES}
+        waited = {stage: self.stats[stage]["waited"] for stage in STAGES}
+        io_waited = waited["read"] + waited["write"]
+        logger.info("Read %d file%s in %.2f s, formatted them in %.2f s and "
+                    "wrote them in %.2f s", count, "s" if count != 1 else "",
+                    busy["read"], busy["format"], busy["write"])
+        logger.info("Waited %.2f s for reads, %.2f s for formatting and "
+                    "%.2f s for writes: %s", waited["read"],
+                    waited["format"], waited["write"],
+                    "I/O-bound" if io_waited > waited["format"]
+                    else "CPU-bound", extra={"counters": self.stats})
+
+
+def format_files(files, jobs=None, io_jobs=16, cache=None, destination=None,
+                 file_profiler=None, ranges=None, rules=None, split=False):
+    # Yields (file, log, error) like parallel.format_files, running a
+    # Pipeline on an event loop of its own while the next result is
+    # awaited. The stats are logged at the end.
+    loop = asyncio.new_event_loop()
+    pipeline = Pipeline(jobs, io_jobs, cache, destination, ranges, rules,
+                        file_profiler is not None, split)
+    results = pipeline.results(files)
+    count = 0
+    try:
+        while True:
+            try:
+                result = loop.run_until_complete(results.__anext__())
+            except StopAsyncIteration:
+                break
+            count += 1
+            yield result
+        pipeline.log_stats(count)
+    finally:
+        loop.run_until_complete(results.aclose())
+        loop.run_until_complete(pipeline.close())
+        loop.run_until_complete(loop.shutdown_default_executor())
+        loop.close()
+        if file_profiler is not None:
+            file_profiler.records.extend(pipeline.records)
@@ -0,0 +1,100 @@
+import hashlib
+import json
+import os
+import tempfile
+
+try:
+    from . import chunks
+    from . import file_handler
+    from . import line_buffer
+    from . import pep8
+except ImportError:
+    import chunks
+    import file_handler
+    import line_buffer
+    import pep8
+
+DEFAULT_MAX_SIZE = 100 * 1024 * 1024
+
+# The modules the formatted content depends on: the rules, the line buffer
+# they edit, the joining of chunks and the decoding and encoding of files
+FORMATTER_MODULES = (pep8, line_buffer, chunks, file_handler)
+
+
+def formatter_version():
+    # The source of the modules making the formatted content is part of
+    # every key, so changing one of them invalidates all results formatted
+    # with the old code
+    digest = hashlib.sha256()
+    for module in FORMATTER_MODULES:
+        with open(module.__file__, "rb") as file:
+            digest.update(file.read())
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """
+    On-disk cache of formatted files.
+
+    Every entry is a file in the cache folder named after the hash of the
+    unformatted content, the formatter version and the rule configuration,
+    and holds the formatted content. Entries are touched when they are
+    used, prune() removes the least recently used entries until the cache
+    is smaller than max_size bytes.
+    """
+
+    def __init__(self, path, config=None, max_size=DEFAULT_MAX_SIZE):
+        self.path = path
+        self.max_size = max_size
+        self._prefix = (formatter_version()
+                        + json.dumps(config or {}, sort_keys=True)).encode()
+        os.makedirs(path, exist_ok=True)
+
+    def _entry_path(self, content):
+        key = hashlib.sha256(self._prefix + content).hexdigest()
+        return os.path.join(self.path, key)
+
+    def get(self, content):
+        # Returns the formatted content or None if content isn't cached
+        entry_path = self._entry_path(content)
+        try:
+            with open(entry_path, "rb") as file:
+                formatted = file.read()
+            os.utime(entry_path)
+        except OSError:
+            return None
+        return formatted
+
+    def put(self, content, formatted):
+        # Written to a temporary file first so workers formatting the same
+        # content never see a partially written entry
+        fd, tmp_path = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as file:
+                file.write(formatted)
+            os.replace(tmp_path, self._entry_path(content))
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def prune(self):
+        entries = []
+        total_size = 0
+        with os.scandir(self.path) as it:
+            for entry in it:
+                if entry.is_file():
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+                    total_size += stat.st_size
+        entries.sort()
+        removed = 0
+        for mtime, size, path in entries:
+            if total_size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total_size -= size
+            removed += 1
+        return removed
@@ -0,0 +1,64 @@
+import difflib
+import functools
+import logging
+
+try:
+    from . import file_handler
+    from . import git_util
+    from . import log
+    from . import parallel
+    from . import pep8
+except ImportError:
+    import file_handler
+    import git_util
+    import log
+    import parallel
+    import pep8
+
+
+def check_file(file, ranges=None, diff=False, rules=None, staged=False):
+    # Formats the file in memory and returns (file, changed, diff, error),
+    # the diff is only built if asked for. Nothing is written. With ranges
+    # only the changes touching those (first, last) lines count, rules are
+    # the names of the rules to apply. With staged the content staged in
+    # git is checked instead of the file.
+    try:
+        if staged:
+            data = git_util.staged_content(file)
+        else:
+            with open(file, 'rb') as f:
+                data = f.read()
+        lines, encoding, newline = file_handler.decode(data, ranges is None)
+        original = lines
+        if ranges is not None:
+            lines = [line.rstrip() for line in original]
+        # only the result of the check is reported
+        with log.capture(file, logging.CRITICAL):
+            lines = list(pep8.format_source(lines, rules=rules).lines)
+        if ranges is not None:
+            lines = git_util.restrict_changes(original, lines, ranges)
+    except Exception as e:
+        return file, False, "", f"{type(e).__name__}: {e}"
+
+    formatted = file_handler.encode(lines, encoding, newline)
+    # bytes comparison stops at the first differing byte
+    if formatted == data:
+        return file, False, "", None
+    if not diff:
+        return file, True, "", None
+    diff_lines = difflib.unified_diff(
+        data.decode(encoding).splitlines(keepends=True),
+        formatted.decode(encoding).splitlines(keepends=True),
+        fromfile=file, tofile=file)
+    return file, True, "".join(diff_lines), None
+
+
+def check_files(files, jobs=None, diff=False, ranges=None, rules=None,
+                staged=False):
+    # Yields (file, changed, diff, error) for every file in order, ranges is
+    # called with every file to get its changed lines like in
+    # parallel.format_files
+    worker = functools.partial(check_file, diff=diff, rules=rules,
+                               staged=staged)
+    items = ((file, ranges(file) if ranges else None) for file in files)
+    return parallel.map_files(worker, items, jobs)
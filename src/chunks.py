@@ -0,0 +1,257 @@
+import functools
+import logging
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    from . import log
+    from . import pep8
+    from . import profiler
+except ImportError:
+    import log
+    import pep8
+    import profiler
+
+logger = logging.getLogger("pep8.chunks")
+
+# Files at least this large are split when splitting is enabled
+SPLIT_MIN_SIZE = 4 * 1024 * 1024
+# Chunks are never smaller than this, they wouldn't be worth a process
+MIN_CHUNK_LINES = 2000
+
+# A line that can start a top level statement. else, elif, except and
+# finally continue the statement above, and a string would be taken for
+# the docstring of its chunk.
+_STATEMENT_START = re.compile(
+    r"(?!(?:else|elif|except|finally)\b)(?![rRbBuUfF]{0,2}['\"])[A-Za-z_@]")
+# The end of a line the next line continues
+_CONTINUED = ("\\", "(", "[", "{", ",")
+
+HEADER, FUTURE_IMPORTS, IMPORTS, TYPE_CHECKING_BLOCKS, BODY = range(5)
+
+
+def format_source(lines, jobs, file_profiler=None, rules=None):
+    """
+    Formats the lines of a large file in chunks in jobs processes.
+
+    The file is cut into chunks of whole top level statements, every chunk
+    is formatted on its own with the imports moved to its start, and the
+    chunks are joined again with the imports of all chunks below the
+    header of the file. Where two chunks meet the blank lines above a
+    definition are counted again and the blank lines at the end of the
+    file are removed last. The result is the same as from
+    pep8.format_source, which is used instead when this returns None:
+    when the file is too small to split, a chunk can't be parsed on its
+    own or has an "if TYPE_CHECKING:" block without the import of
+    TYPE_CHECKING.
+    """
+    cuts = _cut_points(lines, jobs * 2)
+    if not cuts:
+        return None
+    names = tuple(pep8.REGISTRY) if rules is None else tuple(rules)
+    bounds = [0] + cuts + [len(lines)]
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        results = list(executor.map(
+            functools.partial(_format_chunk, names=names,
+                              log_level=log.logger.getEffectiveLevel(),
+                              profile=file_profiler is not None,
+                              file=getattr(file_profiler, "file", None)),
+            (lines[start:end] for start, end in zip(bounds, bounds[1:])),
+            range(len(cuts) + 1), [False] * len(cuts) + [True]))
+    if any(result is None for result in results):
+        logger.debug("A chunk can't be parsed on its own, formatting the "
+                     "whole file at once")
+        return None
+
+    source = pep8.SourceFile([])
+    for _, _, parse_count, counters, records, log_records in results:
+        for record in log_records:
+            logger.handle(record)
+        if file_profiler is not None:
+            file_profiler.records.extend(records)
+        source.parse_count += parse_count
+        source.counters.update(counters)
+
+    joined = list(results[0][0][HEADER])
+    for group in (FUTURE_IMPORTS, IMPORTS, TYPE_CHECKING_BLOCKS):
+        for segments, *_ in results:
+            joined.extend(segments[group])
+    for segments, blank_lines, *_ in results:
+        if "format_newlines" in names:
+            _join_blank_lines(source, joined, segments[BODY], blank_lines)
+        joined.extend(segments[BODY])
+    source.update(joined)
+    if "remove_trailing_newlines" in names:
+        if file_profiler is None:
+            pep8._remove_trailing_newlines(source)
+        else:
+            file_profiler.run("remove_trailing_newlines",
+                              pep8._remove_trailing_newlines, source)
+    logger.debug("Formatted %d lines in %d chunks", len(lines), len(results))
+    return source
+
+
+def _cut_points(lines, count):
+    # Indexes of lines starting top level statements that cut the lines in
+    # at most count chunks of about the same size. The statement above must
+    # have ended, which can only be told for sure by parsing the chunks.
+    size = max(len(lines) // count, MIN_CHUNK_LINES)
+    cuts = []
+    idx = size
+    while idx <= len(lines) - MIN_CHUNK_LINES:
+        if _STATEMENT_START.match(lines[idx]) and _ends_statement(lines,
+                                                                  idx):
+            cuts.append(idx)
+            idx += size
+        else:
+            idx += 1
+    return cuts
+
+
+def _ends_statement(lines, idx):
+    # Whether the last line of code above line idx may end a statement, a
+    # decorator belongs to the definition below it
+    for line in reversed(lines[max(idx - 100, 0):idx]):
+        stripped = line.strip()
+        if stripped and not stripped.startswith("#"):
+            return not (line.startswith("@") or line.endswith(_CONTINUED))
+    return True
+
+
+def _format_chunk(lines, position, last, names, log_level=logging.INFO,
+                  profile=False, file=None):
+    # Runs in a worker process. Returns the segments of the formatted chunk
+    # (see HEADER to BODY), the number of blank lines the first definition
+    # of the body needs above it if the body starts with one, the parse
+    # count, the counters, the profiler records and the log records. Returns
+    # None if the chunk can't be parsed or has an "if TYPE_CHECKING:" block
+    # it can't tell whether to move.
+    state = {"header_end": 0, "groups": ((), (), ())}
+
+    def move_imports(source):
+        tree = source.tree
+        if tree is None:
+            return
+        body = tree.body
+        header_end = 0
+        if position == 0:
+            header_end = pep8._header_end(body)
+            if not last and len(body) <= (1 if body and pep8._is_docstring(
+                    body[0]) else 0):
+                # the header goes on until the first statement, which is in
+                # the next chunk
+                header_end = len(source.lines)
+        state["header_end"] = header_end
+        state["groups"] = pep8._top_level_imports(body)
+        # a block whose TYPE_CHECKING isn't imported in this chunk might
+        # be imported in another one
+        moved = set(state["groups"][2])
+        state["unsure"] = any(
+            pep8._type_checking_name(node) is not None
+            and node.lineno not in moved for node in body)
+        pep8._move_imports_to_start(source, header_end)
+
+    file_profiler = profiler.Profiler(file) if profile else None
+    with log.collect(log_level) as log_records:
+        source = pep8.SourceFile(lines)
+        for name, rule in pep8.schedule(tuple(
+                name for name in names
+                if name != "remove_trailing_newlines")):
+            if name == "move_imports_to_start":
+                rule = move_imports
+            if file_profiler is None:
+                rule(source)
+            else:
+                file_profiler.run(name, rule, source)
+        if source.tree is None or state.get("unsure"):
+            return None
+
+    segments = _segments(source, state["header_end"], state["groups"])
+    if segments is None:
+        return None
+    blank_lines = None
+    if "format_newlines" in names:
+        blank_lines = _first_definition(source, len(source.lines)
+                                        - len(segments[BODY]))
+    return (segments, blank_lines, source.parse_count, dict(source.counters),
+            file_profiler.records if file_profiler is not None else None,
+            log_records)
+
+
+def _segments(source, header_end, groups):
+    # Splits the lines into the segments HEADER to BODY by the index each
+    # line had when the chunk was parsed. Lines the rules added have none,
+    # blank lines and comments belong to the line below them (a trailing
+    # comment moved above its line), other lines and the lines at the end
+    # to the line above (a split import). Returns None if the segments are
+    # mixed up.
+    lines = source.lines
+    segment_of = {}
+    for segment, numbers in zip((FUTURE_IMPORTS, IMPORTS,
+                                 TYPE_CHECKING_BLOCKS), groups):
+        for number in numbers:
+            segment_of[number - 1] = segment
+    labels = []
+    for idx, line in enumerate(lines):
+        origin = lines.origin(idx)
+        if origin is None:
+            labels.append(None)
+        elif origin < header_end:
+            labels.append(HEADER)
+        else:
+            labels.append(segment_of.get(origin, BODY))
+
+    following = None
+    for idx in range(len(labels) - 1, -1, -1):
+        line = lines[idx].strip()
+        if labels[idx] is None and (not line or line.startswith("#")):
+            labels[idx] = following
+        following = labels[idx]
+    previous = HEADER
+    for idx, label in enumerate(labels):
+        if label is None:
+            labels[idx] = previous
+        elif label < previous:
+            return None
+        previous = labels[idx]
+
+    segments = [[] for _ in range(BODY + 1)]
+    for line, label in zip(lines, labels):
+        segments[label].append(line)
+    return segments
+
+
+def _first_definition(source, start):
+    # The number of blank lines required above the first line of code from
+    # start on if it starts a top level definition, lines added above it
+    # by the rules are skipped
+    lines = source.lines
+    idx = start
+    while idx < len(lines) and not lines[idx].strip():
+        idx += 1
+    while idx < len(lines) and lines.origin(idx) is None:
+        idx += 1
+    blank_lines, _ = pep8._find_definitions(source, methods=False)
+    return blank_lines.get(idx)
+
+
+def _join_blank_lines(source, joined, body, blank_lines):
+    # The blank lines where body is added to joined, like format_newlines
+    # counts them when body starts with a definition
+    pending = 0
+    while pending < len(joined) and not joined[len(joined) - 1 - pending]:
+        pending += 1
+    leading = 0
+    while leading < len(body) and not body[leading]:
+        leading += 1
+    if blank_lines is None or leading == len(body):
+        return
+    code_above = pending < len(joined)
+    count = pending + leading
+    new_count = blank_lines if code_above or blank_lines == 1 else 0
+    if new_count == count:
+        return
+    pep8._count_blank_lines(source, new_count - count)
+    del joined[len(joined) - pending:]
+    del body[:leading]
+    joined.extend([""] * new_count)
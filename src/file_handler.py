@@ -1,14 +1,251 @@
+import array
+import bisect
+import filecmp
+import io
+import itertools
+import mmap
+import os
+import shutil
+import tempfile
+import tokenize
+
+# Files at least this large are read with map_lines() when formatting
+MMAP_MIN_SIZE = 64 * 1024 * 1024
+
+# bytes str.rstrip() removes from the end of an utf-8 line, besides the
+# non-ASCII whitespace
+_WHITESPACE = frozenset(b" \t\x0b\x0c\r\x1c\x1d\x1e\x1f")
+# lines MappedLines decodes at once when iterating
+_BLOCK = 4096
+
+
 def read_from_file(filename):
-    file = open(filename, 'r')
-    list1=[]
-    for line in file:
-        list1.append(line.rstrip())
-    file.close()
+    with open(filename, 'rb') as file:
+        data = file.read()
+    return decode(data)[0]
+
+
+def write_to_file(filename, list1, encoding="utf-8", newline="\n"):
+    return write_bytes(filename, encode(list1, encoding, newline))
+
+
+def replace_file(filename, list1, encoding="utf-8", newline="\n"):
+    return write_bytes(filename, encode(list1, encoding, newline),
+                       atomic=True)
+
+
+def decode(data, strip=True):
+    # Returns the lines without trailing whitespace (unless strip is
+    # False), the encoding and the newline of a file's content. The encoding
+    # comes from the BOM or the PEP 263 coding cookie and is utf-8-sig if
+    # the file starts with a BOM.
+    try:
+        encoding, _ = tokenize.detect_encoding(io.BytesIO(data).readline)
+    except SyntaxError:
+        encoding = "utf-8"
+    content = data.decode(encoding)
+    return split_lines(content, strip), encoding, detect_newline(content)
+
+
+def encode(list1, encoding="utf-8", newline="\n"):
+    return "".join(line + newline for line in list1).encode(encoding)
+
+
+def detect_newline(content):
+    # The newline the content uses first, "\n" if it has none
+    idx = content.find("\n")
+    if idx > 0 and content[idx - 1] == "\r":
+        return "\r\n"
+    if "\r" in (content[:idx] if idx != -1 else content):
+        return "\r"
+    return "\n"
+
+
+def split_lines(content, strip=True):
+    # Lines without trailing whitespace, any newline style ends a line
+    if "\r" in content:
+        content = content.replace("\r\n", "\n").replace("\r", "\n")
+    list1 = content.split("\n")
+    if strip:
+        list1 = [line.rstrip() for line in list1]
+    if list1[-1] == "":
+        list1.pop()
     return list1
 
 
-def write_to_file(filename, list1):
-    file = open(filename, 'w')
-    for line in list1:
-        file.write(line + "\n")
-    file.close()
+def write_bytes(filename, data, atomic=False):
+    # Nothing is written if the file already has this content, returns
+    # whether the file was written. An atomic write goes to a temporary file
+    # in the same folder that is renamed over the file, so the file is never
+    # left partially written. A hard linked file is always replaced, so the
+    # other links keep their content.
+    try:
+        stat = os.stat(filename)
+        if stat.st_size == len(data):
+            with open(filename, 'rb') as file:
+                if file.read() == data:
+                    return False
+        exists = True
+        atomic = atomic or stat.st_nlink > 1
+    except FileNotFoundError:
+        exists = False
+
+    if not atomic:
+        with open(filename, 'wb') as file:
+            file.write(data)
+        return True
+
+    _replace(filename, exists, lambda file: file.write(data))
+    return True
+
+
+def _replace(filename, exists, write):
+    # Calls write with a temporary file in the folder of filename and
+    # renames it over filename
+    folder = os.path.dirname(filename) or "."
+    os.makedirs(folder, exist_ok=True)
+    fd, tmp_filename = tempfile.mkstemp(dir=folder, suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            write(file)
+        if exists:
+            shutil.copymode(filename, tmp_filename)
+        os.replace(tmp_filename, filename)
+    except BaseException:
+        os.remove(tmp_filename)
+        raise
+
+
+def map_lines(filename):
+    # MappedLines of the file, None if the file is empty or isn't utf-8
+    # with "\n" newlines
+    with open(filename, 'rb') as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return None
+        data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        encoding, _ = tokenize.detect_encoding(data.readline)
+    except SyntaxError:
+        encoding = "utf-8"
+    if encoding != "utf-8" or data.find(b"\r") != -1:
+        data.close()
+        return None
+    return MappedLines(filename, data)
+
+
+class MappedLines:
+    """
+    Lines of a memory mapped utf-8 file with "\n" newlines.
+
+    Only the offsets the lines start at are kept, in an array, a line is
+    decoded when it is read and comes without trailing whitespace like the
+    lines of decode(). The lines whose bytes aren't exactly the encoded
+    line, because of that whitespace, are listed in dirty. write_lines()
+    copies the other lines straight from the map. Create it with
+    map_lines() and close it once the lines are written.
+    """
+
+    def __init__(self, filename, data):
+        self.filename = filename
+        self._data = data
+        self._view = memoryview(data)
+        size = len(data)
+        self.ends_with_newline = data[size - 1] == ord("\n")
+        self._offsets = offsets = array.array("Q", [0])
+        self.dirty = array.array("Q")
+        find = data.find
+        start = 0
+        while start < size:
+            end = find(b"\n", start)
+            if end == -1:
+                end = size
+            if end > start and not self._clean(start, end):
+                self.dirty.append(len(offsets) - 1)
+            start = end + 1
+            offsets.append(min(start, size))
+
+    def _clean(self, start, end):
+        last = self._data[end - 1]
+        if last < 0x80:
+            return last not in _WHITESPACE
+        tail = self._data[max(start, end - 4):end].decode("utf-8", "ignore")
+        return not tail[-1:].isspace()
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            start, end, step = idx.indices(len(self))
+            if step != 1:
+                return [self[i] for i in range(start, end, step)]
+            return list(self._decode(start, end))
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError("line index out of range")
+        return str(self._view[self._offsets[idx]:self._offsets[idx + 1]],
+                   "utf-8").rstrip()
+
+    def __iter__(self):
+        return self._decode(0, len(self))
+
+    def _decode(self, start, end):
+        # Decodes the lines a block at a time, which is much faster than
+        # one by one, without holding more than a block of strings
+        offsets = self._offsets
+        for first in range(start, end, _BLOCK):
+            last = min(first + _BLOCK, end)
+            text = str(self._view[offsets[first]:offsets[last]], "utf-8")
+            lines = text.split("\n")
+            for line in itertools.islice(lines, last - first):
+                yield line.rstrip()
+
+    def raw(self, start, end):
+        # The bytes of the lines start to end, with their newlines
+        return self._view[self._offsets[start]:self._offsets[end]]
+
+    def close(self):
+        self._view.release()
+        self._data.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def write_lines(filename, chunks, mapped):
+    # Writes the lines of the (lines, start, end) chunks of a LineBuffer
+    # created from mapped, with "\n" newlines. Runs of lines of mapped are
+    # copied from the map, only the dirty ones and the lines of other chunks
+    # are encoded. filename can be the mapped file, it is always replaced
+    # atomically. Nothing is written if the file already has this content,
+    # returns whether the file was written.
+    chunks = list(chunks)
+    exists = os.path.exists(filename)
+    if (chunks == [(mapped, 0, len(mapped))] and not mapped.dirty
+            and mapped.ends_with_newline and exists
+            and filecmp.cmp(mapped.filename, filename, shallow=False)):
+        return False
+
+    def write(file):
+        for lines, start, end in chunks:
+            if lines is not mapped:
+                file.write("".join(line + "\n" for line in lines[start:end])
+                           .encode("utf-8"))
+                continue
+            dirty = mapped.dirty
+            for idx in range(bisect.bisect_left(dirty, start),
+                             bisect.bisect_left(dirty, end)):
+                file.write(mapped.raw(start, dirty[idx]))
+                file.write(mapped[dirty[idx]].encode("utf-8") + b"\n")
+                start = dirty[idx] + 1
+            file.write(mapped.raw(start, end))
+            if (start < end == len(mapped)
+                    and not mapped.ends_with_newline):
+                file.write(b"\n")
+
+    _replace(filename, exists, write)
+    return True
@@ -1,59 +1,413 @@
+import fnmatch
+import logging
+import re
 import shutil
 import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
 
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger("pep8.folders")
+
+# Holds the number of the last output folder, so the name of the next one
+# is known without listing the output folders
+COUNTER_FILE = ".last_output"
+_OUTPUT_NAME = re.compile(r"output(\d+)")
+# ioctl cloning a file on Linux
+FICLONE = 0x40049409
+
+# Folders that never hold code to format, they aren't walked. Folders with
+# a pyvenv.cfg file are virtual environments and aren't walked either.
+EXCLUDED_FOLDERS = frozenset((
+    ".git", ".hg", ".svn", ".tox", ".nox", ".venv", "venv", ".eggs",
+    ".mypy_cache", ".pytest_cache", ".ruff_cache", "__pycache__",
+    "__pypackages__", "node_modules", "build", "dist", "_build", "buck-out"))
+
+
+def find_py_files_in_subfolders(folder_path, exclude=(), gitignore=True):
+    return list(iter_py_files_in_subfolders(folder_path, exclude, gitignore))
+
+
+def iter_py_files_in_subfolders(folder_path, exclude=(), gitignore=True,
+                                jobs=None):
+    """
+    Yields the .py files in the folder and its subfolders while it is
+    walked, so they can be formatted before the walk is finished.
+
+    Folders are listed by jobs threads at the same time, but the files are
+    yielded in the same order every time: the files of a folder sorted by
+    name, then the files of its subfolders. Files and folders matching one
+    of the exclude globs are skipped, a glob containing a "/" is matched
+    against the path relative to folder_path and any other glob against the
+    name, a glob ending with "/" only matches folders. With gitignore the
+    .gitignore files in the walked folders are followed too. Skipped
+    folders and the EXCLUDED_FOLDERS are never listed.
+    """
+    root = os.path.normpath(folder_path)
+    excluded = _compile_globs(exclude)
+    executor = ThreadPoolExecutor(jobs or min(32, (os.cpu_count() or 1) + 4))
+    try:
+        # the folders still to yield, the last one is next
+        stack = [executor.submit(_scan, root, "", (), excluded, gitignore)]
+        while stack:
+            files, subfolders = stack.pop().result()
+            stack.extend(executor.submit(_scan, *subfolder, excluded,
+                                         gitignore)
+                         for subfolder in reversed(subfolders))
+            yield from files
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _scan(folder, relative, rules, excluded, gitignore):
+    # Returns the .py files in the folder and the (folder, relative path,
+    # .gitignore rules) of the subfolders to walk
+    try:
+        with os.scandir(folder) as entries:
+            entries = sorted(entries, key=lambda entry: entry.name)
+    except OSError as e:
+        logger.warning("Can't list %s: %s", folder, e)
+        return [], []
+    names = {entry.name for entry in entries}
+    if "pyvenv.cfg" in names:
+        return [], []
+    if gitignore and ".gitignore" in names:
+        rules = rules + _read_gitignore(os.path.join(folder, ".gitignore"),
+                                        relative)
+    # the paths are built the same way as the root, so they stay normalized
+    prefix = "" if folder == os.curdir else os.path.join(folder, "")
 
-def find_py_files_in_subfolders(folder_path):
     files = []
-    for folder, subfolders, filenames in os.walk(folder_path):
-        for file in filenames:
-            if file.endswith(".py"):
-                file_path = os.path.join(folder, file)
-                file_path = os.path.normpath(file_path)
-                files.append(file_path)
-    return files
+    subfolders = []
+    for entry in entries:
+        name = entry.name
+        path = relative + name
+        try:
+            is_folder = entry.is_dir() and not entry.is_symlink()
+        except OSError:
+            continue
+        if is_folder:
+            if (name not in EXCLUDED_FOLDERS
+                    and not excluded(name, path, True)
+                    and not _ignored(rules, path, True)):
+                subfolders.append((prefix + name, path + "/", rules))
+        elif (name.endswith(".py") and not excluded(name, path, False)
+              and not _ignored(rules, path, False)):
+            files.append(prefix + name)
+    return files, subfolders
+
+
+def is_excluded(file, folder_path, exclude=(), gitignore=True):
+    # Whether the walk of folder_path would skip the file, for files that
+    # are found some other way
+    relative = os.path.relpath(file, folder_path).replace(os.sep, "/")
+    if relative.startswith("../"):
+        return True
+    excluded = _compile_globs(exclude)
+    folder = os.path.normpath(folder_path)
+    rules = ()
+    parts = relative.split("/")
+    for depth, name in enumerate(parts):
+        if os.path.exists(os.path.join(folder, "pyvenv.cfg")):
+            return True
+        prefix = "/".join(parts[:depth])
+        prefix = prefix + "/" if prefix else ""
+        gitignore_file = os.path.join(folder, ".gitignore")
+        if gitignore and os.path.exists(gitignore_file):
+            rules = rules + _read_gitignore(gitignore_file, prefix)
+        is_folder = depth < len(parts) - 1
+        path = prefix + name
+        if ((is_folder and name in EXCLUDED_FOLDERS)
+                or excluded(name, path, is_folder)
+                or _ignored(rules, path, is_folder)):
+            return True
+        folder = os.path.join(folder, name)
+    return False
+
+
+def _compile_globs(patterns):
+    # Returns a function telling whether a file or folder with the name and
+    # relative path matches one of the patterns. Like in .gitignore a
+    # pattern ending with "/" only matches folders.
+    groups = {}
+    for pattern in patterns:
+        folders_only = pattern.endswith("/")
+        pattern = pattern.rstrip("/")
+        if not pattern:
+            continue
+        groups.setdefault(("/" in pattern, folders_only), []).append(
+            fnmatch.translate(pattern.lstrip("/")))
+    regexes = [(is_path, folders_only, re.compile("|".join(group)))
+               for (is_path, folders_only), group in groups.items()]
+
+    def excluded(name, path, is_folder):
+        return any(regex.match(path if is_path else name)
+                   for is_path, folders_only, regex in regexes
+                   if is_folder or not folders_only)
+    return excluded
+
+
+def _read_gitignore(file, relative):
+    # Returns the rules of a .gitignore file in the folder at the relative
+    # path, as (regex, negate, folders_only) tuples
+    try:
+        with open(file, encoding="utf-8", errors="replace") as f:
+            lines = f.read().splitlines()
+    except OSError as e:
+        logger.warning("Can't read %s: %s", file, e)
+        return ()
+    rules = (_gitignore_rule(line, relative) for line in lines)
+    return tuple(rule for rule in rules if rule is not None)
+
+
+def _gitignore_rule(pattern, relative):
+    # A pattern with a "/" before its end matches paths relative to the
+    # folder of the .gitignore file, any other pattern matches at any depth
+    pattern = pattern.rstrip()
+    if not pattern or pattern.startswith("#"):
+        return None
+    negate = pattern.startswith("!")
+    if negate:
+        pattern = pattern[1:]
+    elif pattern.startswith("\\"):
+        pattern = pattern[1:]
+    folders_only = pattern.endswith("/")
+    pattern = pattern.rstrip("/")
+    anchored = "/" in pattern
+    pattern = pattern.lstrip("/")
+    if not pattern:
+        return None
+
+    regex = re.escape(relative) + ("" if anchored else "(?:.*/)?")
+    idx = 0
+    while idx < len(pattern):
+        if pattern.startswith("**/", idx):
+            regex += "(?:.*/)?"
+            idx += 3
+        elif pattern.startswith("**", idx):
+            regex += ".*"
+            idx += 2
+        elif pattern[idx] == "*":
+            regex += "[^/]*"
+            idx += 1
+        elif pattern[idx] == "?":
+            regex += "[^/]"
+            idx += 1
+        elif pattern[idx] == "[" and "]" in pattern[idx + 2:]:
+            end = pattern.index("]", idx + 2)
+            chars = pattern[idx + 1:end]
+            if chars.startswith("!"):
+                chars = "^" + chars[1:]
+            regex += "[" + chars.replace("\\", "\\\\") + "]"
+            idx = end + 1
+        else:
+            regex += re.escape(pattern[idx])
+            idx += 1
+    return re.compile(regex + r"\Z"), negate, folders_only
+
+
+def _ignored(rules, path, is_folder):
+    # The last matching rule decides, rules of deeper .gitignore files
+    # come later
+    ignored = False
+    for regex, negate, folders_only in rules:
+        if (folders_only and not is_folder) or ignored == (not negate):
+            continue
+        if regex.match(path):
+            ignored = not negate
+    return ignored
 
 
-def copy_folder(source_folder, destination_folder):
+def copy_folder(source_folder, destination_folder, link=True):
+    # With link the files are reflinked, or hard linked where the file
+    # system can't, instead of copied. The formatter replaces the files it
+    # changes with new ones, so only those are really copied.
     destination_path = os.path.abspath(destination_folder)
     try:
-        shutil.copytree(source_folder, destination_path)
-        print(
-            f"Folder '{source_folder}' successfully copied " +
-            f"to '{os.path.abspath(destination_path)}'.")
+        if link:
+            shutil.copytree(source_folder, destination_path,
+                            copy_function=_Linker())
+        else:
+            shutil.copytree(source_folder, destination_path)
+        logger.info("Folder '%s' successfully copied to '%s'.",
+                    source_folder, os.path.abspath(destination_path))
         return True
     except FileExistsError:
-        print(
-            f"Destination folder '{os.path.abspath(destination_path)}' " +
-            "already exists. Please move/delete the existing output folder.")
+        logger.error("Destination folder '%s' already exists. Please "
+                     "move/delete the existing output folder.",
+                     os.path.abspath(destination_path))
         return False
     except Exception as e:
-        print(f"An error occurred: {e}")
+        logger.error("An error occurred: %s", e)
         return False
 
+
+class _Linker:
+    # copy_function for shutil.copytree trying a reflink, a hard link and a
+    # copy in that order, a way that failed once isn't tried again
+
+    def __init__(self):
+        self.reflink = fcntl is not None and sys.platform.startswith("linux")
+        self.hardlink = True
+
+    def __call__(self, source, destination):
+        if self.reflink:
+            try:
+                _reflink(source, destination)
+                return destination
+            except OSError as e:
+                logger.debug("Can't reflink files, hard linking them: %s", e)
+                self.reflink = False
+        if self.hardlink:
+            try:
+                os.link(source, destination)
+                return destination
+            except OSError as e:
+                logger.debug("Can't hard link files, copying them: %s", e)
+                self.hardlink = False
+        return shutil.copy2(source, destination)
+
+
+def _reflink(source, destination):
+    # A copy sharing the data of source until one of them is written
+    try:
+        with open(source, "rb") as source_file, \
+                open(destination, "wb") as destination_file:
+            fcntl.ioctl(destination_file.fileno(), FICLONE,
+                        source_file.fileno())
+    except OSError:
+        if os.path.exists(destination):
+            os.remove(destination)
+        raise
+    shutil.copystat(source, destination)
+
+
 def get_next_folder_name(base_folder):
-    # Get a list of existing folders in the base folder
-    existing_folders = [folder for folder in os.listdir(base_folder)
-                        if os.path.isdir(os.path.join(base_folder, folder))]
-    
-    # Find the highest numbered folder
-    highest_number = 0
-    for folder in existing_folders:
+    # The number of the last output folder is read from COUNTER_FILE, the
+    # existing folders are only listed when there is none
+    highest_number = _read_counter(base_folder)
+    if highest_number is None:
+        highest_number = 0
         try:
-            folder_number = int(folder.split("output")[-1])
-            highest_number = max(highest_number, folder_number)
-        except ValueError:
-            pass
+            existing_folders = [
+                folder for folder in os.listdir(base_folder)
+                if os.path.isdir(os.path.join(base_folder, folder))]
+        except FileNotFoundError:
+            existing_folders = []
+        for folder in existing_folders:
+            try:
+                folder_number = int(folder.split("output")[-1])
+                highest_number = max(highest_number, folder_number)
+            except ValueError:
+                pass
 
-    # Create the name for the next folder
+    # folders made without updating the counter are skipped
+    while os.path.exists(os.path.join(base_folder,
+                                      f"output{highest_number + 1}")):
+        highest_number += 1
     next_folder_name = f"output{highest_number + 1}"
     return next_folder_name
 
 
-def copy_folder_to_new_output_folder(folder_path, output_path):
+def _read_counter(base_folder):
+    try:
+        with open(os.path.join(base_folder, COUNTER_FILE)) as file:
+            return int(file.read())
+    except (OSError, ValueError):
+        return None
+
+
+def _save_counter(base_folder, folder_name):
+    # Written to a temporary file first, a run reading it at the same time
+    # sees the old or the new number
+    counter_path = os.path.join(base_folder, COUNTER_FILE)
+    tmp_path = f"{counter_path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "w") as file:
+            file.write(folder_name[len("output"):] + "\n")
+        os.replace(tmp_path, counter_path)
+    except OSError as e:
+        logger.warning("Can't save the number of the output folder: %s", e)
+
+
+def create_new_output_folder(output_path):
+    folder_name = get_next_folder_name(output_path)
+    new_output_path = os.path.join(output_path, folder_name)
+    try:
+        os.makedirs(new_output_path)
+    except OSError as e:
+        logger.error("An error occurred: %s", e)
+        return None
+    _save_counter(output_path, folder_name)
+    return new_output_path
+
+
+def mirror_path(file, folder_path, output_path):
+    # Path of the file relative to folder_path, placed in output_path
+    return os.path.join(output_path, os.path.relpath(file, folder_path))
+
+
+def copy_folder_to_new_output_folder(folder_path, output_path, link=True):
     folder_name = get_next_folder_name(output_path)
-    output_path = os.path.join(output_path, folder_name)
-    copy_status = copy_folder(folder_path, output_path)
+    new_output_path = os.path.join(output_path, folder_name)
+    copy_status = copy_folder(folder_path, new_output_path, link)
     if copy_status:
-        return output_path
+        _save_counter(output_path, folder_name)
+        return new_output_path
     else:
         return None
+
+
+def prune_output_folders(output_path, keep=None, max_size=None):
+    # Removes the oldest output folders until at most keep of them are
+    # left and together they take up at most max_size bytes, the newest
+    # output folder always stays. A file hard linked into several output
+    # folders counts once, for the newest of them. Returns the removed
+    # folders.
+    numbered = []
+    for name in os.listdir(output_path):
+        match = _OUTPUT_NAME.fullmatch(name)
+        if match and os.path.isdir(os.path.join(output_path, name)):
+            numbered.append((int(match.group(1)), name))
+    folders = [os.path.join(output_path, name)
+               for _, name in sorted(numbered)]
+
+    removed = []
+    if keep is not None:
+        removed = folders[:max(len(folders) - max(keep, 1), 0)]
+        folders = folders[len(removed):]
+    if max_size is not None:
+        sizes = _folder_sizes(folders)
+        total_size = sum(sizes)
+        while total_size > max_size and len(folders) > 1:
+            removed.append(folders.pop(0))
+            total_size -= sizes.pop(0)
+
+    for folder in removed:
+        logger.info("Removing old output folder %s", folder)
+        shutil.rmtree(folder, ignore_errors=True)
+    return removed
+
+
+def _folder_sizes(folders):
+    # Bytes of the files of every folder, files found in a newer folder
+    # already aren't counted again
+    seen = set()
+    sizes = []
+    for folder in reversed(folders):
+        size = 0
+        for parent, _, names in os.walk(folder):
+            for name in names:
+                try:
+                    stat = os.lstat(os.path.join(parent, name))
+                except OSError:
+                    continue
+                if (stat.st_dev, stat.st_ino) not in seen:
+                    seen.add((stat.st_dev, stat.st_ino))
+                    size += stat.st_size
+        sizes.append(size)
+    return sizes[::-1]
@@ -0,0 +1,134 @@
+import difflib
+import os
+import re
+import subprocess
+
+_HUNK = re.compile(r"^@@ -\d+(?:,\d+)? \+(\d+)(?:,(\d+))? @@")
+# The escapes of the file names git quotes C-style in diffs
+_QUOTED = re.compile(rb"\\([0-7]{3}|.)")
+_ESCAPES = {b"a": b"\a", b"b": b"\b", b"t": b"\t", b"n": b"\n", b"v": b"\v",
+            b"f": b"\f", b"r": b"\r"}
+
+
+def _git(folder_path, *args):
+    # non-ASCII names are printed as they are instead of quoted
+    result = subprocess.run(["git", "-C", folder_path,
+                             "-c", "core.quotepath=off", *args],
+                            capture_output=True, text=True, check=True)
+    return result.stdout
+
+
+def changed_lines(folder_path, ref=None, staged=False):
+    """
+    Returns the .py files under folder_path changed according to the local
+    git repository, mapped to the ranges of changed lines.
+
+    With staged the staged changes are used, otherwise the changes in the
+    working tree since ref (HEAD by default) and the untracked files. The
+    ranges are (first, last) line numbers of the file, None for files that
+    are new to git. Raises subprocess.CalledProcessError if git fails.
+    """
+    # outside of a repository git diff would compare files instead
+    _git(folder_path, "rev-parse", "--git-dir")
+    args = ["diff", "-U0", "--no-color", "--no-ext-diff", "--relative",
+            "--diff-filter=ACMR"]
+    if staged:
+        args.append("--cached")
+    elif ref:
+        args.append(ref)
+    changes = _parse_diff(_git(folder_path, *args, "--", "*.py"))
+    if not staged:
+        untracked = _git(folder_path, "ls-files", "-z", "--others",
+                         "--exclude-standard", "--", "*.py")
+        for file in _split_names(untracked):
+            changes[file] = None
+    return {os.path.normpath(os.path.join(folder_path, file)): ranges
+            for file, ranges in changes.items()}
+
+
+def unstaged_files(folder_path):
+    # The .py files under folder_path whose working tree differs from what
+    # is staged
+    files = _git(folder_path, "diff", "--name-only", "-z", "--no-ext-diff",
+                 "--relative", "--", "*.py")
+    return {os.path.normpath(os.path.join(folder_path, file))
+            for file in _split_names(files)}
+
+
+def staged_content(file):
+    # The content of the file staged in the index, the staged changes are
+    # line numbers of this content and not of the file
+    folder, name = os.path.split(os.path.abspath(file))
+    result = subprocess.run(["git", "-C", folder, "show", f":./{name}"],
+                            capture_output=True, check=True)
+    return result.stdout
+
+
+def _split_names(output):
+    # names printed with -z end with a NUL and are never quoted
+    return [name for name in output.split("\0") if name]
+
+
+def _unquote(name):
+    # Git puts names with special characters in quotes with C escapes
+    if not (len(name) > 1 and name.startswith('"') and name.endswith('"')):
+        return name
+    def unescape(match):
+        escaped = match.group(1)
+        if len(escaped) == 3:
+            return bytes([int(escaped, 8)])
+        return _ESCAPES.get(escaped, escaped)
+
+    raw = _QUOTED.sub(unescape, name[1:-1].encode("utf-8", "surrogateescape"))
+    return raw.decode("utf-8", "surrogateescape")
+
+
+def _parse_diff(diff):
+    changes = {}
+    ranges = None
+    for line in diff.splitlines():
+        if line.startswith("+++ "):
+            # names with a space are followed by a tab
+            name = line[len("+++ "):]
+            if name.endswith("\t"):
+                name = name[:-1]
+            name = _unquote(name)
+            ranges = changes.setdefault(name[len("b/"):], [])
+            continue
+        match = _HUNK.match(line)
+        if match is None or ranges is None:
+            continue
+        start = int(match.group(1))
+        count = int(match.group(2)) if match.group(2) is not None else 1
+        if count:
+            ranges.append((start, start + count - 1))
+        else:
+            # only lines were removed, after line start
+            ranges.append((max(start, 1), start + 1))
+    return changes
+
+
+def restrict_changes(original, formatted, ranges):
+    # Takes the changes from original to formatted that touch the given
+    # (first, last) line ranges of original and keeps the original lines
+    # everywhere else. Lines differing only in trailing whitespace are
+    # matched, so removing it is decided line by line.
+    changed = [False] * (len(original) + 1)
+    for start, end in ranges:
+        for idx in range(max(start - 1, 0), min(end, len(original))):
+            changed[idx] = True
+
+    lines = []
+    matcher = difflib.SequenceMatcher(
+        None, [line.rstrip() for line in original], formatted,
+        autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            lines.extend(formatted[j1 + idx] if changed[i1 + idx] else line
+                         for idx, line in enumerate(original[i1:i2]))
+        elif any(changed[i1:i2]) or (
+                i1 == i2 and (changed[i1] or (i1 > 0 and changed[i1 - 1]))):
+            lines.extend(formatted[j1:j2])
+        else:
+            lines.extend(original[i1:i2])
+    return lines
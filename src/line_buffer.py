@@ -0,0 +1,257 @@
+import bisect
+import collections
+
+
+class _Lines:
+    # Lines the pieces of a buffer point into, never changed once created.
+    # origins[i] is the index line i had when the buffer was created, None
+    # means the index in lines itself. spans are filled in by set_spans().
+
+    __slots__ = ("lines", "origins", "spans")
+
+    def __init__(self, lines, origins=None, spans=None):
+        self.lines = lines
+        self.origins = origins
+        self.spans = spans
+
+
+class LineBuffer:
+    """
+    Piece table over the lines of a file.
+
+    The lines are pieces of the list the buffer was created with and of
+    the lines added by edits. insert(), delete(), replace() and move()
+    record edits at the indexes the lines had when the batch of edits
+    started, and apply() applies the whole batch in one pass over the
+    pieces. Applying an edit costs in proportion to the size of the edit
+    and the number of pieces, the lines that stay are never copied or
+    shifted. Every line remembers the index it had when the buffer was
+    created, or None if it was added, and its string and comment spans
+    once they are known.
+    """
+
+    def __init__(self, lines, origins=None, spans=None):
+        lines = _Lines(lines, origins, spans)
+        self._pieces = [(lines, 0, len(lines.lines))] if lines.lines else []
+        self._edits = []
+        self._index()
+
+    def _index(self):
+        self._starts = []
+        length = 0
+        for lines, start, end in self._pieces:
+            self._starts.append(length)
+            length += end - start
+        self._length = length
+        self._has_spans = all(lines.spans is not None
+                              for lines, _, _ in self._pieces)
+        self._positions = None
+        self._last = 0
+
+    def __len__(self):
+        return self._length
+
+    def __iter__(self):
+        for lines, start, end in self._pieces:
+            if start == 0 and end == len(lines.lines):
+                yield from lines.lines
+            else:
+                yield from lines.lines[start:end]
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(self._length))]
+        lines, position = self._locate(idx)
+        return lines.lines[position]
+
+    def __eq__(self, other):
+        try:
+            if len(other) != self._length:
+                return False
+        except TypeError:
+            return NotImplemented
+        return all(a == b for a, b in zip(self, other))
+
+    def __repr__(self):
+        return f"LineBuffer({list(self)!r})"
+
+    def _locate(self, idx):
+        # Returns the lines holding line idx and its index in them. The
+        # piece of the previous lookup is tried first, most rules read the
+        # lines in order.
+        if idx < 0:
+            idx += self._length
+        if not 0 <= idx < self._length:
+            raise IndexError("line index out of range")
+        piece = self._last
+        starts = self._starts
+        if not (starts[piece] <= idx and (piece + 1 == len(starts)
+                                          or idx < starts[piece + 1])):
+            piece = bisect.bisect_right(starts, idx) - 1
+            self._last = piece
+        lines, start, _ = self._pieces[piece]
+        return lines, start + idx - starts[piece]
+
+    def origin(self, idx):
+        lines, position = self._locate(idx)
+        if lines.origins is None:
+            return position
+        return lines.origins[position]
+
+    def index_of(self, origin):
+        # Current index of the line that had the index origin when the
+        # buffer was created, None if the line was removed
+        if self._positions is None:
+            # the pieces of the created lines as sorted (origin, end,
+            # current index) ranges, the lines of edits one by one
+            ranges = []
+            added = {}
+            for (lines, start, end), current in zip(self._pieces,
+                                                    self._starts):
+                if lines.origins is None:
+                    ranges.append((start, end, current))
+                    continue
+                for position in range(start, end):
+                    if lines.origins[position] is not None:
+                        added[lines.origins[position]] = (current + position
+                                                          - start)
+            ranges.sort()
+            self._positions = ranges, added
+        ranges, added = self._positions
+        piece = bisect.bisect_right(ranges, (origin, float("inf"))) - 1
+        if piece >= 0 and ranges[piece][0] <= origin < ranges[piece][1]:
+            return ranges[piece][2] + origin - ranges[piece][0]
+        return added.get(origin)
+
+    @property
+    def is_original(self):
+        # Whether the buffer still has the lines it was created with, with
+        # their own indexes as origins
+        if not self._pieces:
+            return True
+        lines, start, end = self._pieces[0]
+        return (len(self._pieces) == 1 and lines.origins is None
+                and start == 0 and end == len(lines.lines))
+
+    def chunks(self):
+        # (lines, start, end) for every piece, lines[start:end] being the
+        # lines of the piece
+        for lines, start, end in self._pieces:
+            yield lines.lines, start, end
+
+    @property
+    def has_spans(self):
+        return self._has_spans
+
+    @property
+    def spans(self):
+        # Spans of the lines, only valid if has_spans
+        return _Spans(self)
+
+    def set_spans(self, spans):
+        # spans has the spans of every current line
+        for (lines, start, end), current in zip(self._pieces, self._starts):
+            if lines.spans is None:
+                lines.spans = [None] * len(lines.lines)
+            lines.spans[start:end] = spans[current:current + end - start]
+        self._has_spans = True
+
+    def _slice(self, start, end):
+        # The pieces holding the lines start to end
+        if start >= end:
+            return []
+        first = bisect.bisect_right(self._starts, start) - 1
+        pieces = []
+        for piece in range(first, len(self._pieces)):
+            piece_start = self._starts[piece]
+            if piece_start >= end:
+                break
+            lines, offset, piece_end = self._pieces[piece]
+            pieces.append((lines,
+                           offset + max(start - piece_start, 0),
+                           offset + min(end - piece_start,
+                                        piece_end - offset)))
+        return pieces
+
+    def insert(self, idx, lines, spans=None):
+        # The new lines have no origin
+        if lines:
+            added = _Lines(list(lines), [None] * len(lines), spans)
+            self._edits.append((idx, idx, [(added, 0, len(lines))]))
+
+    def delete(self, start, end):
+        if start < end:
+            self._edits.append((start, end, []))
+
+    def replace(self, start, end, lines, spans=None):
+        # The first new lines take the origins of the lines they replace
+        lines = list(lines)
+        origins = [self.origin(idx) for idx in range(start, min(end, start
+                                                                + len(lines)))]
+        origins.extend([None] * (len(lines) - len(origins)))
+        added = _Lines(lines, origins, spans)
+        self._edits.append((start, end,
+                            [(added, 0, len(lines))] if lines else []))
+
+    def move(self, start, end, to):
+        # Moves the lines start to end before line to, which isn't one of
+        # them. The lines keep their origins and spans.
+        if start < end:
+            self._edits.append((start, end, []))
+            self._edits.append((to, to, self._slice(start, end)))
+
+    def apply(self):
+        # Applies the recorded edits, in the order they were recorded where
+        # several insert lines at the same index. Returns whether there
+        # were any.
+        if not self._edits:
+            return False
+        inserted = collections.defaultdict(list)
+        # +1 where a deleted range starts and -1 where it ends
+        deleted = collections.Counter()
+        for start, end, pieces in self._edits:
+            inserted[start].extend(pieces)
+            if start < end:
+                deleted[start] += 1
+                deleted[end] -= 1
+        cuts = sorted(set(inserted) | set(deleted) | {0, self._length})
+
+        pieces = []
+        depth = 0
+        for cut, following in zip(cuts, cuts[1:] + [None]):
+            _extend(pieces, inserted.get(cut, ()))
+            depth += deleted.get(cut, 0)
+            if following is not None and depth == 0:
+                _extend(pieces, self._slice(cut, following))
+        self._pieces = pieces
+        self._edits = []
+        self._index()
+        return True
+
+
+def _extend(pieces, new_pieces):
+    # Adds the pieces, joining pieces that continue each other
+    for piece in new_pieces:
+        if piece[1] == piece[2]:
+            continue
+        if pieces and pieces[-1][0] is piece[0] and pieces[-1][2] == piece[1]:
+            pieces[-1] = (piece[0], pieces[-1][1], piece[2])
+        else:
+            pieces.append(piece)
+
+
+class _Spans:
+
+    def __init__(self, buffer):
+        self._buffer = buffer
+
+    def __len__(self):
+        return len(self._buffer)
+
+    def __getitem__(self, idx):
+        lines, position = self._buffer._locate(idx)
+        return lines.spans[position]
+
+    def __iter__(self):
+        for lines, start, end in self._buffer._pieces:
+            yield from lines.spans[start:end]
@@ -0,0 +1,107 @@
+import contextlib
+import io
+import json
+import logging
+import sys
+
+# Every module logs to a child of this logger, e.g. "pep8.rules"
+LOGGER_NAME = "pep8"
+logger = logging.getLogger(LOGGER_NAME)
+_json_format = False
+
+
+class JsonFormatter(logging.Formatter):
+    # One JSON object per line with the file being formatted and the
+    # counters of the per file summary when the record has them
+
+    def format(self, record):
+        entry = {"level": record.levelname, "logger": record.name}
+        file = getattr(record, "file", None)
+        if file is not None:
+            entry["file"] = file
+        entry["message"] = record.getMessage()
+        counters = getattr(record, "counters", None)
+        if counters is not None:
+            entry["counters"] = counters
+        return json.dumps(entry)
+
+
+class _FileFilter(logging.Filter):
+
+    def __init__(self, file):
+        super().__init__()
+        self.file = file
+
+    def filter(self, record):
+        record.file = self.file
+        return True
+
+
+def _handler(stream, json_format):
+    handler = logging.StreamHandler(stream)
+    if json_format:
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter("%(message)s"))
+    return handler
+
+
+def configure(level=logging.INFO, json_format=False, stream=None):
+    # Sets up the output of the parent process
+    global _json_format
+    _json_format = json_format
+    logger.handlers = [_handler(stream or sys.stdout, json_format)]
+    logger.setLevel(level)
+    logger.propagate = False
+
+
+def json_format():
+    return _json_format
+
+
+@contextlib.contextmanager
+def capture(file=None, level=logging.INFO, json_format=False):
+    # Collects the records logged while formatting a file in a StringIO
+    # instead of the configured output, so a worker can return its log and
+    # the parent can write the logs of all files in order
+    stream = io.StringIO()
+    handler = _handler(stream, json_format)
+    handler.addFilter(_FileFilter(file))
+    saved = logger.handlers, logger.level, logger.propagate
+    logger.handlers = [handler]
+    logger.setLevel(level)
+    logger.propagate = False
+    try:
+        yield stream
+    finally:
+        logger.handlers, logger.level, logger.propagate = saved
+
+
+class _RecordList(logging.Handler):
+
+    def __init__(self, records):
+        super().__init__()
+        self.records = records
+
+    def emit(self, record):
+        # the arguments are merged into the message, they might not be
+        # picklable
+        record.msg = record.getMessage()
+        record.args = None
+        record.exc_info = None
+        self.records.append(record)
+
+
+@contextlib.contextmanager
+def collect(level=logging.INFO):
+    # Collects the records logged in a process working for another process,
+    # which passes them on to its own handlers with logger.handle()
+    records = []
+    saved = logger.handlers, logger.level, logger.propagate
+    logger.handlers = [_RecordList(records)]
+    logger.setLevel(level)
+    logger.propagate = False
+    try:
+        yield records
+    finally:
+        logger.handlers, logger.level, logger.propagate = saved
@@ -0,0 +1,299 @@
+import collections
+import contextlib
+import functools
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    from . import chunks
+    from . import file_handler
+    from . import git_util
+    from . import log
+    from . import pep8
+    from . import profiler
+except ImportError:
+    import chunks
+    import file_handler
+    import git_util
+    import log
+    import pep8
+    import profiler
+
+logger = logging.getLogger("pep8.files")
+
+# In the workers of a pool splitting large files, a semaphore with a slot
+# for every process that may format at once, see init_slots()
+_slots = None
+
+
+def init_slots(slots):
+    # Initializer of the workers of a pool whose large files are formatted
+    # in chunks. A worker holds a slot while it formats a file and formats
+    # chunks only in as many processes as there are free slots, so all
+    # pools together never format in more processes than the pool has.
+    global _slots
+    _slots = slots
+
+
+def _slot():
+    return _slots if _slots is not None else contextlib.nullcontext()
+
+
+def format_file(file, destination=None, ranges=None, cache=None,
+                profile=False, log_level=logging.INFO, log_json=False,
+                rules=None, split_jobs=None):
+    # Runs in a worker process, everything logged is captured so the parent
+    # can write the logs of all files in order. Without a destination the
+    # file is overwritten, otherwise the result is written to the
+    # destination only if it differs from what is already there. With
+    # ranges only the changes touching those (first, last) lines are kept,
+    # such results are never cached, and neither are files of at least
+    # file_handler.MMAP_MIN_SIZE bytes. rules are the names of the rules to
+    # apply, all of them by default. With split_jobs, files of at least
+    # chunks.SPLIT_MIN_SIZE bytes are formatted in chunks in that many
+    # processes.
+    # Returns (file, log, error, records) with the profiler records of the
+    # rules or None if profile is False.
+    error = None
+    file_profiler = profiler.Profiler(file) if profile else None
+    with _slot(), log.capture(file, log_level, log_json) as file_log:
+        try:
+            if (cache is None or ranges is not None or os.path.getsize(file)
+                    >= file_handler.MMAP_MIN_SIZE):
+                _format_file(file, destination, None, file_profiler, ranges,
+                             rules, split_jobs)
+            else:
+                _format_file_with_cache(file, destination, cache,
+                                        file_profiler, rules, split_jobs)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+    records = file_profiler.records if profile else None
+    return file, file_log.getvalue(), error, records
+
+
+def _format_file(file, destination, data=None, file_profiler=None,
+                 ranges=None, rules=None, split_jobs=None):
+    # Returns the formatted content, written with the encoding and newlines
+    # of the file. Large files are read through a memory map when possible,
+    # then the result is written as it is produced and None is returned.
+    if data is None:
+        if (ranges is None and not _split(file, split_jobs)
+                and os.path.getsize(file) >= file_handler.MMAP_MIN_SIZE
+                and _format_mapped_file(file, destination, file_profiler,
+                                        rules)):
+            return None
+        with open(file, "rb") as f:
+            data = f.read()
+    formatted = _format_data(file, data, file_profiler, ranges, rules,
+                             split_jobs)
+    _write(file, destination, formatted)
+    return formatted
+
+
+def format_data(file, data, ranges=None, profile=False,
+                log_level=logging.INFO, log_json=False, rules=None,
+                split_jobs=None):
+    # Like format_file for the content of a file the parent read and writes
+    # itself. Returns (formatted, log, error, records), formatted is None
+    # after an error.
+    formatted = error = None
+    file_profiler = profiler.Profiler(file) if profile else None
+    with _slot(), log.capture(file, log_level, log_json) as file_log:
+        try:
+            formatted = _format_data(file, data, file_profiler, ranges, rules,
+                                     split_jobs)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+    records = file_profiler.records if profile else None
+    return formatted, file_log.getvalue(), error, records
+
+
+def _format_data(file, data, file_profiler=None, ranges=None, rules=None,
+                 split_jobs=None):
+    # The formatted content, with the encoding and newlines of data
+    lines, encoding, newline = file_handler.decode(data, ranges is None)
+    original = lines
+    if ranges is not None:
+        lines = [line.rstrip() for line in original]
+    source = None
+    if ranges is None and _split(file, split_jobs, len(data)):
+        source = _format_chunks(lines, split_jobs, file_profiler, rules)
+    if source is None:
+        source = pep8.format_source(lines, file_profiler, rules)
+    _log_summary(source)
+    lines = source.lines
+    if ranges is not None:
+        lines = git_util.restrict_changes(original, list(lines), ranges)
+    return file_handler.encode(lines, encoding, newline)
+
+
+def _split(file, split_jobs, size=None):
+    # Whether the file is formatted in chunks
+    if split_jobs is None or split_jobs <= 1:
+        return False
+    if size is None:
+        size = os.path.getsize(file)
+    return size >= chunks.SPLIT_MIN_SIZE
+
+
+def _format_chunks(lines, split_jobs, file_profiler=None, rules=None):
+    # chunks.format_source in split_jobs processes, or with init_slots()
+    # in the process of the worker, which waits for them, and the free
+    # slots. None if no slot is free.
+    if _slots is None:
+        return chunks.format_source(lines, split_jobs, file_profiler, rules)
+    extra = 0
+    while extra < split_jobs - 1 and _slots.acquire(block=False):
+        extra += 1
+    try:
+        if not extra:
+            logger.debug("All processes are busy, formatting the file in "
+                         "one piece")
+            return None
+        return chunks.format_source(lines, extra + 1, file_profiler, rules)
+    finally:
+        for _ in range(extra):
+            _slots.release()
+
+
+def _format_mapped_file(file, destination, file_profiler=None, rules=None):
+    # Formats the file without reading it into strings, the lines the rules
+    # don't change are copied from the map to the result. Returns False if
+    # the file can't be mapped.
+    mapped = file_handler.map_lines(file)
+    if mapped is None:
+        return False
+    with mapped:
+        source = pep8.format_source(mapped, file_profiler, rules)
+        _log_summary(source)
+        written = file_handler.write_lines(destination or file,
+                                           source.lines.chunks(), mapped)
+    if written and destination is not None:
+        logger.info("Written to %s", destination)
+    return True
+
+
+def _log_summary(source):
+    if logger.isEnabledFor(logging.INFO):
+        summary = "".join(f", {name}={count}"
+                          for name, count in sorted(source.counters.items()))
+        logger.info("Parsed %d time%s%s", source.parse_count,
+                    "s" if source.parse_count != 1 else "", summary,
+                    extra={"counters": dict(source.counters,
+                                            parse_count=source.parse_count)})
+
+
+def _write(file, destination, formatted):
+    if destination is None:
+        file_handler.write_bytes(file, formatted)
+    elif file_handler.write_bytes(destination, formatted, atomic=True):
+        logger.info("Written to %s", destination)
+
+
+def _format_file_with_cache(file, destination, cache, file_profiler=None,
+                            rules=None, split_jobs=None):
+    with open(file, "rb") as f:
+        data = f.read()
+    formatted = cache.get(data)
+    if formatted is None:
+        cache.put(data, _format_file(file, destination, data, file_profiler,
+                                     rules=rules, split_jobs=split_jobs))
+        return
+
+    logger.info("Unchanged since an earlier run, using the cached result")
+    _write(file, destination, formatted)
+
+
+def format_files(files, jobs=None, cache=None, destination=None,
+                 file_profiler=None, ranges=None, rules=None, split=False):
+    # Yields (file, log, error) for every file in the order of files.
+    # destination is called with every file to get the path the result is
+    # written to and ranges to get the changed lines of the file, None to
+    # format the whole file. The records of the workers are collected in
+    # file_profiler. The workers log with the level and format configured in
+    # the parent and apply the rules named in rules, all of them by default.
+    # With split large files are formatted in chunks in the processes that
+    # aren't busy, see init_slots().
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    worker = functools.partial(format_file, cache=cache, rules=rules,
+                               split_jobs=jobs if split else None,
+                               profile=file_profiler is not None,
+                               log_level=log.logger.getEffectiveLevel(),
+                               log_json=log.json_format())
+    items = ((file, destination(file) if destination else None,
+              ranges(file) if ranges else None)
+             for file in files)
+    slots = (multiprocessing.Semaphore(jobs),) if split else None
+    for file, file_log, error, records in map_files(worker, items, jobs,
+                                                    slots):
+        if records:
+            file_profiler.records.extend(records)
+        yield file, file_log, error
+
+
+def map_files(worker, items, jobs=None, slots=None):
+    # Yields worker(*item) for every item in the order of items, no matter
+    # which worker finished first. items can be a generator, it is consumed
+    # in a background thread while the files are processed and at most a
+    # few items per worker are queued at any time. slots are the arguments
+    # of init_slots() for the workers.
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    items = prefetch(items, jobs * 4)
+    if jobs <= 1:
+        for item in items:
+            yield worker(*item)
+        return
+
+    pending = collections.deque()
+    with ProcessPoolExecutor(max_workers=jobs,
+                             initializer=init_slots if slots else None,
+                             initargs=slots or ()) as executor:
+        for item in items:
+            pending.append(executor.submit(worker, *item))
+            if len(pending) >= jobs * 4:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def prefetch(iterable, maxsize):
+    # Iterates over iterable in a background thread, staying at most
+    # maxsize items ahead of the consumer
+    items = queue.Queue(maxsize)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put((True, item)):
+                    return
+            put((False, None))
+        except Exception as e:
+            put((False, e))
+
+    threading.Thread(target=produce, daemon=True).start()
+    try:
+        while True:
+            more, item = items.get()
+            if not more:
+                if item is not None:
+                    raise item
+                return
+            yield item
+    finally:
+        stop.set()
@@ -1,16 +1,103 @@
 import ast
+import collections
+import functools
+import logging
+import re
+import textwrap
+
+try:
+    from .line_buffer import LineBuffer
+except ImportError:
+    from line_buffer import LineBuffer
+
+logger = logging.getLogger("pep8.rules")
 
 
 def apply_rules(lines):
+    return list(format_source(lines).lines)
 
-    lines = find_code(lines, replace_tabs)
-    lines = move_imports_to_start(lines)
-    lines = split_imports(lines)
-    lines = format_newlines(lines)
-    lines = remove_trailing_newlines(lines)
-    lines = split_long_comments(lines)
 
-    return lines
+def format_source(lines, profiler=None, rules=None):
+    # profiler is called instead of every rule, see profiler.Profiler.
+    # rules are the names of the rules to apply, all of them by default.
+    source = SourceFile(lines)
+
+    for name, rule in (RULES if rules is None else schedule(rules)):
+        if profiler is None:
+            rule(source)
+        else:
+            profiler.run(name, rule, source)
+
+    return source
+
+
+class SourceFile:
+    """
+    Lines of a file together with an AST that is shared by all rules.
+
+    The lines are a LineBuffer, rules record their edits on it and apply
+    them in one go. The code is parsed the first time a rule asks for the
+    tree, every line remembers the index it had then, so the line numbers
+    stored in the tree can still be mapped to the current lines. Only an
+    update() with new lines and without that information invalidates the
+    tree and causes another parse. The string and comment spans of the
+    lines are scanned once, lines that are moved keep their spans and only
+    lines added without spans cause another scan.
+    """
+
+    def __init__(self, lines):
+        self.lines = LineBuffer(lines)
+        self.parse_count = 0
+        self.scan_count = 0
+        # what the rules changed, logged as a summary for every file
+        self.counters = collections.Counter()
+        self._tree = None
+        self._parsed = False
+
+    @property
+    def spans(self):
+        if not self.lines.has_spans:
+            self.scan_count += 1
+            self.lines.set_spans(scan(list(self.lines)))
+        return self.lines.spans
+
+    @property
+    def tree(self):
+        if not self._parsed:
+            self._parse()
+        return self._tree
+
+    def _parse(self):
+        self.parse_count += 1
+        self._parsed = True
+        if not self.lines.is_original:
+            # the line numbers of the tree are the indexes of the lines now
+            spans = list(self.lines.spans) if self.lines.has_spans else None
+            self.lines = LineBuffer(list(self.lines), spans=spans)
+        try:
+            self._tree = ast.parse("\n".join(self.lines))
+        except SyntaxError as e:
+            logger.warning("Error parsing code: %s", e)
+            self._tree = None
+
+    def update(self, lines, origins=None, spans=None):
+        # Replaces all lines, for rules that don't edit the buffer.
+        # origins[i] is the index of the new line i in the previous lines
+        # or None if the line is new, without origins the tree is dropped.
+        # spans are the spans of the new lines if the rule knows them.
+        if origins is None:
+            self._parsed = False
+            self._tree = None
+        elif self._parsed:
+            origins = [self.lines.origin(o) if o is not None else None
+                       for o in origins]
+        self.lines = LineBuffer(lines, origins if self._parsed else None,
+                                spans)
+
+    def index_of(self, lineno):
+        # Current index of the line that had the number lineno when the
+        # tree was parsed, None if the line was removed
+        return self.lines.index_of(lineno - 1)
 
 
 # Helper function to check for triple quotes
@@ -21,214 +108,643 @@ def is_triple_quotes(line, idx, char):
         return False
 
 
+CODE = "code"
+STRING = "string"
+COMMENT = "comment"
+
+# Strings (with their prefix) and comments, everything between two matches
+# is code. Unterminated strings end at the end of their line, or at the end
+# of the file for triple quoted strings.
+_STRING_OR_COMMENT = re.compile(r"""
+    (?P<comment>\#[^\n]*)
+  | (?P<string>
+        (?:(?<!\w)[rRbBuUfF]{1,2})?
+        (?: '''(?:[^'\\]|\\.|'(?!''))*(?:'''|\Z)
+          | \"\"\"(?:[^"\\]|\\.|"(?!""))*(?:\"\"\"|\Z)
+          | '(?:[^'\\\n]|\\.)*(?:'|(?=\n)|\Z)
+          | "(?:[^"\\\n]|\\.)*(?:"|(?=\n)|\Z)
+        )
+    )
+""", re.VERBOSE | re.DOTALL)
+
+
+def scan(lines):
+    """
+    Splits every line into code, string and comment spans.
+
+    Returns a list with a list of (kind, start, end) tuples for every line,
+    where start and end are column offsets. Strings spanning several lines
+    are split at the line ends.
+    """
+    spans = [[] for _ in lines]
+    if not lines:
+        return spans
+    line = 0
+    line_start = 0
+
+    def add(kind, start, end):
+        nonlocal line, line_start
+        while start < end:
+            line_end = line_start + len(lines[line])
+            if start >= line_end:
+                # skip the newline between two lines
+                if start == line_end:
+                    start += 1
+                line += 1
+                line_start = line_end + 1
+                continue
+            stop = min(end, line_end)
+            spans[line].append((kind, start - line_start, stop - line_start))
+            start = stop
+
+    text = "\n".join(lines)
+    position = 0
+    for match in _STRING_OR_COMMENT.finditer(text):
+        add(CODE, position, match.start())
+        add(match.lastgroup, match.start(), match.end())
+        position = match.end()
+    add(CODE, position, len(text))
+    return spans
+
+
 def find_code(lines, callback):
     modified_lines = []
-    in_string = False
-    in_triple_quotes = False
-    apostrophe = None
-    for line in lines:
-        modified_line = ""
-        in_comment = False
-        for idx, char in enumerate(line):
-            if in_comment:
-                modified_line += char
+    for line, line_spans in zip(lines, scan(lines)):
+        parts = []
+        for kind, start, end in line_spans:
+            if kind == CODE:
+                # Apply callback to characters outside of strings
+                parts.extend(callback(line, idx) for idx in range(start, end))
             else:
-                # Inside a string
-                if in_string:
-                    modified_line += char
-                    if in_triple_quotes and char == apostrophe:
-                        # Check for triple quotes end
-                        if is_triple_quotes(line, idx, apostrophe):
-                            in_triple_quotes = False
-                            in_string = False
-                    elif char == apostrophe:
-                        in_string = False
-                # Outside of strings
-                else:
-                    if char == "#":
-                        modified_line += char
-                        in_comment = True
-                    elif char in ["'", '"']:
-                        modified_line += char
-                        # Check for triple quotes start
-                        if is_triple_quotes(line, idx, char):
-                            in_triple_quotes = True
-                        in_string = True
-                        apostrophe = char
-                    else:
-                        # Apply callback to characters outside of strings
-                        modified_line += callback(line, idx)
-        modified_lines.append(modified_line)
+                parts.append(line[start:end])
+        modified_lines.append("".join(parts))
 
     return modified_lines
 
 
+def _replace_tabs_in_line(source, line, spans):
+    parts = []
+    new_spans = []
+    length = 0
+    for kind, start, end in spans:
+        part = line[start:end]
+        if kind == CODE:
+            part = part.replace("\t", "    ")
+        parts.append(part)
+        new_spans.append((kind, length, length + len(part)))
+        length += len(part)
+    new_line = "".join(parts)
+    if new_line != line:
+        logger.debug("replaced tab in line: %s", line)
+        source.counters["lines_with_tabs"] += 1
+    return new_line, new_spans
+
+
 def replace_tabs(line, idx):
     if line[idx] == "\t":
-        print(f"replaced tab in line: {line}")
+        logger.debug("replaced tab in line: %s", line)
         return "    "
     else:
         return line[idx]
 
 
 def move_imports_to_start(lines):
-    code = "\n".join(lines)
-    try:
-        tree = ast.parse(code)
-    except SyntaxError as e:
-        print(f"Error parsing code: {e}")
-        return lines
-    
-    imports_on_depth_0 = []
-    for node in tree.body:
-        if isinstance(node, (ast.Import, ast.ImportFrom)):
-            for line in range(node.lineno, node.end_lineno+1):
-                imports_on_depth_0.append(line)
-    if imports_on_depth_0:
-        print(f"Moving imports from lines: {imports_on_depth_0} ")
-
-    indexes = [idx-1 for idx in imports_on_depth_0]
-    moved_lines = [lines[i] for i in indexes]
-    remaining_lines = [line for index, line in enumerate(
-        lines) if index not in indexes]
-    lines = moved_lines + remaining_lines
-    return lines
+    source = SourceFile(lines)
+    _move_imports_to_start(source)
+    return list(source.lines)
+
+
+IMPORTS = (ast.Import, ast.ImportFrom)
+
+
+def _is_docstring(node):
+    return (isinstance(node, ast.Expr)
+            and isinstance(node.value, ast.Constant)
+            and isinstance(node.value.value, str))
+
+
+def _type_checking_name(node):
+    # The name "if TYPE_CHECKING:" or "if typing.TYPE_CHECKING:" with only
+    # imports needs, "TYPE_CHECKING" or "typing", None for other statements
+    if not isinstance(node, ast.If) or node.orelse:
+        return None
+    test = node.test
+    if isinstance(test, ast.Name) and test.id == "TYPE_CHECKING":
+        name = test.id
+    elif (isinstance(test, ast.Attribute) and test.attr == "TYPE_CHECKING"
+            and isinstance(test.value, ast.Name)):
+        name = test.value.id
+    else:
+        return None
+    if all(isinstance(child, IMPORTS) for child in node.body):
+        return name
+    return None
+
+
+def _imported_names(node):
+    # The names an import statement binds
+    for alias in node.names:
+        if alias.asname:
+            yield alias.asname
+        else:
+            yield alias.name.split(".")[0]
+
+
+def _header_end(body):
+    # Number of the last line that stays above the imports, the module
+    # docstring and the comments before the first statement
+    header_end = 0
+    first = 0
+    if body and _is_docstring(body[0]):
+        header_end = body[0].end_lineno
+        first = 1
+    if first < len(body):
+        node = body[first]
+        start = node.lineno
+        if getattr(node, "decorator_list", None):
+            start = node.decorator_list[0].lineno
+        header_end = max(header_end, start - 1)
+    return header_end
+
+
+def _top_level_imports(body):
+    # The line numbers of the top level __future__ imports, other imports
+    # and "if TYPE_CHECKING:" blocks with only imports. A block is only
+    # moved when TYPE_CHECKING, or typing for typing.TYPE_CHECKING, is
+    # bound by one of the moved imports, it would be undefined above an
+    # assignment like "TYPE_CHECKING = False".
+    future_imports = []
+    imports = []
+    blocks = []
+    imported = set()
+    for position, node in enumerate(body):
+        # a line that also holds another statement after a semicolon stays
+        if ((position > 0 and body[position - 1].end_lineno == node.lineno)
+                or (position + 1 < len(body)
+                    and body[position + 1].lineno == node.end_lineno)):
+            continue
+        if isinstance(node, IMPORTS):
+            if (isinstance(node, ast.ImportFrom)
+                    and node.module == "__future__"):
+                group = future_imports
+            else:
+                group = imports
+                imported.update(_imported_names(node))
+            group.extend(range(node.lineno, node.end_lineno + 1))
+        else:
+            name = _type_checking_name(node)
+            if name is not None:
+                blocks.append((name, node))
+    type_checking_blocks = []
+    for name, node in blocks:
+        if name in imported:
+            type_checking_blocks.extend(range(node.lineno,
+                                              node.end_lineno + 1))
+    return future_imports, imports, type_checking_blocks
+
+
+def _move_imports_to_start(source, header_end=None):
+    # Imports are moved below the header in one pass, __future__ imports
+    # first and "if TYPE_CHECKING:" blocks with only imports last.
+    # header_end is the number of the last line of the header, by default
+    # the module docstring and the comments before the first statement.
+    tree = source.tree
+    if tree is None:
+        return
+    lines = source.lines
+    body = tree.body
+
+    future_imports, imports, type_checking_blocks = _top_level_imports(body)
+    imports_on_depth_0 = future_imports + imports + type_checking_blocks
+    if not imports_on_depth_0:
+        return
+    logger.debug("Moving imports from lines: %s", imports_on_depth_0)
+    source.counters["imports_moved"] += len(imports_on_depth_0)
+
+    if header_end is None:
+        header_end = _header_end(body)
+    header_length = source.index_of(header_end) + 1 if header_end else 0
+    indexes = [source.index_of(idx) for idx in imports_on_depth_0]
+    indexes = [idx for idx in indexes if idx is not None]
+    # consecutive lines are moved together
+    start = 0
+    for position in range(1, len(indexes) + 1):
+        if (position == len(indexes)
+                or indexes[position] != indexes[position - 1] + 1):
+            lines.move(indexes[start], indexes[position - 1] + 1,
+                       header_length)
+            start = position
+    lines.apply()
 
 
 def split_imports(lines):
-    indent_level = 0
+    source = SourceFile(lines)
+    _split_imports(source)
+    return list(source.lines)
+
+
+def _statements(tree):
+    # Yields every statement with the statements before and after it in
+    # the same block, None at the start and end of a block
+    for node in ast.walk(tree):
+        for field in ("body", "orelse", "finalbody"):
+            block = getattr(node, field, None)
+            if not isinstance(block, list):
+                continue
+            for position, statement in enumerate(block):
+                if isinstance(statement, ast.stmt):
+                    yield (block[position - 1] if position else None,
+                           statement,
+                           block[position + 1] if position + 1 < len(block)
+                           else None)
+
+
+def _split_import_node(source, node):
+    # Returns the index of the first and last line of the import and the
+    # lines that replace them, or None if the lines can't be replaced
+    start = source.index_of(node.lineno)
+    end = source.index_of(node.end_lineno)
+    if start is None or end is None:
+        return None
+    line = source.lines[start]
+    code = line.lstrip()
+    if not code.startswith("import"):
+        return None
+    indent = line[:len(line) - len(code)]
+    comment = ""
+    for kind, span_start, span_end in source.spans[end]:
+        if kind == COMMENT:
+            comment = "  " + source.lines[end][span_start:span_end]
+
+    new_lines = []
+    for alias in node.names:
+        new_line = indent + "import " + alias.name
+        if alias.asname:
+            new_line += " as " + alias.asname
+        new_lines.append(new_line)
+    new_lines[0] += comment
+    return start, end, new_lines
+
+
+def _split_imports(source):
+    # Every import of several modules is replaced with one import per
+    # module while the new lines are built in one pass
+    if not any("import" in line and "," in line for line in source.lines):
+        return
+    tree = source.tree
+    if tree is None:
+        _split_import_lines(source)
+        return
+    lines = source.lines
+
+    replacements = {}
+    for previous, node, following in _statements(tree):
+        if not isinstance(node, ast.Import) or len(node.names) < 2:
+            continue
+        # an import sharing a line with another statement is left alone
+        if ((previous is not None and previous.end_lineno == node.lineno)
+                or (following is not None
+                    and following.lineno == node.end_lineno)):
+            continue
+        replacement = _split_import_node(source, node)
+        if replacement is not None:
+            start, end, new_lines = replacement
+            logger.debug("Splitting imports in line %d: %s", start,
+                         lines[start])
+            source.counters["imports_split"] += len(new_lines) - 1
+            replacements[start] = (end, new_lines)
+    _apply_replacements(source, replacements)
+
+
+def _apply_replacements(source, replacements):
+    # replacements maps the index of the first of the lines that are
+    # replaced to the index of the last one and the new lines
+    for start, (end, replacement) in replacements.items():
+        source.lines.replace(start, end + 1, replacement)
+    source.lines.apply()
+
+
+def _split_import_lines(source):
+    # Used when the code can't be parsed, splits lines starting with import
+    # at every comma
+    lines = source.lines
     for idx, line in enumerate(lines):
         if line.strip().startswith("import"):
             imports = line.split(",")
             if len(imports) > 1:
-                print(f"Splitting imports in line {idx}: {line}")
+                logger.debug("Splitting imports in line %d: %s", idx, line)
+                source.counters["imports_split"] += len(imports) - 1
                 # Adjust indent to match the original line's indentation level
                 indent = line[:line.find("import")]
-                indent_level = len(indent)
-                lines[idx] = imports[0]
-
-                for package in imports[1:]:
-                    package = package.strip()
-                    idx += 1
-                    # Insert new import line with the same indentation level
-                    lines.insert(idx, " " * indent_level + "import " + package)
-    return lines
+                lines.replace(idx, idx + 1, [imports[0]] + [
+                    indent + "import " + package.strip()
+                    for package in imports[1:]])
+    lines.apply()
 
 
 def format_newlines_between_functions_and_classes(lines):
-    code = "\n".join(lines)
-    try:
-        tree = ast.parse(code)
-    except SyntaxError as e:
-        print(f"Error parsing code: {e}")
-        return lines
-    
-    function_and_class_starts = []
-    for node in tree.body:
-        if isinstance(node, (ast.FunctionDef, ast.ClassDef)):
-            function_and_class_starts.append(node.lineno)
-    if function_and_class_starts:
-        print("Formatting newlines between functions and classes...")
-
-    function_and_class_starts = [x - 1 for x in function_and_class_starts]
-    idx = 0
-    while idx < len(function_and_class_starts):
-        current_line = function_and_class_starts[idx]
-        while (current_line >= 1
-               and (lines[current_line - 1].strip() == ""
-                    or lines[current_line - 1].strip().startswith("@"))):
-            if lines[current_line - 1].strip().startswith("@"):
-                current_line -= 1
-            else:
-                lines.pop(current_line - 1)
-                function_and_class_starts = [x - 1 for x
-                                             in function_and_class_starts]
-                current_line -= 1
-                
-        if current_line > 0:
-            lines.insert(current_line, "")
-            lines.insert(current_line, "")
-            function_and_class_starts = [x + 2 for x
-                                         in function_and_class_starts]
-        idx += 1
-
-    return lines
+    source = SourceFile(lines)
+    _format_newlines(source, methods=False)
+    return list(source.lines)
 
 
 def format_newlines_between_methods(lines):
-    code = "\n".join(lines)
-    try:
-        tree = ast.parse(code)
-    except SyntaxError as e:
-        print(f"Error parsing code: {e}")
-        return lines
-    
-    method_starts = []
-    for node in tree.body:
-        if isinstance(node, ast.ClassDef):
-            for class_node in node.body:
-                if isinstance(class_node, ast.FunctionDef):
-                    method_starts.append(class_node.lineno)
-    if method_starts:
-        print("Formatting newlines between methods...")
-
-    method_starts = [x - 1 for x in method_starts]
-    idx = 0
-    while idx < len(method_starts):
-        current_line = method_starts[idx]
-        while (current_line >= 1
-               and (lines[current_line - 1].strip() == ""
-                    or lines[current_line - 1].strip().startswith("@"))):
-            if lines[current_line - 1].strip().startswith("@"):
-                current_line -= 1
+    source = SourceFile(lines)
+    _format_newlines(source, top_level=False)
+    return list(source.lines)
+
+
+def format_newlines(lines):
+    source = SourceFile(lines)
+    _format_newlines(source)
+    return list(source.lines)
+
+
+DEFINITIONS = (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)
+
+
+def _find_definitions(source, top_level=True, methods=True):
+    # Returns a dict mapping the index of the first line of a definition
+    # (its first decorator if it has any) to the number of blank lines
+    # required above it, and the set of indexes of the lines between its
+    # decorators and the definition, lines inside a decorator aren't in it
+    blank_lines = {}
+    decorator_lines = set()
+
+    def add(node, count):
+        start = source.index_of(node.lineno)
+        top = start
+        if node.decorator_list:
+            top = source.index_of(node.decorator_list[0].lineno)
+            following = node.decorator_list[1:] + [node]
+            for decorator, next_node in zip(node.decorator_list, following):
+                decorator_lines.update(range(
+                    source.index_of(decorator.end_lineno) + 1,
+                    source.index_of(next_node.lineno)))
+        blank_lines[top] = count
+
+    def add_class_body(class_node):
+        for node in class_node.body:
+            if isinstance(node, DEFINITIONS):
+                add(node, 1)
+            if isinstance(node, ast.ClassDef):
+                add_class_body(node)
+
+    for node in source.tree.body:
+        if isinstance(node, DEFINITIONS):
+            if top_level:
+                add(node, 2)
+            if methods and isinstance(node, ast.ClassDef):
+                add_class_body(node)
+    return blank_lines, decorator_lines
+
+
+def _format_newlines(source, top_level=True, methods=True):
+    # Single pass over the lines: blank lines are held back until the next
+    # line with code shows whether they are kept or replaced with the
+    # number of blank lines the definition starting there requires
+    tree = source.tree
+    if tree is None:
+        return
+    blank_lines, decorator_lines = _find_definitions(source, top_level,
+                                                     methods)
+    if not blank_lines:
+        return
+    if top_level:
+        logger.debug("Formatting newlines between functions and classes...")
+    if methods:
+        logger.debug("Formatting newlines between methods...")
+
+    lines = source.lines
+    # whether there is code above the current line
+    code_above = False
+    pending = []
+    # whether a pending blank line has whitespace left to remove
+    pending_whitespace = False
+    for idx, line in enumerate(lines):
+        if line.strip() == "":
+            # blank lines between decorators and the definition are removed
+            if idx in decorator_lines:
+                lines.delete(idx, idx + 1)
+                source.counters["blank_lines_removed"] += 1
             else:
-                lines.pop(current_line - 1)
-                method_starts = [x - 1 for x in method_starts]
-                current_line -= 1
+                pending.append(idx)
+                pending_whitespace = pending_whitespace or line != ""
+            continue
+        count = blank_lines.get(idx)
+        # a definition at the start of the file needs no blank lines
+        if count is not None and (code_above or count == 1) and (
+                len(pending) != count or pending_whitespace):
+            start = pending[0] if pending else idx
+            lines.replace(start, start + len(pending), [""] * count,
+                          [[]] * count)
+            _count_blank_lines(source, count - len(pending))
+        elif count is not None and not code_above and pending:
+            lines.delete(pending[0], pending[-1] + 1)
+            _count_blank_lines(source, -len(pending))
+        pending = []
+        pending_whitespace = False
+        code_above = True
+    lines.apply()
+
+
+def _count_blank_lines(source, added):
+    if added > 0:
+        source.counters["blank_lines_added"] += added
+    elif added < 0:
+        source.counters["blank_lines_removed"] -= added
 
-        lines.insert(current_line, "")
-        method_starts = [x + 1 for x in method_starts]
-        idx += 1
 
-    return lines
+def split_long_comments(lines, max_length=79):
+    source = SourceFile(lines)
+    _split_long_comments(source, max_length)
+    return list(source.lines)
+
+
+# Comments that only apply to their own line are never moved or reflowed
+_LINE_PRAGMAS = ("type:", "noqa", "pragma", "pylint:", "fmt:")
+# Docstring lines that start a list, a doctest or a directive
+_STRUCTURED_TEXT = re.compile(r"(>>>|\.\.\s|[-*+]\s|\d+[.)]\s|:)")
+# The underline of a numpy section header and a Google section header
+_SECTION_UNDERLINE = re.compile(r"-{3,}|={3,}")
+_SECTION_HEADER = re.compile(r"\w+( \w+)?:")
+# The PEP 263 encoding declaration, only read on the first two lines
+_CODING_COOKIE = re.compile(r"#.*?coding[:=]")
+
+
+def _wrap(text, indent, prefix, max_length):
+    # the width includes the indent and the prefix, reflowed lines have
+    # always been kept shorter than max_length. Runs of whitespace are
+    # collapsed, so wrapped text wraps the same again.
+    return textwrap.wrap(" ".join(text.split()), width=max(max_length - 1,
+                                         len(indent) + len(prefix) + 20),
+                         initial_indent=indent + prefix,
+                         subsequent_indent=indent + prefix,
+                         break_long_words=False, break_on_hyphens=False)
+
+
+def _split_long_comments(source, max_length=79):
+    # Streams over the lines holding only the current block of comment
+    # lines. A block ends at a line that isn't a comment or at a comment
+    # with a different indent, and is reflowed only if one of its lines is
+    # too long. Long trailing comments are moved above their line.
+    _reflow_docstrings(source, max_length)
+    lines = source.lines
+    if not any(len(line) > max_length for line in lines):
+        return
+    block = []
+    block_indent = ""
+    definitions = {}
+    if source.tree is not None:
+        definitions = _find_definitions(source)[0]
+
+    def flush():
+        # a line that is too long but a single word, like a URL, can't be
+        # shortened, the block is left alone unless another line can
+        if not any(len(lines[idx]) > max_length
+                   and len(lines[idx].lstrip()[1:].split()) > 1
+                   for idx in block):
+            block.clear()
+            return
+        source.counters["comment_blocks_reflowed"] += 1
+        new_lines = []
+        paragraph = []
+        for idx in block + [None]:
+            text = lines[idx].lstrip()[1:].strip() if idx is not None \
+                else ""
+            if text:
+                paragraph.append(idx)
+                continue
+            # empty comment lines separate paragraphs
+            words = " ".join(lines[i].lstrip()[1:].strip() for i in paragraph)
+            new_lines.extend(_wrap(words, block_indent, "# ", max_length))
+            paragraph = []
+            if idx is not None:
+                new_lines.append(lines[idx])
+        lines.replace(block[0], block[-1] + 1, new_lines)
+        block.clear()
+
+    for idx, line in enumerate(lines):
+        stripped = line.lstrip()
+        indent = line[:len(line) - len(stripped)]
+        spans = source.spans[idx] if "#" in line else ()
+        if (stripped.startswith("#") and spans
+                and spans[-1] == (COMMENT, len(indent), len(line))):
+            # the shebang, the encoding declaration and pragmas end the
+            # block and are never reflowed
+            if (idx == 0 and stripped.startswith("#!")
+                    or idx < 2 and _CODING_COOKIE.match(stripped)
+                    or stripped[1:].strip().startswith(_LINE_PRAGMAS)):
+                flush()
+                continue
+            if block and indent != block_indent:
+                flush()
+            block.append(idx)
+            block_indent = indent
+            continue
+        flush()
+
+        if (len(line) > max_length and spans and spans[0][0] == CODE
+                and spans[-1][0] == COMMENT
+                and not (idx > 0 and lines[idx - 1].endswith("\\"))):
+            comment_start = spans[-1][1]
+            code = line[:comment_start].rstrip()
+            text = line[comment_start + 1:].strip()
+            if code.strip() and not text.startswith(_LINE_PRAGMAS):
+                logger.debug("Moving trailing comment above line %d", idx)
+                source.counters["trailing_comments_moved"] += 1
+                # above a definition the comment goes above its blank
+                # lines, format_newlines puts them right above the
+                # definition
+                above = idx
+                while (idx in definitions and above > 0
+                       and not lines[above - 1].strip()):
+                    above -= 1
+                lines.insert(above, _wrap(text, indent, "# ", max_length))
+                lines.replace(idx, idx + 1, [code])
+    flush()
+    lines.apply()
+
+
+def _reflow_docstrings(source, max_length):
+    # Paragraphs of plain text in multi-line docstrings are refilled when
+    # one of their lines is too long, the summary line is left alone
+    lines = source.lines
+    if not any(len(line) > max_length and source.spans[idx]
+               and source.spans[idx][0][0] == STRING
+               for idx, line in enumerate(lines)):
+        return
+    tree = source.tree
+    if tree is None:
+        return
+
+    replacements = {}
+    for node in ast.walk(tree):
+        if not isinstance(node, (ast.Module,) + DEFINITIONS) or not (
+                node.body and _is_docstring(node.body[0])):
+            continue
+        start = source.index_of(node.body[0].lineno)
+        end = source.index_of(node.body[0].end_lineno)
+        if (start is None or end is None
+                or not _is_triple_quoted(source, start, end)):
+            continue
+        # Paragraphs are the lines between the opening and the closing
+        # line, they end at blank lines, lists, doctests, section headers
+        # and lines indented differently from the opening line, like code
+        # examples
+        paragraph = []
+        indent = _indent(lines[start])
+        for idx in range(start + 1, end):
+            line = lines[idx]
+            text = line.lstrip()
+            if (not text or _STRUCTURED_TEXT.match(text)
+                    or _indent(line) != indent
+                    or _SECTION_HEADER.fullmatch(text)
+                    or _SECTION_UNDERLINE.fullmatch(text)
+                    or idx + 1 < end and _SECTION_UNDERLINE.fullmatch(
+                        lines[idx + 1].strip())):
+                _reflow_paragraph(lines, paragraph, max_length, replacements)
+                paragraph = []
+                continue
+            paragraph.append(idx)
+        _reflow_paragraph(lines, paragraph, max_length, replacements)
+    _apply_replacements(source, replacements)
+
+
+def _is_triple_quoted(source, start, end):
+    # True if the lines are one triple-quoted literal, docstrings joined
+    # from several literals can't be refilled as plain text
+    lines = source.lines
+    spans = source.spans[start]
+    if not spans or spans[-1] != (STRING, spans[-1][1], len(lines[start])):
+        return False
+    opening = lines[start][spans[-1][1]:].lstrip("rRuU")
+    return opening.startswith(('"""', "'''")) and all(
+        source.spans[idx] in ([], [(STRING, 0, len(lines[idx]))])
+        for idx in range(start + 1, end))
 
 
-def format_newlines(lines):
-    lines = format_newlines_between_functions_and_classes(lines)
-    lines = format_newlines_between_methods(lines)
-    return lines
+def _indent(line):
+    return line[:len(line) - len(line.lstrip())]
 
 
-def split_long_comments(lines, max_length=79):
-    new_lines = []
-    comment_buffer = ''
-    indent_level = 0
-    for line in lines:
-        if line.strip().startswith("#"):
-            indent = line[:line.find("#")]
-            indent_level = len(indent)
-            comment_buffer += line.strip()[1:].strip() + ' '
-        else:
-            while len(comment_buffer) > max_length - 2 - indent_level:
-                split_index = comment_buffer.rfind(" ", 0, max_length
-                                                   - 2 - indent_level)
-                if split_index == -1:
-                    split_index = max_length
-                new_lines.append(" " * indent_level + "# "
-                                 + comment_buffer[:split_index])
-                comment_buffer = comment_buffer[split_index:].strip()
-            
-            # append the leftover
-            if comment_buffer:
-                new_lines.append(" " * indent_level + "# " + comment_buffer)
-                comment_buffer = ''
-            
-            new_lines.append(line)
-
-    if comment_buffer:
-        new_lines.append("# " + comment_buffer)
-
-    return new_lines
+def _reflow_paragraph(lines, paragraph, max_length, replacements):
+    # like a comment block, left alone if its long lines are single words
+    if not any(len(lines[idx]) > max_length
+               and len(lines[idx].split()) > 1 for idx in paragraph):
+        return
+    text = " ".join(lines[idx].strip() for idx in paragraph)
+    wrapped = _wrap(text, _indent(lines[paragraph[0]]), "", max_length)
+    replacements[paragraph[0]] = (paragraph[-1], wrapped)
+
+
+def _remove_trailing_newlines(source):
+    lines = source.lines
+    end = len(lines)
+    while end > 0 and lines[end - 1].strip() == "":
+        end -= 1
+    lines.delete(end, len(lines))
+    lines.apply()
 
 
 def remove_trailing_newlines(lines):
@@ -238,3 +754,140 @@ def remove_trailing_newlines(lines):
         while len(lines) > 0 and lines[-1].strip() == "":
             lines.pop()
     return lines
+
+
+class Rule:
+    """
+    A rule together with what the scheduler needs to know about it.
+
+    needs names what the rule reads: "lines", "spans" (see scan()) or
+    "tree", and invalidates what is out of date after it changed the
+    lines. after names the rules that have to run before it when they are
+    selected. A line-local rule is called as function(source, line, spans)
+    for every line containing trigger (every line if it is None) and
+    returns the new line and its spans.
+    """
+
+    def __init__(self, name, function, needs=("lines",),
+                 invalidates=("spans",), after=(), line_local=False,
+                 trigger=None):
+        self.name = name
+        self.function = function
+        self.needs = frozenset(needs)
+        self.invalidates = frozenset(invalidates)
+        self.after = tuple(after)
+        self.line_local = line_local
+        self.trigger = trigger
+
+
+REGISTRY = {}
+
+
+def register(rule):
+    REGISTRY[rule.name] = rule
+    schedule.cache_clear()
+    return rule
+
+
+def _run_line_rules(source, rules):
+    # One pass over the lines for consecutive line-local rules. Lines
+    # without the trigger of any rule are skipped, so a file without them
+    # is never scanned.
+    lines = source.lines
+    for idx, line in enumerate(lines):
+        new_line = line
+        line_spans = None
+        for rule in rules:
+            if rule.trigger is not None and rule.trigger not in new_line:
+                continue
+            if line_spans is None:
+                line_spans = source.spans[idx]
+            new_line, line_spans = rule.function(source, new_line,
+                                                 line_spans)
+        if new_line != line:
+            lines.replace(idx, idx + 1, [new_line], [line_spans])
+    lines.apply()
+
+
+# How expensive it is to bring what a rule needs up to date
+_COSTS = {"lines": 0, "spans": 1, "tree": 2}
+
+
+@functools.lru_cache(maxsize=None)
+def schedule(names=None):
+    """
+    Orders the rules called names, all registered rules by default.
+
+    Returns a list of (name, function) pairs, calling function(source)
+    runs one pass over the file. A rule runs after the rules it names in
+    after. Of the rules that could run next, the one whose needs are the
+    cheapest to bring up to date runs first, and consecutive line-local
+    rules are merged into one pass named after all of them. Raises
+    ValueError for unknown names.
+    """
+    if names is None:
+        names = tuple(REGISTRY)
+    _check_names(names)
+    pending = [rule for rule in REGISTRY.values() if rule.name in names]
+    selected = {rule.name for rule in pending}
+
+    passes = []
+    valid = {"lines"}
+    while pending:
+        ready = [rule for rule in pending
+                 if not any(name in selected for name in rule.after)]
+        if not ready:
+            raise ValueError("Rules can't be ordered: "
+                             + ", ".join(rule.name for rule in pending))
+        merging = bool(passes) and isinstance(passes[-1], list)
+        # min() keeps the registration order between rules of equal cost
+        rule = min(ready, key=lambda rule: (
+            sum(_COSTS[need] for need in rule.needs - valid),
+            not (merging and rule.line_local)))
+        pending.remove(rule)
+        selected.discard(rule.name)
+        valid = (valid | rule.needs) - rule.invalidates
+        if not rule.line_local:
+            passes.append((rule.name, rule.function))
+        elif merging:
+            passes[-1].append(rule)
+        else:
+            passes.append([rule])
+    return [("+".join(rule.name for rule in step),
+             functools.partial(_run_line_rules, rules=step))
+            if isinstance(step, list) else step for step in passes]
+
+
+def select_rules(select=None, ignore=()):
+    # Names of the rules in select (all rules by default) that aren't in
+    # ignore, raises ValueError for unknown names
+    names = tuple(REGISTRY) if not select else tuple(select)
+    _check_names(names + tuple(ignore))
+    return tuple(name for name in REGISTRY
+                 if name in names and name not in ignore)
+
+
+def _check_names(names):
+    unknown = sorted(set(names) - set(REGISTRY))
+    if unknown:
+        raise ValueError(f"Unknown rule{'s' if len(unknown) > 1 else ''}: "
+                         f"{', '.join(unknown)}")
+
+
+register(Rule("replace_tabs", _replace_tabs_in_line, needs=("spans",),
+              invalidates=(), line_local=True, trigger="\t"))
+register(Rule("move_imports_to_start", _move_imports_to_start,
+              needs=("tree",), invalidates=()))
+register(Rule("split_imports", _split_imports, needs=("tree", "spans"),
+              after=("move_imports_to_start",)))
+register(Rule("format_newlines", _format_newlines, needs=("tree",),
+              invalidates=(), after=("move_imports_to_start",
+                                     "split_imports")))
+register(Rule("remove_trailing_newlines", _remove_trailing_newlines,
+              invalidates=(), after=("format_newlines",)))
+register(Rule("split_long_comments", _split_long_comments,
+              needs=("spans", "tree"),
+              after=("replace_tabs", "remove_trailing_newlines")))
+
+# The passes format_source runs by default
+RULES = schedule()
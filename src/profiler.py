@@ -0,0 +1,113 @@
+import collections
+import json
+import time
+import tracemalloc
+
+FIELDS = ("seconds", "allocated_bytes", "peak_bytes", "lines_in",
+          "lines_out", "edits")
+
+
+class Profiler:
+    """
+    Records the cost of every rule on every file.
+
+    pep8.format_source calls run() instead of the rule when it is given a
+    profiler. For every rule the wall time, the memory allocated and the
+    peak memory while it ran (with trace_memory), the number of lines
+    before and after and the number of edits are recorded. Edits are the
+    lines added plus the lines removed, so moving a line isn't an edit.
+    """
+
+    def __init__(self, file=None, trace_memory=True):
+        self.file = file
+        self.trace_memory = trace_memory
+        self.records = []
+
+    def run(self, name, rule, source):
+        lines_before = list(source.lines)
+        tracing = self.trace_memory and not tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.start()
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+            memory_before = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        try:
+            return rule(source)
+        finally:
+            seconds = time.perf_counter() - start
+            allocated = peak = 0
+            if self.trace_memory:
+                memory, peak = tracemalloc.get_traced_memory()
+                allocated = max(0, memory - memory_before)
+                peak = max(0, peak - memory_before)
+            if tracing:
+                tracemalloc.stop()
+            self.records.append({
+                "file": self.file,
+                "rule": name,
+                "seconds": seconds,
+                "allocated_bytes": allocated,
+                "peak_bytes": peak,
+                "lines_in": len(lines_before),
+                "lines_out": len(source.lines),
+                "edits": count_edits(lines_before, source.lines),
+            })
+
+    def totals(self, key):
+        # Sums of the fields for every file or every rule, key is "file"
+        # or "rule"
+        totals = collections.defaultdict(lambda: dict.fromkeys(FIELDS, 0))
+        for record in self.records:
+            total = totals[record[key]]
+            for field in FIELDS:
+                total[field] += record[field]
+        return dict(totals)
+
+    def report(self, limit=10):
+        lines = []
+        for key in ("file", "rule"):
+            totals = sorted(self.totals(key).items(),
+                            key=lambda item: item[1]["seconds"],
+                            reverse=True)[:limit]
+            lines.append(f"{'Slowest ' + key + 's':<50}{'ms':>10}"
+                         f"{'alloc KiB':>11}{'peak KiB':>10}{'edits':>8}")
+            for name, total in totals:
+                name = str(name)
+                if len(name) > 48:
+                    name = "..." + name[-45:]
+                lines.append(f"{name:<50}{total['seconds'] * 1000:>10.2f}"
+                             f"{total['allocated_bytes'] / 1024:>11,.0f}"
+                             f"{total['peak_bytes'] / 1024:>10,.0f}"
+                             f"{total['edits']:>8}")
+            lines.append("")
+        return "\n".join(lines)
+
+    def to_json(self):
+        return json.dumps({"records": self.records,
+                           "rules": self.totals("rule")}, indent=2)
+
+    def to_prometheus(self):
+        # Totals per rule in the Prometheus text exposition format, files
+        # aren't used as labels to keep the number of series small
+        totals = self.totals("rule")
+        lines = ["# HELP pep8_files_total Files formatted",
+                 "# TYPE pep8_files_total counter",
+                 f"pep8_files_total "
+                 f"{len({record['file'] for record in self.records})}"]
+        for field in FIELDS:
+            metric = f"pep8_rule_{field}_total"
+            lines.append(f"# HELP {metric} Sum of {field} of every rule "
+                         f"over all files")
+            lines.append(f"# TYPE {metric} counter")
+            for rule, total in totals.items():
+                lines.append(f'{metric}{{rule="{rule}"}} {total[field]}')
+        return "\n".join(lines) + "\n"
+
+
+def count_edits(lines_before, lines_after):
+    if lines_before == lines_after:
+        return 0
+    before = collections.Counter(lines_before)
+    after = collections.Counter(lines_after)
+    return sum((before - after).values()) + sum((after - before).values())
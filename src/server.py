@@ -0,0 +1,263 @@
+import asyncio
+import difflib
+import json
+import logging
+import multiprocessing
+import os
+import sys
+
+try:
+    from . import file_handler
+    from . import log
+    from . import pep8
+except ImportError:
+    import file_handler
+    import log
+    import pep8
+
+logger = logging.getLogger("pep8.server")
+
+PARSE_ERROR = -32700
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+TIMEOUT = -32000
+FORMAT_ERROR = -32001
+
+MAX_REQUEST_SIZE = 64 * 1024 * 1024
+
+
+def format_text(source):
+    # Returns the formatted source and the edits turning source into it,
+    # every edit replaces the lines [start, end) of source with lines
+    original = file_handler.split_lines(source, strip=False)
+    with log.capture(level=logging.CRITICAL):
+        lines = pep8.apply_rules([line.rstrip() for line in original])
+    newline = file_handler.detect_newline(source)
+    formatted = "".join(line + newline for line in lines)
+    matcher = difflib.SequenceMatcher(None, original, lines, autojunk=False)
+    edits = [{"start": i1, "end": i2, "lines": lines[j1:j2]}
+             for tag, i1, i2, j1, j2 in matcher.get_opcodes()
+             if tag != "equal"]
+    return formatted, edits
+
+
+class Server:
+    """
+    JSON-RPC 2.0 server formatting source text.
+
+    Requests and responses are JSON objects, one per line. The "format"
+    method takes {"source": text} and returns {"source": formatted,
+    "edits": [...]}. Requests are formatted concurrently in up to jobs
+    worker processes, responses are sent as soon as they are ready and can
+    come in any order. Once max_pending requests are in progress no more
+    requests are read. A request taking longer than timeout seconds gets an
+    error and its worker is killed, a new one takes its place, so slow
+    requests can't hold up the others.
+    """
+
+    def __init__(self, jobs=None, timeout=10.0, max_pending=None):
+        self.jobs = jobs or os.cpu_count() or 1
+        self.timeout = timeout
+        self._pending = asyncio.Semaphore(max_pending or self.jobs * 4)
+        self._workers = set()
+        self._idle = asyncio.Queue()
+
+    def close(self):
+        for worker in self._workers:
+            worker.kill()
+        self._workers.clear()
+
+    async def handle(self, message):
+        # Returns the response to one request line, None for notifications
+        try:
+            request = json.loads(message)
+        except ValueError as e:
+            return _error(None, PARSE_ERROR, f"Parse error: {e}")
+        if not isinstance(request, dict) or "method" not in request:
+            return _error(None, INVALID_REQUEST, "Invalid request")
+        request_id = request.get("id")
+        method = request["method"]
+        params = request.get("params") or {}
+        if method != "format":
+            response = _error(request_id, METHOD_NOT_FOUND,
+                              f"Method not found: {method}")
+        elif not isinstance(params, dict) or not isinstance(
+                params.get("source"), str):
+            response = _error(request_id, INVALID_PARAMS,
+                              "params.source must be a string")
+        else:
+            response = await self._format(request_id, params["source"])
+        return response if "id" in request else None
+
+    async def _format(self, request_id, source):
+        try:
+            result, error = await asyncio.wait_for(self._run(source),
+                                                   self.timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Request %s timed out after %s seconds",
+                           request_id, self.timeout)
+            return _error(request_id, TIMEOUT,
+                          f"Timed out after {self.timeout} seconds")
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        if error is not None:
+            return _error(request_id, FORMAT_ERROR, error)
+        formatted, edits = result
+        return {"jsonrpc": "2.0", "id": request_id,
+                "result": {"source": formatted, "edits": edits}}
+
+    async def _run(self, source):
+        # Formats source in an idle worker, starting one if fewer than jobs
+        # are running. A worker that is cancelled by the timeout or dies is
+        # killed and forgotten, and None takes its place in the idle queue
+        # so the next request waiting for a worker starts a new one.
+        if self._idle.empty() and len(self._workers) < self.jobs:
+            worker = None
+        else:
+            worker = await self._idle.get()
+        if worker is None:
+            worker = _Worker()
+            self._workers.add(worker)
+        loop = asyncio.get_running_loop()
+        try:
+            result = await loop.run_in_executor(None, worker.format, source)
+        except BaseException:
+            self._workers.discard(worker)
+            worker.kill()
+            self._idle.put_nowait(None)
+            raise
+        self._idle.put_nowait(worker)
+        return result
+
+    async def serve(self, reader, writer):
+        # Answers the requests of one client until it disconnects
+        tasks = set()
+        lock = asyncio.Lock()
+
+        async def respond(message):
+            try:
+                response = await self.handle(message)
+                if response is not None:
+                    async with lock:
+                        writer.write(json.dumps(response).encode() + b"\n")
+                        await writer.drain()
+            except ConnectionError:
+                pass
+            finally:
+                self._pending.release()
+
+        try:
+            while True:
+                # a full server stops reading, so clients have to wait
+                await self._pending.acquire()
+                try:
+                    message = await reader.readline()
+                except (ValueError, ConnectionError) as e:
+                    self._pending.release()
+                    logger.warning("Closing the connection: %s", e)
+                    break
+                if not message:
+                    self._pending.release()
+                    break
+                if not message.strip():
+                    self._pending.release()
+                    continue
+                task = asyncio.ensure_future(respond(message))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.wait(tasks)
+        finally:
+            writer.close()
+
+
+class _Worker:
+    # A process formatting one source at a time, unlike a process pool
+    # worker it can be killed while it is busy
+
+    def __init__(self):
+        self._connection, child = multiprocessing.Pipe()
+        self._process = multiprocessing.Process(target=_work, args=(child,),
+                                                daemon=True)
+        self._process.start()
+        child.close()
+
+    def format(self, source):
+        # Returns (format_text(source), None) or (None, error), runs in a
+        # thread. Raises EOFError when the process is killed meanwhile.
+        self._connection.send(source)
+        return self._connection.recv()
+
+    def kill(self):
+        self._process.kill()
+        self._process.join()
+
+
+def _work(connection):
+    # Runs in a worker process until the server closes the connection
+    while True:
+        try:
+            source = connection.recv()
+        except EOFError:
+            return
+        try:
+            connection.send((format_text(source), None))
+        except Exception as e:
+            connection.send((None, f"{type(e).__name__}: {e}"))
+
+
+def _error(request_id, code, message):
+    return {"jsonrpc": "2.0", "id": request_id,
+            "error": {"code": code, "message": message}}
+
+
+async def serve_socket(path, **kwargs):
+    # Serves the clients connecting to the Unix socket at path until
+    # cancelled
+    server = Server(**kwargs)
+    try:
+        unix_server = await asyncio.start_unix_server(
+            server.serve, path, limit=MAX_REQUEST_SIZE)
+        logger.info("Listening on %s", path)
+        async with unix_server:
+            await unix_server.serve_forever()
+    finally:
+        server.close()
+        if os.path.exists(path):
+            os.remove(path)
+
+
+async def serve_stdio(**kwargs):
+    # Serves the requests read from stdin until it is closed, the responses
+    # are written to stdout
+    server = Server(**kwargs)
+    try:
+        await server.serve(_StdinReader(), _StdoutWriter())
+    finally:
+        server.close()
+
+
+class _StdinReader:
+    # stdin can be a file or a terminal that asyncio can't read from, so it
+    # is read in a thread
+
+    async def readline(self):
+        loop = asyncio.get_running_loop()
+        line = await loop.run_in_executor(None, sys.stdin.buffer.readline,
+                                          MAX_REQUEST_SIZE + 1)
+        if len(line) > MAX_REQUEST_SIZE:
+            raise ValueError("Request is too large")
+        return line
+
+
+class _StdoutWriter:
+
+    def write(self, data):
+        sys.stdout.buffer.write(data)
+
+    async def drain(self):
+        sys.stdout.buffer.flush()
+
+    def close(self):
+        sys.stdout.buffer.flush()
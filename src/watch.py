@@ -0,0 +1,217 @@
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import struct
+import sys
+import time
+
+try:
+    from . import folder_util
+except ImportError:
+    import folder_util
+
+logger = logging.getLogger("pep8.watch")
+
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+IN_ISDIR = 0x40000000
+_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+_EVENT = struct.Struct("iIII")
+
+
+class Watcher:
+    """
+    Watches a folder for changed .py files.
+
+    Uses inotify on Linux and falls back to comparing the modification
+    times of all files every poll_interval seconds. batches() yields the
+    changed files in sorted lists, events arriving within debounce seconds
+    of each other are put in the same list. Files the walk of the folder
+    would skip with exclude and gitignore are left out, see
+    folder_util.iter_py_files_in_subfolders. Files that weren't touched
+    again since the previous batch was handled are left out, so files
+    rewritten by the formatter don't come back as changes.
+    """
+
+    def __init__(self, folder_path, poll_interval=0.5, debounce=0.05,
+                 polling=False, exclude=(), gitignore=True):
+        self.folder_path = folder_path
+        self.exclude = exclude
+        self.gitignore = gitignore
+        self.poll_interval = poll_interval
+        self.debounce = debounce
+        self._handled = {}
+        self._source = None
+        if not polling:
+            try:
+                self._source = _Inotify(folder_path, self._walk)
+            except OSError as e:
+                logger.debug("inotify is not available, polling: %s", e)
+        if self._source is None:
+            self._source = _Poller(self._walk)
+
+    def _walk(self):
+        return folder_util.iter_py_files_in_subfolders(
+            self.folder_path, self.exclude, self.gitignore)
+
+    @property
+    def polling(self):
+        return isinstance(self._source, _Poller)
+
+    def batches(self):
+        while True:
+            changed = self._source.changes(self.poll_interval)
+            if not changed:
+                continue
+            while True:
+                # a new folder is an event even before its files are
+                # there, only a debounce without any events ends the batch
+                more = self._source.changes(self.debounce)
+                if more is None:
+                    break
+                changed |= more
+            batch = sorted(file for file in changed
+                           if _stat(file) not in (None,
+                                                  self._handled.get(file)))
+            if not self.polling:
+                # inotify reports every file, the walk has already skipped
+                # the excluded ones
+                batch = [file for file in batch
+                         if not folder_util.is_excluded(
+                             file, self.folder_path, self.exclude,
+                             self.gitignore)]
+            if not batch:
+                continue
+            yield batch
+            for file in batch:
+                self._handled[file] = _stat(file)
+
+    def close(self):
+        self._source.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _stat(file):
+    try:
+        stat = os.stat(file)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+class _Inotify:
+    # One watch per folder, folders created later are watched as they
+    # appear
+
+    def __init__(self, folder_path, walk):
+        if not sys.platform.startswith("linux"):
+            raise OSError("inotify is only available on Linux")
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c"),
+                                 use_errno=True)
+        self._fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        self._walk = walk
+        self._folders = {}
+        try:
+            self._add_tree(folder_path)
+        except OSError:
+            self.close()
+            raise
+
+    def _add_tree(self, folder_path):
+        # Returns the .py files already in the new folders. A folder is
+        # watched before it is listed, a file created in between is
+        # reported by the listing, by the watch or by both.
+        files = set()
+        pending = [os.path.normpath(folder_path)]
+        while pending:
+            folder = pending.pop()
+            wd = self._libc.inotify_add_watch(self._fd, os.fsencode(folder),
+                                              _MASK)
+            if wd < 0:
+                errno = ctypes.get_errno()
+                raise OSError(errno, os.strerror(errno), folder)
+            self._folders[wd] = folder
+            try:
+                entries = list(os.scandir(folder))
+            except OSError:
+                continue
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.name not in folder_util.EXCLUDED_FOLDERS:
+                        pending.append(os.path.join(folder, entry.name))
+                elif entry.name.endswith(".py"):
+                    files.add(os.path.join(folder, entry.name))
+        return files
+
+    def changes(self, timeout):
+        # Returns the changed files, None if there were no events
+        if not select.select([self._fd], [], [], timeout)[0]:
+            return None
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return None
+        changed = set()
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = _EVENT.unpack_from(data, offset)
+            offset += _EVENT.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b"\0"))
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                logger.warning("Too many changes at once, checking every "
+                               "file")
+                changed.update(self._walk())
+            elif mask & IN_IGNORED:
+                self._folders.pop(wd, None)
+            elif wd in self._folders:
+                path = os.path.join(self._folders[wd], name)
+                if mask & IN_ISDIR:
+                    if mask & (IN_CREATE | IN_MOVED_TO):
+                        try:
+                            changed |= self._add_tree(path)
+                        except OSError as e:
+                            logger.warning("Can't watch %s: %s", path, e)
+                elif name.endswith(".py") and mask & (IN_CLOSE_WRITE
+                                                      | IN_MOVED_TO):
+                    changed.add(path)
+        return changed
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+class _Poller:
+
+    def __init__(self, walk):
+        self._walk = walk
+        self._stats = self._scan()
+
+    def _scan(self):
+        return {file: _stat(file) for file in self._walk()}
+
+    def changes(self, timeout):
+        time.sleep(timeout)
+        stats = self._scan()
+        changed = {file for file, stat in stats.items()
+                   if stat is not None and self._stats.get(file) != stat}
+        self._stats = stats
+        return changed or None
+
+    def close(self):
+        pass
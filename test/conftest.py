@@ -0,0 +1,26 @@
+import logging
+import os
+import tempfile
+import pytest
+
+from src import log
+
+
+@pytest.fixture
+def py_files():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        files = []
+        for idx in range(5):
+            file = os.path.join(tmp_dir, f"test{idx}.py")
+            with open(file, "w") as f:
+                f.write(f"x = {idx}\nimport os, sys\n")
+            files.append(file)
+        yield files
+
+
+@pytest.fixture
+def info_logs():
+    level = log.logger.level
+    log.logger.setLevel(logging.INFO)
+    yield
+    log.logger.setLevel(level)
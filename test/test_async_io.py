@@ -0,0 +1,103 @@
+import logging
+import os
+import tempfile
+
+from src import async_io
+from src import cache
+from src import log
+from src import parallel
+
+
+def test_format_files_keeps_order(py_files, info_logs):
+    # given
+    files = py_files[:2] + [py_files[0] + ".missing"] + py_files[2:]
+
+    # when
+    results = list(async_io.format_files(iter(files), 2, io_jobs=2))
+
+    # then
+    assert [file for file, _, _ in results] == files
+    errors = [error for _, _, error in results]
+    assert errors[2].startswith("FileNotFoundError")
+    assert errors.count(None) == 5
+    assert all("imports_split=1" in file_log
+               for _, file_log, error in results if error is None)
+    for idx, file in enumerate(py_files):
+        with open(file) as f:
+            assert f.read() == f"import os\nimport sys\nx = {idx}\n"
+
+
+def test_format_files_to_destinations_with_cache(py_files, info_logs):
+    with tempfile.TemporaryDirectory() as cache_dir:
+        # given
+        result_cache = cache.ResultCache(cache_dir)
+
+        # when
+        list(async_io.format_files(py_files[:1], 1, 2, result_cache,
+                                   lambda file: file + ".out"))
+        results = list(async_io.format_files(py_files[:1], 1, 2,
+                                             result_cache,
+                                             lambda file: file + ".out"))
+
+        # then
+        assert "cached result" in results[0][1]
+        assert "Written to" not in results[0][1]
+        with open(py_files[0] + ".out") as f:
+            assert f.read() == "import os\nimport sys\nx = 0\n"
+
+
+def test_format_files_with_ranges_skips_the_cache(py_files):
+    with tempfile.TemporaryDirectory() as cache_dir:
+        # given
+        result_cache = cache.ResultCache(cache_dir)
+        with open(py_files[0], "rb") as f:
+            data = f.read()
+        list(async_io.format_files(py_files[:1], 1, 2, result_cache,
+                                   lambda file: file + ".out"))
+        list(parallel.format_files(iter(py_files[:1]), 1,
+                                   destination=lambda file: file + ".expected",
+                                   ranges=lambda file: [(1, 1)]))
+
+        # when
+        list(async_io.format_files(py_files[:1], 1, 2, result_cache,
+                                   lambda file: file + ".ranges",
+                                   ranges=lambda file: [(1, 1)]))
+
+        # then
+        assert result_cache.get(data) is not None
+        with open(py_files[0] + ".ranges") as f, \
+                open(py_files[0] + ".expected") as expected:
+            assert f.read() == expected.read()
+        with open(py_files[0] + ".out") as f, \
+                open(py_files[0] + ".ranges") as ranged:
+            assert f.read() != ranged.read()
+
+
+def test_pipeline_stats(py_files, info_logs, caplog, monkeypatch):
+    # given
+    monkeypatch.setattr(log.logger, "propagate", True)
+
+    # when
+    with caplog.at_level(logging.INFO, "pep8.io"):
+        list(async_io.format_files(py_files, 2, io_jobs=2))
+
+    # then
+    messages = [record.getMessage() for record in caplog.records
+                if record.name == "pep8.io"]
+    assert messages[0].startswith("Read 5 files in")
+    assert messages[1].startswith("Waited") and messages[1].endswith("bound")
+    stats = caplog.records[-1].counters
+    assert set(stats) == set(async_io.STAGES)
+    assert stats["format"]["busy"] > 0
+
+
+def test_format_files_stops_cleanly(py_files):
+    # when
+    results = async_io.format_files(py_files, 1, io_jobs=1)
+    first = next(results)
+    results.close()
+
+    # then
+    assert first[0] == py_files[0] and first[2] is None
+    assert not [name for name in os.listdir(os.path.dirname(py_files[0]))
+                if name.endswith(".tmp")]
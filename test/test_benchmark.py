@@ -0,0 +1,20 @@
+import ast
+import pytest
+
+from benchmark import corpus
+
+
+@pytest.mark.parametrize("tab_ratio", [0.0, 1.0])
+def test_generate_module(tab_ratio):
+    lines = corpus.generate_module(500, tab_ratio=tab_ratio, imports=20,
+                                   seed=1)
+
+    ast.parse("\n".join(lines))
+    assert len(lines) >= 500
+    assert sum(line.startswith("import ") for line in lines) <= 20
+    assert any("\t" in line for line in lines) == (tab_ratio > 0)
+
+
+def test_generate_module_is_deterministic():
+    assert (corpus.generate_module(200, seed=3)
+            == corpus.generate_module(200, seed=3))
@@ -0,0 +1,70 @@
+import os
+import tempfile
+import pytest
+
+from src import cache
+
+
+@pytest.fixture
+def cache_dir():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        yield tmp_dir
+
+
+def test_get_put(cache_dir):
+    # given
+    result_cache = cache.ResultCache(cache_dir)
+
+    # when
+    missing = result_cache.get(b"import os, sys\n")
+    result_cache.put(b"import os, sys\n", b"import os\nimport sys\n")
+
+    # then
+    assert missing is None
+    assert result_cache.get(b"import os, sys\n") == b"import os\nimport sys\n"
+
+
+def test_config_is_part_of_the_key(cache_dir):
+    # given
+    result_cache = cache.ResultCache(cache_dir, {"max_length": 79})
+    other_cache = cache.ResultCache(cache_dir, {"max_length": 100})
+
+    # when
+    result_cache.put(b"x = 1\n", b"x = 1\n")
+
+    # then
+    assert other_cache.get(b"x = 1\n") is None
+
+
+def test_formatter_modules_are_part_of_the_key(cache_dir, monkeypatch):
+    # given
+    result_cache = cache.ResultCache(cache_dir)
+    result_cache.put(b"x = 1\n", b"x = 1\n")
+
+    with tempfile.NamedTemporaryFile(suffix=".py") as changed:
+        changed.write(b"# changed\n")
+        changed.flush()
+        # when
+        monkeypatch.setattr(cache.line_buffer, "__file__", changed.name)
+        other_cache = cache.ResultCache(cache_dir)
+
+    # then
+    assert other_cache.get(b"x = 1\n") is None
+
+
+def test_prune_removes_least_recently_used(cache_dir):
+    # given
+    result_cache = cache.ResultCache(cache_dir, max_size=25)
+    for idx in range(3):
+        result_cache.put(f"x = {idx}\n".encode(), b"0123456789")
+    for idx, entry in enumerate(sorted(os.listdir(cache_dir))):
+        os.utime(os.path.join(cache_dir, entry), (idx, idx))
+    result_cache.get(b"x = 0\n")
+
+    # when
+    removed = result_cache.prune()
+
+    # then
+    assert removed == 1
+    assert result_cache.get(b"x = 0\n") == b"0123456789"
+    assert len(os.listdir(cache_dir)) == 2
@@ -0,0 +1,70 @@
+import os
+import tempfile
+import pytest
+
+from src import check
+
+
+@pytest.fixture
+def py_file():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file = os.path.join(tmp_dir, "test.py")
+        yield file
+
+
+@pytest.mark.parametrize("content, expected_changed", [
+    ("import os\nimport sys\n", False),
+    ("import os, sys\n", True),
+    ("x = 1   \n", True),
+    ("x = 1\n\n", True),
+])
+def test_check_file(py_file, content, expected_changed):
+    # given
+    with open(py_file, "w") as f:
+        f.write(content)
+
+    # when
+    file, changed, diff, error = check.check_file(py_file)
+
+    # then
+    assert changed == expected_changed
+    assert diff == "" and error is None
+    with open(py_file) as f:
+        assert f.read() == content
+
+
+def test_check_file_diff(py_file):
+    # given
+    with open(py_file, "w") as f:
+        f.write("import os, sys\n")
+
+    # when
+    file, changed, diff, error = check.check_file(py_file, diff=True)
+
+    # then
+    assert changed
+    assert diff == (f"--- {py_file}\n+++ {py_file}\n@@ -1 +1,2 @@\n"
+                    "-import os, sys\n+import os\n+import sys\n")
+
+
+def test_check_files_reports_errors(py_file):
+    # when
+    results = list(check.check_files([py_file], jobs=1))
+
+    # then
+    assert results[0][3].startswith("FileNotFoundError")
+
+
+def test_check_file_ranges(py_file):
+    # given
+    with open(py_file, "w") as f:
+        f.write("import os, sys\nx = 1\ny = 2   \n")
+
+    # when
+    unchanged = check.check_file(py_file, [(2, 2)])
+    changed = check.check_file(py_file, [(3, 3)], diff=True)
+
+    # then
+    assert unchanged[1] is False
+    assert changed[1] is True
+    assert "-y = 2   \n+y = 2\n" in changed[2]
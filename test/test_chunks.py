@@ -0,0 +1,105 @@
+import pytest
+
+from src import chunks
+from src import pep8
+
+
+SOURCE = '''"""Module docstring"""
+# a comment kept below the docstring
+from __future__ import annotations
+import os, sys
+x = 1
+
+
+def f():
+\treturn x
+import re
+@decorator
+
+def g():  # a trailing comment that is much too long to stay on the line of its code
+    pass
+
+
+
+class A:
+    def method(self):
+        pass
+    def other(self):
+        pass
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    import typing
+y = [
+2,
+]
+def h():
+    pass
+import json
+
+
+'''.split("\n")
+
+
+@pytest.fixture
+def small_chunks(monkeypatch):
+    monkeypatch.setattr(chunks, "MIN_CHUNK_LINES", 3)
+
+
+def test_format_source_is_the_same_as_in_one_piece(small_chunks):
+    # given
+    expected = list(pep8.format_source(SOURCE).lines)
+
+    # when
+    source = chunks.format_source(SOURCE, 2)
+
+    # then
+    assert source is not None
+    assert list(source.lines) == expected
+    assert source.parse_count > 1
+
+
+def test_format_source_with_selected_rules(small_chunks):
+    # given
+    rules = ("split_imports", "format_newlines")
+    expected = list(pep8.format_source(SOURCE, rules=rules).lines)
+
+    # when
+    source = chunks.format_source(SOURCE, 2, rules=rules)
+
+    # then
+    assert list(source.lines) == expected
+
+
+def test_format_source_without_cut_points():
+    assert chunks.format_source(SOURCE, 2) is None
+
+
+def test_format_source_when_a_chunk_cant_be_parsed(small_chunks):
+    # given
+    lines = ["x = '''", "a", "b", "c", "d", "'''", "y = 1", "z = 2"]
+
+    # then
+    assert chunks.format_source(lines, 2) is None
+
+
+def test_cut_points(monkeypatch):
+    # given
+    monkeypatch.setattr(chunks, "MIN_CHUNK_LINES", 1)
+    lines = ["@decorator", "def f():", "    pass", "x = (", "y)", "else:",
+             "r'string'", "z = 1"]
+
+    # when
+    cuts = chunks._cut_points(lines, len(lines))
+
+    # then
+    assert cuts == [3, 7]
+
+
+def test_format_source_when_type_checking_is_imported_in_another_chunk(
+        small_chunks):
+    # given
+    lines = ["from typing import TYPE_CHECKING", "a = 1", "b = 2", "c = 3",
+             "if TYPE_CHECKING:", "    import os", "d = 4", "e = 5"]
+
+    # then
+    assert chunks.format_source(lines, 2) is None
@@ -1,29 +1,49 @@
+import os
+import tempfile
 import pytest
-from unittest.mock import patch, call, mock_open
+from unittest.mock import patch, mock_open
 
 from src import file_handler
+from src.line_buffer import LineBuffer
 
 
-def test_write_to_file():
+@pytest.fixture
+def tmp_dir():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        yield tmp_dir
+
+
+def test_write_to_file(tmp_dir):
     # given
-    open_mock = mock_open()
-    
+    filename = os.path.join(tmp_dir, "output.py")
+
     # when
-    with patch("builtins.open", open_mock, create=True):
-        file_handler.write_to_file("output.py", ["line 1", "", "line 3"])
+    written = file_handler.write_to_file(filename, ["line 1", "", "line 3"])
 
     # then
-    open_mock.assert_has_calls([
-        call("output.py", "w"),
-        call().write("line 1\n"),
-        call().write("\n"),
-        call().write("line 3\n")
-    ])
+    assert written is True
+    with open(filename, "rb") as file:
+        assert file.read() == b"line 1\n\nline 3\n"
+
+
+def test_write_to_file_skips_identical_content(tmp_dir):
+    # given
+    filename = os.path.join(tmp_dir, "output.py")
+    with open(filename, "wb") as file:
+        file.write(b"line 1\n")
+
+    # when
+    with patch("builtins.open", wraps=open) as open_mock:
+        written = file_handler.write_to_file(filename, ["line 1"])
+
+    # then
+    assert written is False
+    open_mock.assert_called_once_with(filename, "rb")
 
 
 def test_read_from_file():
     # given
-    file_content = "line1\n   \nline3"
+    file_content = b"line1\n   \nline3"
     open_mock = mock_open(read_data=file_content)
     
     # when
@@ -32,4 +52,121 @@ def test_read_from_file():
 
     # then
     assert result == ["line1", "", "line3"]
-    open_mock.assert_called_with("input.py", "r")
\ No newline at end of file
+    open_mock.assert_called_once_with("input.py", "rb")
+
+
+@pytest.mark.parametrize("data, expected_lines, expected_encoding, "
+                         "expected_newline", [
+    (b"x = 1\n", ["x = 1"], "utf-8", "\n"),
+    (b"x = 1\r\ny = 2\r\n", ["x = 1", "y = 2"], "utf-8", "\r\n"),
+    (b"x = 1\ry = 2", ["x = 1", "y = 2"], "utf-8", "\r"),
+    (b"\xef\xbb\xbfx = '\xc5\xbe'\n", ["x = '\u017e'"], "utf-8-sig", "\n"),
+    (
+            b"# -*- coding: latin-1 -*-\nx = '\xe9'\n",
+            ["# -*- coding: latin-1 -*-", "x = '\xe9'"], "iso-8859-1", "\n"
+    ),
+])
+def test_decode(data, expected_lines, expected_encoding, expected_newline):
+    lines, encoding, newline = file_handler.decode(data)
+
+    assert lines == expected_lines
+    assert encoding == expected_encoding
+    assert newline == expected_newline
+    assert file_handler.encode(lines, encoding, newline).startswith(data[:3])
+
+
+def test_replace_file(tmp_dir):
+    # given
+    filename = os.path.join(tmp_dir, "sub", "output.py")
+
+    # when
+    written = file_handler.replace_file(filename, ["line 1", "line 2"],
+                                        newline="\r\n")
+    written_again = file_handler.replace_file(filename, ["line 1", "line 2"],
+                                              newline="\r\n")
+
+    # then
+    assert written is True
+    assert written_again is False
+    with open(filename, "rb") as file:
+        assert file.read() == b"line 1\r\nline 2\r\n"
+    assert os.listdir(os.path.dirname(filename)) == ["output.py"]
+
+
+@pytest.mark.parametrize("content, expected", [
+    ("", []),
+    ("line1\n   \nline3", ["line1", "", "line3"]),
+    ("line1  \nline2\n", ["line1", "line2"]),
+    ("line1\n\n", ["line1", ""]),
+    ("line1\r\nline2\rline3", ["line1", "line2", "line3"]),
+])
+def test_split_lines(content, expected):
+    assert file_handler.split_lines(content) == expected
+
+
+@pytest.mark.parametrize("data", [
+    b"x = 1  \n\nif x:\n\ty = '\xc5\xbe'\xc2\xa0\n",
+    b"a\n  \nb",
+    b"# nothing to do\n",
+])
+def test_map_lines(tmp_dir, data):
+    # given
+    filename = os.path.join(tmp_dir, "input.py")
+    with open(filename, "wb") as file:
+        file.write(data)
+
+    # when
+    with file_handler.map_lines(filename) as mapped:
+        lines = list(mapped)
+        last = mapped[-1]
+
+    # then
+    assert lines == file_handler.decode(data)[0]
+    assert last == lines[-1]
+
+
+@pytest.mark.parametrize("data", [b"", b"a\r\nb\r\n",
+                                  b"# coding: latin-1\nx = '\xe9'\n"])
+def test_map_lines_only_maps_utf8_with_newlines(tmp_dir, data):
+    # given
+    filename = os.path.join(tmp_dir, "input.py")
+    with open(filename, "wb") as file:
+        file.write(data)
+
+    # then
+    assert file_handler.map_lines(filename) is None
+
+
+def test_write_lines_copies_unchanged_lines(tmp_dir):
+    # given
+    filename = os.path.join(tmp_dir, "input.py")
+    with open(filename, "wb") as file:
+        file.write(b"a = 1\nb = 2  \nc = 3\nd = 4")
+    output = os.path.join(tmp_dir, "output.py")
+
+    # when
+    with file_handler.map_lines(filename) as mapped:
+        buffer = LineBuffer(mapped)
+        buffer.replace(2, 3, ["c = 30"])
+        buffer.apply()
+        written = file_handler.write_lines(output, buffer.chunks(), mapped)
+
+    # then
+    assert written is True
+    with open(output, "rb") as file:
+        assert file.read() == b"a = 1\nb = 2\nc = 30\nd = 4\n"
+
+
+def test_write_lines_skips_identical_content(tmp_dir):
+    # given
+    filename = os.path.join(tmp_dir, "input.py")
+    with open(filename, "wb") as file:
+        file.write(b"a = 1\nb = 2\n")
+
+    # when
+    with file_handler.map_lines(filename) as mapped:
+        written = file_handler.write_lines(
+            filename, LineBuffer(mapped).chunks(), mapped)
+
+    # then
+    assert written is False
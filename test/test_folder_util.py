@@ -1,8 +1,9 @@
 import os
 import tempfile
 import pytest
-from unittest.mock import patch
+from unittest.mock import ANY, patch
 
+from src import file_handler
 from src import folder_util
 
 
@@ -47,6 +48,43 @@ def test_get_next_folder_name(mocked_isdir, folders, name):
         assert folder_util.get_next_folder_name(base_folder) == name
 
 
+def test_create_new_output_folder():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # given
+        os.makedirs(os.path.join(tmp_dir, "output1"))
+
+        # when
+        output_path = folder_util.create_new_output_folder(tmp_dir)
+
+        # then
+        assert output_path == os.path.join(tmp_dir, "output2")
+        assert os.path.isdir(output_path)
+
+
+def test_get_next_folder_name_from_the_counter():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # given
+        os.makedirs(os.path.join(tmp_dir, "output1"))
+        folder_util.create_new_output_folder(tmp_dir)
+        os.makedirs(os.path.join(tmp_dir, "output3"))
+
+        # when
+        with patch('os.listdir') as mocked_listdir:
+            name = folder_util.get_next_folder_name(tmp_dir)
+
+        # then
+        mocked_listdir.assert_not_called()
+        assert name == "output4"
+
+
+def test_mirror_path():
+    file = os.path.join("src", "pkg", "b.py")
+
+    actual = folder_util.mirror_path(file, "src", "out")
+
+    assert actual == os.path.join("out", "pkg", "b.py")
+
+
 def test_copy_folder_successful_copy():
     # given
     source_folder = '/path/to/source'
@@ -59,42 +97,40 @@ def test_copy_folder_successful_copy():
         # then
         assert status is True
         mock_copytree.assert_called_once_with(source_folder, os.path.abspath(
-            destination_folder))
+            destination_folder), copy_function=ANY)
 
 
-def test_copy_folder_file_exists_error():
+def test_copy_folder_file_exists_error(caplog):
     # given
     source_folder = '/path/to/source'
     destination_folder = '/path/to/destination'
 
     # Mock shutil.copytree to raise FileExistsError
-    with patch('shutil.copytree', side_effect=FileExistsError), \
-            patch('builtins.print') as mock_print:
+    with patch('shutil.copytree', side_effect=FileExistsError):
         # when
         status = folder_util.copy_folder(source_folder, destination_folder)
 
         # then
         assert status == False
-        mock_print.assert_called_once_with(
+        assert caplog.messages == [
             f"Destination folder '{os.path.abspath(destination_folder)}' " +
             "already exists. Please move/delete the existing output folder."
-        )
+        ]
 
 
-def test_copy_folder_exception():
+def test_copy_folder_exception(caplog):
     # given
     source_folder = '/path/to/source'
     destination_folder = '/path/to/destination'
 
     # Mock shutil.copytree to raise an exception
-    with patch('shutil.copytree', side_effect=Exception('Some error')), \
-            patch('builtins.print') as mock_print:
+    with patch('shutil.copytree', side_effect=Exception('Some error')):
         # when
         status = folder_util.copy_folder(source_folder, destination_folder)
 
         # then
         assert status == False
-        mock_print.assert_called_once_with(f"An error occurred: Some error")
+        assert caplog.messages == ["An error occurred: Some error"]
 
 
 @patch('src.folder_util.get_next_folder_name', return_value="output1")
@@ -102,7 +138,8 @@ def test_copy_folder_to_new_output_folder_successful_copy(mock_folder_name):
     # given
     with tempfile.TemporaryDirectory() as tmp_dir:
         source_folder = tmp_dir
-        output_path = './outputs'
+        output_path = os.path.join(tmp_dir, 'outputs')
+        os.makedirs(output_path)
 
         with patch('src.folder_util.copy_folder', return_value=True):
             # when
@@ -110,6 +147,9 @@ def test_copy_folder_to_new_output_folder_successful_copy(mock_folder_name):
                 source_folder, output_path)
             # then
             assert actual_output_path == os.path.join(output_path, 'output1')
+            with open(os.path.join(output_path,
+                                   folder_util.COUNTER_FILE)) as f:
+                assert f.read() == "1\n"
 
 
 def test_copy_folder_to_new_output_folder_unsuccessful_copy():
@@ -124,3 +164,147 @@ def test_copy_folder_to_new_output_folder_unsuccessful_copy():
                 source_folder, output_path)
             # then
             assert actual_output_path is None
+
+
+def test_copy_folder_links_the_files():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # given
+        source_folder = os.path.join(tmp_dir, "source")
+        create_files(source_folder, ["a.py", "sub/b.py"])
+        with open(os.path.join(source_folder, "a.py"), "w") as f:
+            f.write("x = 1\n")
+
+        # when
+        output_path = folder_util.copy_folder_to_new_output_folder(
+            source_folder, os.path.join(tmp_dir, "outputs"))
+        copied = os.path.join(output_path, "a.py")
+        file_handler.write_bytes(copied, b"x = 2\n")
+
+        # then
+        with open(os.path.join(source_folder, "a.py")) as f:
+            assert f.read() == "x = 1\n"
+        with open(copied) as f:
+            assert f.read() == "x = 2\n"
+        assert os.path.isfile(os.path.join(output_path, "sub", "b.py"))
+
+
+def test_prune_output_folders():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # given
+        for number in (1, 2, 3, 10):
+            folder = os.path.join(tmp_dir, f"output{number}")
+            os.makedirs(folder)
+            with open(os.path.join(folder, "a.py"), "wb") as f:
+                f.write(b"x" * 100)
+        os.link(os.path.join(tmp_dir, "output10", "a.py"),
+                os.path.join(tmp_dir, "output3", "b.py"))
+        os.makedirs(os.path.join(tmp_dir, "other"))
+
+        # when
+        removed_by_count = folder_util.prune_output_folders(tmp_dir, keep=3)
+        removed_by_size = folder_util.prune_output_folders(tmp_dir,
+                                                           max_size=200)
+        removed_last = folder_util.prune_output_folders(tmp_dir, max_size=0)
+
+        # then
+        assert removed_by_count == [os.path.join(tmp_dir, "output1")]
+        assert removed_by_size == [os.path.join(tmp_dir, "output2")]
+        assert removed_last == [os.path.join(tmp_dir, "output3")]
+        assert sorted(os.listdir(tmp_dir)) == ["other", "output10"]
+
+
+def create_files(tmp_dir, files):
+    for file in files:
+        path = os.path.join(tmp_dir, *file.split("/"))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        open(path, 'a').close()
+
+
+def test_iter_py_files_in_subfolders_order():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # given
+        create_files(tmp_dir, ["b.py", "a/z.py", "a/b/c.py", "c/d.py",
+                               "a.py"])
+
+        # when
+        actual = list(folder_util.iter_py_files_in_subfolders(tmp_dir,
+                                                              jobs=4))
+
+        # then
+        assert actual == [os.path.join(tmp_dir, *file.split("/")) for file
+                          in ["a.py", "b.py", "a/z.py", "a/b/c.py",
+                              "c/d.py"]]
+
+
+def test_iter_py_files_in_subfolders_relative_paths():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        create_files(tmp_dir, ["a.py", "sub/b.py"])
+        cwd = os.getcwd()
+        os.chdir(tmp_dir)
+        try:
+            actual = list(folder_util.iter_py_files_in_subfolders("./"))
+        finally:
+            os.chdir(cwd)
+
+    assert actual == ["a.py", os.path.join("sub", "b.py")]
+
+
+def test_iter_py_files_in_subfolders_excludes():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # given
+        create_files(tmp_dir, [
+            "keep.py", "gen_pb2.py", ".git/hook.py", "node_modules/x.py",
+            "env/pyvenv.cfg", "env/lib/site.py", "docs/conf.py",
+            "src/docs/keep.py"])
+
+        # when
+        actual = list(folder_util.iter_py_files_in_subfolders(
+            tmp_dir, ["*_pb2.py", "/docs/"]))
+
+        # then
+        assert actual == [os.path.join(tmp_dir, "keep.py"),
+                          os.path.join(tmp_dir, "src", "docs", "keep.py")]
+
+
+def test_iter_py_files_in_subfolders_excludes_folders_only():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # given
+        create_files(tmp_dir, ["keep.py", "tests/t.py", "src/tests/t.py",
+                               "src/tests.py"])
+
+        # when
+        actual = list(folder_util.iter_py_files_in_subfolders(
+            tmp_dir, ["tests/", "tests.py/"]))
+
+        # then
+        assert actual == [os.path.join(tmp_dir, "keep.py"),
+                          os.path.join(tmp_dir, "src", "tests.py")]
+        assert folder_util.is_excluded(
+            os.path.join(tmp_dir, "src", "tests", "t.py"), tmp_dir,
+            ["tests/"])
+
+
+def test_iter_py_files_in_subfolders_gitignore():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # given
+        create_files(tmp_dir, [
+            "a.py", "generated.py", "out/a.py", "lib/generated.py",
+            "lib/keep_generated.py", "lib/deep/x.py", "data/x.py"])
+        with open(os.path.join(tmp_dir, ".gitignore"), "w") as f:
+            f.write("# comment\n*generated.py\n!keep_*.py\nout/\n/data\n")
+        with open(os.path.join(tmp_dir, "lib", ".gitignore"), "w") as f:
+            f.write("deep/**\n")
+
+        # when
+        actual = list(folder_util.iter_py_files_in_subfolders(tmp_dir))
+        everything = folder_util.find_py_files_in_subfolders(
+            tmp_dir, gitignore=False)
+
+        # then
+        assert actual == [os.path.join(tmp_dir, "a.py"),
+                          os.path.join(tmp_dir, "lib", "keep_generated.py")]
+        assert len(everything) == 7
+        assert all(folder_util.is_excluded(file, tmp_dir)
+                   for file in everything if file not in actual)
+        assert not any(folder_util.is_excluded(file, tmp_dir)
+                       for file in actual)
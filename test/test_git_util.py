@@ -0,0 +1,154 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import pytest
+
+from src import check
+from src import git_util
+
+pytestmark = pytest.mark.skipif(shutil.which("git") is None,
+                                reason="git is not installed")
+
+
+def git(repo, *args):
+    subprocess.run(["git", "-C", repo, "-c", "user.name=test",
+                    "-c", "user.email=test@example.com", *args],
+                   check=True, capture_output=True)
+
+
+def write(repo, name, content):
+    with open(os.path.join(repo, name), "w") as f:
+        f.write(content)
+
+
+@pytest.fixture
+def repo():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        git(tmp_dir, "init", "-q")
+        write(tmp_dir, "a.py", "import os\nx = 1\ny = 2\nz = 3\n")
+        write(tmp_dir, "b.py", "import sys\n")
+        write(tmp_dir, "notes.txt", "text\n")
+        git(tmp_dir, "add", ".")
+        git(tmp_dir, "commit", "-q", "-m", "initial")
+        yield tmp_dir
+
+
+def test_changed_lines(repo):
+    # given
+    write(repo, "a.py", "import os\nx = 1\ny = 20\nz = 3\n")
+    write(repo, "c.py", "import os, sys\n")
+    write(repo, "notes.txt", "more text\n")
+
+    # when
+    changes = git_util.changed_lines(repo)
+
+    # then
+    assert changes == {os.path.join(repo, "a.py"): [(3, 3)],
+                       os.path.join(repo, "c.py"): None}
+
+
+def test_changed_lines_staged(repo):
+    # given
+    write(repo, "a.py", "import os\nx = 1\ny = 20\nw = 4\nz = 3\n")
+    write(repo, "b.py", "import sys\nimport os\n")
+    git(repo, "add", "a.py")
+
+    # when
+    changes = git_util.changed_lines(repo, staged=True)
+
+    # then
+    assert changes == {os.path.join(repo, "a.py"): [(3, 4)]}
+
+
+def test_changed_lines_with_special_names(repo):
+    # given
+    write(repo, "café.py", "x = 1\n")
+    write(repo, "sp ace.py", "x = 1\n")
+    write(repo, 'quo"te.py', "x = 1\n")
+    git(repo, "add", ".")
+    git(repo, "commit", "-q", "-m", "names")
+    write(repo, "café.py", "x = 2\n")
+    write(repo, "sp ace.py", "x = 2\n")
+    write(repo, 'quo"te.py', "x = 2\n")
+    write(repo, "new café.py", "x = 1\n")
+
+    # when
+    changes = git_util.changed_lines(repo)
+    unstaged = git_util.unstaged_files(repo)
+
+    # then
+    assert changes == {os.path.join(repo, "café.py"): [(1, 1)],
+                       os.path.join(repo, "sp ace.py"): [(1, 1)],
+                       os.path.join(repo, 'quo"te.py'): [(1, 1)],
+                       os.path.join(repo, "new café.py"): None}
+    assert unstaged == {os.path.join(repo, "café.py"),
+                        os.path.join(repo, "sp ace.py"),
+                        os.path.join(repo, 'quo"te.py')}
+
+
+def test_unstaged_files_and_staged_content(repo):
+    # given
+    write(repo, "a.py", "import os\nx = 1\ny = 20\nz = 3\n")
+    git(repo, "add", "a.py")
+    write(repo, "a.py", "import os, sys\nx = 1\ny = 20\nz = 3\n")
+    write(repo, "b.py", "import sys  \n")
+
+    # when
+    unstaged = git_util.unstaged_files(repo)
+    staged = git_util.staged_content(os.path.join(repo, "a.py"))
+
+    # then
+    assert unstaged == {os.path.join(repo, "a.py"), os.path.join(repo, "b.py")}
+    assert staged == b"import os\nx = 1\ny = 20\nz = 3\n"
+
+
+def test_check_file_staged(repo):
+    # given
+    write(repo, "a.py", "import os\nx = 1\ny = 2   \nz = 3\n")
+    git(repo, "add", "a.py")
+    write(repo, "a.py", "import os, sys\nx = 1\ny = 2   \nz = 3\n")
+    file = os.path.join(repo, "a.py")
+    ranges = git_util.changed_lines(repo, staged=True)[file]
+
+    # when
+    _, changed, diff, error = check.check_file(file, ranges, diff=True,
+                                               staged=True)
+
+    # then
+    assert error is None and changed
+    assert "-y = 2   \n+y = 2\n" in diff
+    assert "sys" not in diff
+
+
+def test_changed_lines_since_ref(repo):
+    # given
+    write(repo, "b.py", "import sys\nimport os\n")
+    git(repo, "commit", "-q", "-am", "second")
+
+    # when
+    changes = git_util.changed_lines(repo, "HEAD~1")
+
+    # then
+    assert changes == {os.path.join(repo, "b.py"): [(2, 2)]}
+
+
+def test_changed_lines_not_a_repository():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        with pytest.raises(subprocess.CalledProcessError):
+            git_util.changed_lines(tmp_dir)
+
+
+def test_restrict_changes():
+    # given
+    original = ["import os, sys", "x = 1", "y = 2   ", "z = 3",
+                "import a, b"]
+    formatted = ["import os", "import sys", "x = 1", "y = 2", "z = 3",
+                 "import a", "import b"]
+
+    # when
+    lines = git_util.restrict_changes(original, formatted, [(3, 3), (5, 5)])
+
+    # then
+    assert lines == ["import os, sys", "x = 1", "y = 2", "z = 3",
+                     "import a", "import b"]
@@ -0,0 +1,76 @@
+import pytest
+
+from src.line_buffer import LineBuffer
+
+
+def test_apply_batch_of_edits():
+    # given
+    buffer = LineBuffer(["a", "b", "c", "d", "e", "f"])
+
+    # when
+    buffer.replace(1, 2, ["B1", "B2"])
+    buffer.delete(2, 3)
+    buffer.insert(4, ["x"])
+    buffer.move(5, 6, 0)
+    applied = buffer.apply()
+
+    # then
+    assert applied
+    assert buffer == ["f", "a", "B1", "B2", "d", "x", "e"]
+    assert list(buffer) == ["f", "a", "B1", "B2", "d", "x", "e"]
+    assert buffer[-1] == "e" and buffer[2:4] == ["B1", "B2"]
+    assert not buffer.apply()
+
+
+def test_inserts_at_the_same_index_keep_their_order():
+    buffer = LineBuffer(["a", "b"])
+
+    buffer.insert(1, ["x"])
+    buffer.replace(1, 2, ["B"])
+    buffer.insert(2, ["end"])
+    buffer.apply()
+
+    assert buffer == ["a", "x", "B", "end"]
+
+
+def test_origins_follow_the_lines():
+    # given
+    buffer = LineBuffer(["a", "b", "c", "d"])
+
+    # when
+    buffer.move(2, 4, 0)
+    buffer.replace(1, 2, ["b1", "b2"])
+    buffer.apply()
+    buffer.delete(0, 1)
+    buffer.apply()
+
+    # then
+    assert buffer == ["d", "a", "b1", "b2"]
+    assert [buffer.origin(idx) for idx in range(4)] == [3, 0, 1, None]
+    assert [buffer.index_of(origin) for origin in range(4)] == [1, 2, None, 0]
+
+
+def test_spans_are_kept_for_moved_lines():
+    # given
+    buffer = LineBuffer(["a", "b", "c"])
+    buffer.set_spans([["a"], ["b"], ["c"]])
+
+    # when
+    buffer.move(2, 3, 0)
+    buffer.insert(1, [""], [[]])
+    buffer.apply()
+
+    # then
+    assert buffer.has_spans
+    assert list(buffer.spans) == [["c"], ["a"], [], ["b"]]
+
+    buffer.replace(0, 1, ["C"])
+    buffer.apply()
+    assert not buffer.has_spans
+
+
+def test_index_out_of_range():
+    buffer = LineBuffer(["a"])
+
+    with pytest.raises(IndexError):
+        buffer[1]
@@ -0,0 +1,166 @@
+import json
+import multiprocessing
+import os
+import tempfile
+import pytest
+from unittest.mock import patch
+
+from src import cache
+from src import chunks
+from src import file_handler
+from src import log
+from src import parallel
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_format_files_keeps_order(py_files, jobs, info_logs):
+    # when
+    results = list(parallel.format_files(py_files, jobs))
+
+    # then
+    assert [file for file, log, error in results] == py_files
+    assert all(error is None for file, log, error in results)
+    assert all("Parsed 1 time, imports_moved=1, imports_split=1" in log
+               for file, log, error in results)
+    with open(py_files[0]) as f:
+        assert f.read() == "import os\nimport sys\nx = 0\n"
+
+
+def test_format_files_reports_errors(py_files):
+    # given
+    files = py_files[:1] + [py_files[0] + ".missing"] + py_files[1:2]
+
+    # when
+    results = list(parallel.format_files(files, 2))
+
+    # then
+    errors = [error for file, log, error in results]
+    assert errors[0] is None and errors[2] is None
+    assert errors[1].startswith("FileNotFoundError")
+
+
+def test_format_files_uses_cache(py_files, info_logs):
+    with tempfile.TemporaryDirectory() as cache_dir:
+        # given
+        result_cache = cache.ResultCache(cache_dir)
+        list(parallel.format_files(py_files[:1], 1, result_cache))
+        with open(py_files[0], "w") as f:
+            f.write("x = 0\nimport os, sys\n")
+
+        # when
+        results = list(parallel.format_files(py_files[:1], 1, result_cache))
+
+        # then
+        assert "cached result" in results[0][1]
+        with open(py_files[0]) as f:
+            assert f.read() == "import os\nimport sys\nx = 0\n"
+
+
+def test_format_files_to_destinations(py_files):
+    with tempfile.TemporaryDirectory() as output_dir:
+        # given
+        def destination(file):
+            return os.path.join(output_dir, "pkg", os.path.basename(file))
+
+        # when
+        results = list(parallel.format_files(py_files, 2, None, destination))
+
+        # then
+        assert all(error is None for file, log, error in results)
+        with open(destination(py_files[1])) as f:
+            assert f.read() == "import os\nimport sys\nx = 1\n"
+        with open(py_files[1]) as f:
+            assert f.read() == "x = 1\nimport os, sys\n"
+
+
+def test_format_files_from_generator(py_files):
+    # when
+    results = list(parallel.format_files(iter(py_files), 2))
+
+    # then
+    assert [file for file, log, error in results] == py_files
+
+
+def test_prefetch():
+    # given
+    def numbers():
+        yield from range(100)
+        raise ValueError("walk failed")
+
+    # when
+    items = parallel.prefetch(numbers(), 4)
+
+    # then
+    assert [next(items) for _ in range(100)] == list(range(100))
+    with pytest.raises(ValueError):
+        next(items)
+
+
+def test_format_files_keeps_newlines_and_encoding(py_files):
+    # given
+    with open(py_files[0], "wb") as f:
+        f.write(b"\xef\xbb\xbfx = '\xc5\xbe'\r\nimport os, sys\r\n")
+
+    # when
+    results = list(parallel.format_files(py_files[:1], 1))
+
+    # then
+    assert results[0][2] is None
+    with open(py_files[0], "rb") as f:
+        assert f.read() == (b"\xef\xbb\xbfimport os\r\nimport sys\r\n"
+                            b"x = '\xc5\xbe'\r\n")
+
+
+def test_format_files_logs_json(py_files, info_logs, monkeypatch):
+    # given
+    monkeypatch.setattr(log, "_json_format", True)
+
+    # when
+    results = list(parallel.format_files(py_files[:1], 1))
+
+    # then
+    entry = json.loads(results[0][1])
+    assert entry["file"] == py_files[0]
+    assert entry["counters"] == {"imports_moved": 1, "imports_split": 1,
+                                 "parse_count": 1}
+
+
+def test_format_files_maps_large_files(py_files, monkeypatch):
+    # given
+    monkeypatch.setattr(file_handler, "MMAP_MIN_SIZE", 0)
+    with open(py_files[0], "wb") as f:
+        f.write(b"x = 1  \nimport os, sys\n\n\n\n\ndef f():\n\treturn x\n")
+
+    # when
+    with patch.object(file_handler, "write_lines",
+                      wraps=file_handler.write_lines) as write_lines:
+        results = list(parallel.format_files(py_files[:1], 1))
+
+    # then
+    assert results[0][2] is None
+    write_lines.assert_called_once()
+    with open(py_files[0], "rb") as f:
+        assert f.read() == (b"import os\nimport sys\nx = 1\n\n\n"
+                            b"def f():\n    return x\n")
+
+
+def test_format_chunks_in_free_slots_only(monkeypatch):
+    # given
+    slots = multiprocessing.Semaphore(3)
+    monkeypatch.setattr(parallel, "_slots", slots)
+    calls = []
+    monkeypatch.setattr(chunks, "format_source",
+                        lambda lines, jobs, *args: calls.append(jobs))
+
+    # when
+    with slots, slots:
+        # this worker and another one hold a slot each
+        parallel._format_chunks(["x = 1"], 8)
+        with slots:
+            all_busy = parallel._format_chunks(["x = 1"], 8)
+
+    # then
+    assert calls == [2]
+    assert all_busy is None
+    for _ in range(3):
+        assert slots.acquire(block=False)
@@ -1,6 +1,4 @@
 import pytest
-from unittest.mock import patch
-from io import StringIO
 
 from src import pep8
 
@@ -48,6 +46,36 @@ def test_split_imports(lines, expected_lines):
     assert actual_lines == expected_lines
 
 
+@pytest.mark.parametrize("lines, expected_lines", [
+    (
+            ["import os.path as osp, sys as system  # noqa"],
+            ["import os.path as osp  # noqa", "import sys as system"]
+    ),
+    (
+            ["import os, \\", "    sys", "x = 1"],
+            ["import os", "import sys", "x = 1"]
+    ),
+    (
+            ["def f():", "    import os, sys", "    import json, re"],
+            ["def f():", "    import os", "    import sys", "    import json",
+             "    import re"]
+    ),
+    (
+            ["import os, sys; x = 1", "from os import (path,", "    sep)"],
+            ["import os, sys; x = 1", "from os import (path,", "    sep)"]
+    ),
+    # code that can't be parsed is split at every comma
+    (
+            ["def f():", "import os, sys"],
+            ["def f():", "import os", "import sys"]
+    ),
+])
+def test_split_imports_statements(lines, expected_lines):
+    actual_lines = pep8.split_imports(lines)
+
+    assert actual_lines == expected_lines
+
+
 @pytest.mark.parametrize("lines, expected_result", [
     (
             ["def test_function():", "    print('No imports')"],
@@ -90,10 +118,66 @@ def test_move_imports_to_start(lines, expected_result):
     assert actual_lines == expected_result
 
 
-@patch('sys.stdout', new_callable=StringIO)
-def test_move_imports_to_start_unparsable_code(mock_stdout):
+@pytest.mark.parametrize("lines, expected_result", [
+    # module docstring and comments stay above the imports
+    (
+            ['#!/usr/bin/env python', '"""Module', 'docstring"""', "",
+             "x = 1", "import os"],
+            ['#!/usr/bin/env python', '"""Module', 'docstring"""', "",
+             "import os", "x = 1"]
+    ),
+    # __future__ imports come first
+    (
+            ['"""Docstring"""', "import os",
+             "from __future__ import annotations", "x = 1"],
+            ['"""Docstring"""', "from __future__ import annotations",
+             "import os", "x = 1"]
+    ),
+    # TYPE_CHECKING blocks with only imports follow the imports
+    (
+            ["from typing import TYPE_CHECKING", "if TYPE_CHECKING:",
+             "    import numpy", "x = 1", "import os"],
+            ["from typing import TYPE_CHECKING", "import os",
+             "if TYPE_CHECKING:", "    import numpy", "x = 1"]
+    ),
+    # so do typing.TYPE_CHECKING blocks
+    (
+            ["x = 1", "if typing.TYPE_CHECKING:", "    import numpy",
+             "import typing"],
+            ["import typing", "if typing.TYPE_CHECKING:", "    import numpy",
+             "x = 1"]
+    ),
+    # TYPE_CHECKING that isn't imported stays below its assignment
+    (
+            ["TYPE_CHECKING = False", "if TYPE_CHECKING:", "    import os",
+             "x = 1"],
+            ["TYPE_CHECKING = False", "if TYPE_CHECKING:", "    import os",
+             "x = 1"]
+    ),
+    # TYPE_CHECKING blocks with other statements stay where they are
+    (
+            ["x = 1", "if TYPE_CHECKING:", "    import numpy", "    y = 2",
+             "import os"],
+            ["import os", "x = 1", "if TYPE_CHECKING:", "    import numpy",
+             "    y = 2"]
+    ),
+    # multi-line imports and lines with several statements
+    (
+            ["x = 1", "from os import (", "    path,", ")",
+             "import sys; y = 2"],
+            ["from os import (", "    path,", ")", "x = 1",
+             "import sys; y = 2"]
+    ),
+])
+def test_move_imports_to_start_placement(lines, expected_result):
+    actual_lines = pep8.move_imports_to_start(lines)
+
+    assert actual_lines == expected_result
+
+
+def test_move_imports_to_start_unparsable_code(caplog):
     # ast can't parse the code so the function returns the unchanged lines
-    # and prints the error
+    # and logs the error
 
     lines = ["def test_function():",
              "import numpy",
@@ -102,8 +186,10 @@ def test_move_imports_to_start_unparsable_code(mock_stdout):
     actual_lines = pep8.move_imports_to_start(lines)
 
     assert actual_lines == lines
-    assert mock_stdout.getvalue() == ("Error parsing code: expected an "
-                                      "indented block (<unknown>, line 2)\n")
+    assert len(caplog.records) == 1
+    assert caplog.records[0].levelname == "WARNING"
+    assert caplog.messages[0].startswith("Error parsing code: expected an "
+                                         "indented block")
 
 
 @pytest.fixture
@@ -184,6 +270,61 @@ def test_format_newlines_between_methods(example_code):
     assert formatted_lines == expected_lines
 
 
+def test_format_newlines_async_and_nested_classes():
+    lines = [
+        "import os",
+        "async def fetch():",
+        "    pass",
+        "class Outer:",
+        "    class Inner:",
+        "        async def method(self):",
+        "            pass",
+        "        @property",
+        "",
+        "        def prop(self):",
+        "            pass",
+        "    def method(self):",
+        "        pass",
+    ]
+    expected_lines = [
+        "import os",
+        "",
+        "",
+        "async def fetch():",
+        "    pass",
+        "",
+        "",
+        "class Outer:",
+        "",
+        "    class Inner:",
+        "",
+        "        async def method(self):",
+        "            pass",
+        "",
+        "        @property",
+        "        def prop(self):",
+        "            pass",
+        "",
+        "    def method(self):",
+        "        pass",
+    ]
+
+    formatted_lines = pep8.format_newlines(lines)
+
+    assert formatted_lines == expected_lines
+
+
+def test_format_newlines_keeps_blank_lines_inside_decorators():
+    lines = ["@decorator('''", "a", "", "b", "''')", "", "@other(", "",
+             "    1)", "", "def f():", "    pass"]
+    expected_lines = ["@decorator('''", "a", "", "b", "''')", "@other(", "",
+                      "    1)", "def f():", "    pass"]
+
+    formatted_lines = pep8.format_newlines(lines)
+
+    assert formatted_lines == expected_lines
+
+
 def test_split_long_comments():
     input_lines = [
         "This is a normal line",
@@ -211,6 +352,107 @@ def test_split_long_comments():
     assert actual_lines == expected_lines
 
 
+LONG_TEXT = " ".join(["word"] * 20)
+
+
+@pytest.mark.parametrize("input_lines, expected_lines", [
+    # short comments are left as they are
+    (
+            ["# first", "#second", "x = 1"],
+            ["# first", "#second", "x = 1"]
+    ),
+    # blocks end when the indent changes and keep their indent at the end
+    # of the file
+    (
+            ["# " + LONG_TEXT, "if x:", "    # " + LONG_TEXT,
+             "    # short", "# end"],
+            ["# " + " ".join(["word"] * 15), "# " + " ".join(["word"] * 5),
+             "if x:", "    # " + " ".join(["word"] * 14),
+             "    # " + " ".join(["word"] * 6) + " short", "# end"]
+    ),
+    # empty comment lines separate paragraphs
+    (
+            ["# " + LONG_TEXT, "#", "# short"],
+            ["# " + " ".join(["word"] * 15), "# " + " ".join(["word"] * 5),
+             "#", "# short"]
+    ),
+    # the shebang, the encoding declaration and pragmas are kept
+    (
+            ["#!/usr/bin/env python", "# -*- coding: utf-8 -*-",
+             "# " + LONG_TEXT, "# fmt: off", "# noqa"],
+            ["#!/usr/bin/env python", "# -*- coding: utf-8 -*-",
+             "# " + " ".join(["word"] * 15), "# " + " ".join(["word"] * 5),
+             "# fmt: off", "# noqa"]
+    ),
+    # long trailing comments are moved above their line
+    (
+            ["    x = '#'  # " + LONG_TEXT],
+            ["    # " + " ".join(["word"] * 14),
+             "    # " + " ".join(["word"] * 6), "    x = '#'"]
+    ),
+    (
+            ["x = 1  # type: " + LONG_TEXT],
+            ["x = 1  # type: " + LONG_TEXT]
+    ),
+    # docstrings are refilled, lists and examples are kept
+    (
+            ["def f():", '    """Summary.', "", "    " + LONG_TEXT,
+             "    word", "", "    - " + LONG_TEXT, "        " + LONG_TEXT,
+             '    """'],
+            ["def f():", '    """Summary.', "", "    " + " ".join(
+                ["word"] * 15), "    " + " ".join(["word"] * 6), "",
+             "    - " + LONG_TEXT, "        " + LONG_TEXT, '    """']
+    ),
+    # numpy and Google section headers end paragraphs
+    (
+            ["def f(x):", '    """Summary.', "", "    Parameters",
+             "    ----------", "    x : " + LONG_TEXT, "    Returns:",
+             "    " + LONG_TEXT, '    """'],
+            ["def f(x):", '    """Summary.', "", "    Parameters",
+             "    ----------", "    x : " + " ".join(["word"] * 14),
+             "    " + " ".join(["word"] * 6), "    Returns:",
+             "    " + " ".join(["word"] * 15), "    " + " ".join(
+                 ["word"] * 5), '    """']
+    ),
+    # docstrings joined from several literals are left alone
+    (
+            ["def f():", '    """Summary.', "", "    " + LONG_TEXT,
+             '    """', "def g():", '    "Summary. " \\',
+             '    "' + LONG_TEXT + '" \\', '    "end"'],
+            ["def f():", '    """Summary.', "", "    " + " ".join(
+                ["word"] * 15), "    " + " ".join(["word"] * 5), '    """',
+             "def g():", '    "Summary. " \\', '    "' + LONG_TEXT + '" \\',
+             '    "end"']
+    ),
+    # lines that are too long but a single word are left alone
+    (
+            ["# see", "# https://example.com/" + "a" * 80, "# for more"],
+            ["# see", "# https://example.com/" + "a" * 80, "# for more"]
+    ),
+])
+def test_split_long_comments_blocks(input_lines, expected_lines):
+    actual_lines = pep8.split_long_comments(input_lines)
+
+    assert actual_lines == expected_lines
+
+
+def test_apply_rules_twice_changes_nothing():
+    lines = ["import os", "x = 1",
+             "def f(a):  # a trailing comment that is much too long to "
+             "stay on the line of its def",
+             '    """Summary.', "",
+             "    Parameters", "    ----------",
+             "    a : int   with   runs   of   whitespace " + LONG_TEXT,
+             '    """',
+             "    # see", "    # https://example.com/" + "a" * 80,
+             "    #   runs   of   whitespace " + LONG_TEXT,
+             "    return a"]
+
+    once = pep8.apply_rules(lines)
+
+    assert pep8.apply_rules(once) == once
+
+
 @pytest.mark.parametrize("input_lines, expected_lines", [
     ([], []),
     (["", "", "", ""], []),
@@ -292,3 +534,145 @@ def test_replace_tabs(line, idx, expected):
     actual = pep8.replace_tabs(line, idx)
 
     assert actual == expected
+
+
+def test_format_source_parses_once():
+    lines = ["import os, sys", "x = 1", "import numpy", "",
+             "class MyClass:", "    def __init__(self):", "        pass",
+             "    def method1(self):", "        pass",
+             "@decorator", "def f():", "    pass"]
+    expected_lines = ["import os", "import sys", "import numpy", "x = 1",
+                      "", "", "class MyClass:", "",
+                      "    def __init__(self):", "        pass", "",
+                      "    def method1(self):", "        pass", "", "",
+                      "@decorator", "def f():", "    pass"]
+
+    source = pep8.format_source(lines)
+
+    assert source.parse_count == 1
+    assert source.lines == expected_lines
+
+
+def test_format_source_matches_separate_rules(example_code):
+    example_code = ["\timport os, sys", "def f():", "\treturn 1",
+                    "import numpy"] + example_code
+    lines = pep8.find_code(list(example_code), pep8.replace_tabs)
+    lines = pep8.move_imports_to_start(lines)
+    lines = pep8.split_imports(lines)
+    lines = pep8.format_newlines(lines)
+    lines = pep8.remove_trailing_newlines(lines)
+    expected_lines = pep8.split_long_comments(lines)
+
+    actual_lines = pep8.apply_rules(list(example_code))
+
+    assert actual_lines == expected_lines
+
+
+def test_source_file_reparses_after_unmapped_update():
+    source = pep8.SourceFile(["x = 1"])
+    assert source.tree is not None
+
+    source.update(["y = 2", "x = 1"], [None, 0])
+    assert source.tree is not None
+    assert source.index_of(1) == 1
+    assert source.parse_count == 1
+
+    source.update(["x = 1"])
+    assert source.tree is not None
+    assert source.parse_count == 2
+
+
+@pytest.mark.parametrize("input_lines, expected_output", [
+    # f-string with an escaped quote
+    (
+            ['x = f"a\\"\t" # comment\t'],
+            ['x = f"a\\"\t" # comment\t']
+    ),
+    # triple quoted string starting in the middle of a line
+    (
+            ["x = '''first\t", "\tsecond''' +\t1"],
+            ["x = '''first\t", "\tsecond''' +    1"]
+    ),
+    # string prefixes
+    (
+            ["x = rb'\t'\t+ Rb'\t'"],
+            ["x = rb'\t'    + Rb'\t'"]
+    ),
+])
+def test_find_code_strings(input_lines, expected_output):
+    modified_lines = pep8.find_code(input_lines, pep8.replace_tabs)
+
+    assert modified_lines == expected_output
+
+
+def test_scan():
+    lines = ["x = '''a", "b''' # c", "", "y = f'z'"]
+    expected_spans = [
+        [("code", 0, 4), ("string", 4, 8)],
+        [("string", 0, 4), ("code", 4, 5), ("comment", 5, 8)],
+        [],
+        [("code", 0, 4), ("string", 4, 8)],
+    ]
+
+    assert pep8.scan(lines) == expected_spans
+
+
+def test_schedule_default_order():
+    assert [name for name, rule in pep8.RULES] == [
+        "replace_tabs", "move_imports_to_start", "split_imports",
+        "format_newlines", "remove_trailing_newlines", "split_long_comments"]
+
+
+def test_schedule_merges_line_local_rules(monkeypatch):
+    def double_quotes(source, line, spans):
+        return line.replace("'", '"'), spans
+
+    monkeypatch.setitem(pep8.REGISTRY, "double_quotes", pep8.Rule(
+        "double_quotes", double_quotes, needs=(), invalidates=(),
+        line_local=True))
+    pep8.schedule.cache_clear()
+    try:
+        passes = pep8.schedule(("split_imports", "double_quotes",
+                                "replace_tabs"))
+    finally:
+        monkeypatch.undo()
+        pep8.schedule.cache_clear()
+
+    assert [name for name, rule in passes] == ["double_quotes+replace_tabs",
+                                               "split_imports"]
+    source = pep8.SourceFile(["\tx = 'a'", "import os, sys"])
+    for name, rule in passes:
+        rule(source)
+    assert source.lines == ['    x = "a"', "import os", "import sys"]
+
+
+def test_format_source_selected_rules():
+    lines = ["import os, sys", "\tx = 1", "", ""]
+
+    source = pep8.format_source(list(lines), rules=pep8.select_rules(
+        ignore=["split_imports", "remove_trailing_newlines"]))
+
+    assert source.lines == ["import os, sys", "    x = 1", "", ""]
+
+
+@pytest.mark.parametrize("select, ignore", [
+    (["replace_tabs", "sort_imports"], []),
+    (None, ["sort_imports"]),
+])
+def test_select_rules_unknown(select, ignore):
+    with pytest.raises(ValueError, match="Unknown rule: sort_imports"):
+        pep8.select_rules(select, ignore)
+
+
+def test_format_source_scans_once():
+    lines = ["x = 1\t# a comment that is long enough to be moved above the "
+             "line it is on, and then some", "def f():", "\treturn 1",
+             "import os"]
+
+    source = pep8.format_source(lines)
+
+    assert source.scan_count == 1
+    assert source.lines == [
+        "import os", "# a comment that is long enough to be moved above the "
+        "line it is on, and then", "# some", "x = 1", "", "", "def f():",
+        "    return 1"]
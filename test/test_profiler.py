@@ -0,0 +1,55 @@
+import json
+import pytest
+
+from src import pep8
+from src import profiler
+
+
+@pytest.fixture
+def file_profiler():
+    file_profiler = profiler.Profiler("test.py")
+    pep8.format_source(["x = 1", "import os, sys", "def f():", "\tpass"],
+                       file_profiler)
+    return file_profiler
+
+
+def test_records_every_rule(file_profiler):
+    records = {record["rule"]: record for record in file_profiler.records}
+
+    assert list(records) == [name for name, rule in pep8.RULES]
+    assert all(record["file"] == "test.py" for record in records.values())
+    assert records["split_imports"]["lines_in"] == 4
+    assert records["split_imports"]["lines_out"] == 5
+    assert records["split_imports"]["edits"] == 3
+    assert records["move_imports_to_start"]["edits"] == 0
+    assert records["replace_tabs"]["edits"] == 2
+    assert all(record["seconds"] >= 0 for record in records.values())
+
+
+def test_format_source_without_profiler_matches():
+    lines = ["x = 1", "import os, sys", "def f():", "\tpass"]
+
+    assert (pep8.format_source(list(lines)).lines
+            == pep8.format_source(list(lines), profiler.Profiler()).lines)
+
+
+def test_exports(file_profiler):
+    report = file_profiler.report()
+    exported = json.loads(file_profiler.to_json())
+    prometheus = file_profiler.to_prometheus()
+
+    assert "Slowest files" in report and "split_imports" in report
+    assert len(exported["records"]) == len(pep8.RULES)
+    assert exported["rules"]["split_imports"]["edits"] == 3
+    assert "pep8_files_total 1\n" in prometheus
+    assert 'pep8_rule_edits_total{rule="split_imports"} 3\n' in prometheus
+
+
+@pytest.mark.parametrize("before, after, expected", [
+    (["a", "b"], ["a", "b"], 0),
+    (["a", "b"], ["b", "a"], 0),
+    (["a", "b"], ["a", "c"], 2),
+    (["a"], ["a", "", ""], 2),
+])
+def test_count_edits(before, after, expected):
+    assert profiler.count_edits(before, after) == expected
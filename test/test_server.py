@@ -0,0 +1,134 @@
+import asyncio
+import json
+import os
+import tempfile
+import time
+import pytest
+
+from src import server
+
+
+def test_format_text():
+    # when
+    formatted, edits = server.format_text("x = 1\r\nimport os, sys  \r\n")
+
+    # then
+    assert formatted == "import os\r\nimport sys\r\nx = 1\r\n"
+    assert edits == [{"start": 0, "end": 0, "lines": ["import os",
+                                                       "import sys"]},
+                     {"start": 1, "end": 2, "lines": []}]
+
+
+def request(method, request_id=1, **params):
+    return json.dumps({"jsonrpc": "2.0", "id": request_id, "method": method,
+                       "params": params})
+
+
+@pytest.mark.parametrize("message, code", [
+    ("not json", server.PARSE_ERROR),
+    ("[1, 2]", server.INVALID_REQUEST),
+    (request("lint", source=""), server.METHOD_NOT_FOUND),
+    (request("format", source=1), server.INVALID_PARAMS),
+    (request("format", source="x = 1\n"), server.TIMEOUT),
+])
+def test_handle_errors(message, code):
+    async def handle():
+        formatter = server.Server(jobs=1, timeout=0)
+        try:
+            return await formatter.handle(message)
+        finally:
+            formatter.close()
+
+    # when
+    response = asyncio.run(handle())
+
+    # then
+    assert response["error"]["code"] == code
+
+
+def test_serve_socket():
+    async def format_over_socket(path):
+        serving = asyncio.ensure_future(server.serve_socket(path, jobs=2))
+        while not os.path.exists(path):
+            await asyncio.sleep(0.01)
+        reader, writer = await asyncio.open_unix_connection(path)
+        for request_id in range(3):
+            writer.write(request("format", request_id,
+                                 source=f"import os, sys\nx = {request_id}\n"
+                                 ).encode() + b"\n")
+        # a notification gets no response
+        writer.write(request("format", None, source="").replace(
+            '"id": null, ', "").encode() + b"\n")
+        await writer.drain()
+        responses = [json.loads(await reader.readline()) for _ in range(3)]
+        writer.close()
+        serving.cancel()
+        try:
+            await serving
+        except asyncio.CancelledError:
+            pass
+        return responses
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # when
+        responses = asyncio.run(format_over_socket(
+            os.path.join(tmp_dir, "pep8.sock")))
+
+    # then
+    results = {response["id"]: response["result"]["source"]
+               for response in responses}
+    assert results == {request_id: f"import os\nimport sys\nx = {request_id}\n"
+                       for request_id in range(3)}
+
+
+def slow_format_text(source):
+    if source == "slow":
+        time.sleep(60)
+    return "formatted", []
+
+
+def test_slow_request_doesnt_hold_up_the_next_one(monkeypatch):
+    # given
+    # the worker processes are forked after the patch
+    monkeypatch.setattr(server, "format_text", slow_format_text)
+
+    async def handle():
+        formatter = server.Server(jobs=1, timeout=0.5)
+        try:
+            slow = await formatter.handle(request("format", 1, source="slow"))
+            fast = await formatter.handle(request("format", 2, source="x"))
+            return slow, fast
+        finally:
+            formatter.close()
+
+    # when
+    start = time.perf_counter()
+    slow, fast = asyncio.run(handle())
+
+    # then
+    assert slow["error"]["code"] == server.TIMEOUT
+    assert fast["result"]["source"] == "formatted"
+    assert time.perf_counter() - start < 5
+
+
+def test_waiting_request_gets_the_place_of_a_timed_out_worker(monkeypatch):
+    # given
+    monkeypatch.setattr(server, "format_text", slow_format_text)
+
+    async def handle():
+        formatter = server.Server(jobs=1, timeout=2)
+        try:
+            slow = asyncio.ensure_future(
+                formatter.handle(request("format", 1, source="slow")))
+            await asyncio.sleep(1)
+            fast = await formatter.handle(request("format", 2, source="x"))
+            return await slow, fast
+        finally:
+            formatter.close()
+
+    # when
+    slow, fast = asyncio.run(handle())
+
+    # then
+    assert slow["error"]["code"] == server.TIMEOUT
+    assert fast["result"]["source"] == "formatted"
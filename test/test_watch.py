@@ -0,0 +1,86 @@
+import os
+import sys
+import tempfile
+import threading
+import pytest
+
+from src import watch
+
+
+@pytest.fixture
+def folder():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        with open(os.path.join(tmp_dir, "a.py"), "w") as f:
+            f.write("x = 1\n")
+        yield tmp_dir
+
+
+def write_later(*files):
+    def write():
+        for file in files:
+            os.makedirs(os.path.dirname(file), exist_ok=True)
+            with open(file, "w") as f:
+                f.write("y = 2\n")
+    timer = threading.Timer(0.1, write)
+    timer.start()
+    return timer
+
+
+@pytest.mark.parametrize("polling", [
+    True,
+    pytest.param(False, marks=pytest.mark.skipif(
+        not sys.platform.startswith("linux"), reason="needs inotify")),
+])
+def test_watcher_batches(folder, polling):
+    # given
+    a = os.path.join(folder, "a.py")
+    b = os.path.join(folder, "sub", "b.py")
+    txt = os.path.join(folder, "notes.txt")
+
+    with watch.Watcher(folder, poll_interval=0.05, debounce=0.2,
+                       polling=polling) as watcher:
+        assert watcher.polling == polling
+        write_later(a, b, txt)
+
+        # when
+        batch = next(watcher.batches())
+
+    # then
+    assert batch == [a, b]
+
+
+def test_watcher_skips_handled_files(folder):
+    # given
+    a = os.path.join(folder, "a.py")
+    b = os.path.join(folder, "b.py")
+
+    with watch.Watcher(folder, poll_interval=0.05, debounce=0.1,
+                       polling=True) as watcher:
+        batches = watcher.batches()
+        write_later(a)
+        assert next(batches) == [a]
+
+        # when
+        with open(a, "w") as f:
+            f.write("formatted = True\n")
+        write_later(b)
+        batch = next(batches)
+
+    # then
+    assert batch == [b]
+
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"),
+                    reason="needs inotify")
+def test_inotify_reports_new_empty_folders(folder):
+    # given
+    with watch.Watcher(folder, polling=False) as watcher:
+        os.makedirs(os.path.join(folder, "sub"))
+
+        # when
+        changed = watcher._source.changes(1.0)
+        quiet = watcher._source.changes(0.05)
+
+    # then
+    assert changed == set()
+    assert quiet is None